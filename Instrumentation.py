@@ -0,0 +1,203 @@
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+# Timings are bucketed by powers of 2 of microseconds: bucket i holds durations below 2**i us
+NUM_BUCKETS = 32
+
+# (class, method name, metric name) of the instrumented methods
+_registry: List[tuple] = []
+# (class, method name): original class attribute, while instrumentation is enabled
+_originals: Dict[tuple, object] = {}
+_lock = threading.Lock()
+_enabled = False
+
+
+class Histogram:
+    def __init__(self):
+        ''' Distribution of durations [s] in log2 buckets, see NUM_BUCKETS '''
+        self.count: int = 0
+        self.total: float = 0.
+        self.min: float = None
+        self.max: float = None
+        self.buckets: List[int] = [0] * NUM_BUCKETS
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        # frexp exponent: smallest i with value < 2**i
+        bucket = math.frexp(seconds * 1e6)[1] if seconds > 0 else 0
+        self.buckets[min(max(bucket, 0), NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, q: float):
+        ''' Upper bound [s] of the bucket holding the q-th percentile, 0 <= q <= 100 '''
+        if not self.count:
+            return None
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                return min(2 ** i * 1e-6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_s': self.total / self.count if self.count else None,
+            'min_s': self.min,
+            'max_s': self.max,
+            'p50_s': self.percentile(50),
+            'p90_s': self.percentile(90),
+            'p99_s': self.percentile(99),
+            # upper bound [s]: number of durations, non empty buckets only
+            'buckets': {str(2 ** i * 1e-6): n for i, n in enumerate(self.buckets) if n}
+        }
+
+
+# metric name: Histogram
+timers: Dict[str, Histogram] = {}
+# counter name: value
+counters: Dict[str, int] = {}
+
+
+def record(name: str, seconds: float):
+    ''' Adds a duration to a timer '''
+    with _lock:
+        if name not in timers:
+            timers[name] = Histogram()
+        timers[name].add(seconds)
+
+
+def count(name: str, n: int = 1):
+    ''' Increments a counter; does nothing when instrumentation is disabled '''
+    if not _enabled:
+        return
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+@contextmanager
+def timer(name: str):
+    ''' Times a block of code, e.g. a stage of an import; only recorded when enabled '''
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def _timed(func, name: str):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _wrap(cls, method: str, name: str):
+    original = cls.__dict__[method]
+    _originals[(cls, method)] = original
+    if isinstance(original, staticmethod):
+        setattr(cls, method, staticmethod(_timed(original.__func__, name)))
+    elif isinstance(original, classmethod):
+        setattr(cls, method, classmethod(_timed(original.__func__, name)))
+    else:
+        setattr(cls, method, _timed(original, name))
+
+
+def register(cls, methods: List[str]):
+    '''
+    Declares methods of a class to time, under the metric name 'Class.method'. The methods are replaced by
+    timed wrappers only while instrumentation is enabled, so disabled instrumentation adds no cost to them
+    :param cls: class defining the methods
+    :param methods: names of methods defined in the class itself, not inherited
+    '''
+    for method in methods:
+        assert method in cls.__dict__, f'Method not defined in {cls.__name__}: {method}'
+        entry = (cls, method, f'{cls.__name__}.{method}')
+        if entry in _registry:
+            continue
+        _registry.append(entry)
+        if _enabled:
+            _wrap(*entry)
+
+
+def enable():
+    ''' Starts timing the registered methods. Timings of processes started by a process pool are not collected '''
+    global _enabled
+    if _enabled:
+        return
+    for entry in _registry:
+        _wrap(*entry)
+    _enabled = True
+
+
+def disable():
+    ''' Restores the original methods; collected metrics are kept until reset '''
+    global _enabled
+    for (cls, method), original in _originals.items():
+        setattr(cls, method, original)
+    _originals.clear()
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        timers.clear()
+        counters.clear()
+
+
+def snapshot():
+    '''
+    :return: dict {'enabled', 'timers': {name: Histogram.to_dict}, 'counters': {name: value}}
+    '''
+    with _lock:
+        return {
+            'enabled': _enabled,
+            'timers': {name: timers[name].to_dict() for name in sorted(timers)},
+            'counters': dict(sorted(counters.items()))
+        }
+
+
+def to_json(path: str = None):
+    '''
+    :param path: file to write the snapshot to
+    :return: the snapshot as a json string
+    '''
+    text = json.dumps(snapshot(), indent=1)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+
+def summary():
+    '''
+    Timers sorted by total time, to see which stage dominates. The time of a timed method called by another
+    one is included in both totals
+    :return: list of (name, count, total [s], share of the timed total)
+    '''
+    with _lock:
+        items = [(name, h.count, h.total) for name, h in timers.items()]
+    grand_total = sum(x[2] for x in items)
+    return [(name, n, total, total / grand_total if grand_total else None)
+            for name, n, total in sorted(items, key=lambda x: -x[2])]
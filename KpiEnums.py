@@ -33,4 +33,11 @@ class RibaStages(enum.Enum):
 class DevelopmentTypes(enum.Enum):
     RESIDENTIAL = enum.auto()
     COMMERCIAL = enum.auto()
-    MASTERPLAN = enum.auto()
\ No newline at end of file
+    MASTERPLAN = enum.auto()
+
+
+class NormalisationTypes(enum.Enum):
+    LINEAR = enum.auto()
+    PRACTICE = enum.auto()
+    LOGISTIC = enum.auto()
+    STEPWISE = enum.auto()
@@ -0,0 +1,100 @@
+import numpy as np
+
+from KpiEnums import NormalisationTypes
+
+# Normalisation strategies map raw KPI scores to the standard 0-100 range.
+# All strategies take numpy arrays (one element per raw score) and return unrounded float arrays,
+# rounding is applied in normalise()
+
+
+def normalise_linear(vals: np.ndarray, lower_bound: np.ndarray, upper_bound: np.ndarray,
+                     good_practice: np.ndarray, leading_practice: np.ndarray):
+    ''' Min-max normalisation over the evaluation range, clipped to 0-100 '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = 100. * (vals - lower_bound) / (upper_bound - lower_bound)
+    # an empty range would be clipped to 0 or 100 from +-inf, it is left undefined instead
+    return np.where(upper_bound == lower_bound, np.nan, np.clip(norm, 0., 100.))
+
+
+def normalise_practice(vals: np.ndarray, lower_bound: np.ndarray, upper_bound: np.ndarray,
+                       good_practice: np.ndarray, leading_practice: np.ndarray):
+    ''' Piecewise-linear curve: 0-50 below good practice, 50-100 between good and leading practice '''
+    norm = np.full(vals.shape, 100.)
+    below_gp = vals < good_practice
+    between = (good_practice < vals) & (vals <= leading_practice)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = np.where(below_gp, vals * 50. / good_practice, norm)
+        norm = np.where(between, 50. + 50. * ((leading_practice - vals) / (leading_practice - good_practice)),
+                        norm)
+    return norm
+
+
+def normalise_logistic(vals: np.ndarray, lower_bound: np.ndarray, upper_bound: np.ndarray,
+                       good_practice: np.ndarray, leading_practice: np.ndarray):
+    '''
+    Logistic curve centred at good practice (50), reaching ~88 at leading practice.
+    When the thresholds coincide, the width is taken from the evaluation range instead
+    '''
+    width = leading_practice - good_practice
+    range_width = (upper_bound - lower_bound) / 4.
+    width = np.where(width > 0, width, np.where(np.isfinite(range_width) & (range_width > 0), range_width, 1.))
+    return 100. / (1. + np.exp(-2. * (vals - good_practice) / width))
+
+
+def normalise_stepwise(vals: np.ndarray, lower_bound: np.ndarray, upper_bound: np.ndarray,
+                       good_practice: np.ndarray, leading_practice: np.ndarray):
+    ''' Steps following the KPI status: 0 - needs improvement, 50 - good practice, 100 - leading practice '''
+    return np.where(vals >= leading_practice, 100., np.where(vals >= good_practice, 50., 0.))
+
+
+# NormalisationTypes: (function, required arguments)
+NORMALISATION_STRATEGIES = {
+    NormalisationTypes.LINEAR: (normalise_linear, ['lower_bound', 'upper_bound']),
+    NormalisationTypes.PRACTICE: (normalise_practice, ['good_practice', 'leading_practice']),
+    NormalisationTypes.LOGISTIC: (normalise_logistic, ['good_practice', 'leading_practice']),
+    NormalisationTypes.STEPWISE: (normalise_stepwise, ['good_practice', 'leading_practice']),
+}
+
+
+def register_strategy(normalisation: NormalisationTypes, function, required_args: list):
+    '''
+    Registers or replaces the function used for a normalisation type
+    :param normalisation: NormalisationTypes the function is used for
+    :param function: f(vals, lower_bound, upper_bound, good_practice, leading_practice) -> np.ndarray
+    :param required_args: names of the arguments that cannot be None
+    :return: Nothing
+    '''
+    NORMALISATION_STRATEGIES[normalisation] = (function, required_args)
+
+
+def normalise(normalisation: NormalisationTypes, vals, lower_bound=None, upper_bound=None,
+              good_practice=None, leading_practice=None):
+    '''
+    Applies the selected strategy to one or many raw scores. Arguments can be scalars or arrays of the same
+    length as vals; None arguments are passed as NaN
+    :return: np.ndarray of int, normalised scores
+    :raises ZeroDivisionError: if the strategy is undefined for any of the scores
+    '''
+    assert normalisation in NORMALISATION_STRATEGIES, f'Unknown normalisation strategy: {normalisation}'
+    function, _ = NORMALISATION_STRATEGIES[normalisation]
+
+    def as_array(x):
+        if x is None:
+            return np.nan
+        if isinstance(x, (list, tuple)):
+            x = [np.nan if v is None else v for v in x]
+        return np.asarray(x, dtype=np.float64)
+
+    vals = np.atleast_1d(np.asarray(vals, dtype=np.float64))
+    norm = function(vals, as_array(lower_bound), as_array(upper_bound),
+                    as_array(good_practice), as_array(leading_practice))
+
+    # e.g. a linear range with equal bounds or good practice at 0, which the scalar normalisation divided by
+    undefined = ~np.isfinite(norm)
+    if undefined.any():
+        raise ZeroDivisionError(f'{normalisation} normalisation is undefined for the raw score '
+                                f'{vals[undefined][0]} with the given thresholds and bounds')
+
+    # int() truncates towards zero, keep the same rounding as the original scalar normalisation
+    return np.trunc(norm + 0.5).astype(np.int64)
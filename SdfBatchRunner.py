@@ -0,0 +1,311 @@
+import math
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+import numpy as np
+
+from SdfKpi import error_message
+from SdfProject import SdfProject
+from SdfResultTable import SdfResultTable
+from KpiEnums import KpiTypes, DevelopmentTypes, RibaStages, NormalisationTypes
+
+QUESTION_TYPES = [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]
+# Chunks per worker process when no chunk size is given, so a slow chunk does not leave the other workers idle
+CHUNKS_PER_PROCESS = 4
+# Keys of the vals of a NUMBERS_SET KPI whose func cannot be pickled: its raw score is calculated before encoding
+_RAW = 'raw'
+_ERROR = 'error'
+# reply of a question without one, encoded as -1
+_MISSING = object()
+
+# (project_identifier, SdfProject) of the run, set in forked worker processes when they start, see _inherit
+_projects: list = None
+
+
+def default_context():
+    '''
+    Start method of the worker processes: fork when no other thread is running, the workers then inherit the
+    projects. Forking would copy the locks held by other threads, the workers are then started by a fork server,
+    or spawned
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _inherit(projects: list):
+    ''' Initializer of the forked worker processes, projects is inherited rather than pickled '''
+    global _projects
+    _projects = projects
+
+
+def _precomputed(vals: dict):
+    ''' func of a NUMBERS_SET KPI evaluated before encoding '''
+    assert _ERROR not in vals, vals.get(_ERROR)
+    return vals[_RAW]
+
+
+class _Encoder:
+    def __init__(self):
+        '''
+        Compact form of projects sent to the worker processes. Question texts, reply options and replies are
+        interned in one list of strings, questions with their option scores are interned as well, and
+        everything about a KPI except its input values (type, thresholds, stages, questions) is interned as a
+        template, since the same KPI definitions are shared by most projects. A project is then a few arrays:
+        KPI identifier codes, template ids and the string codes of all its replies
+        '''
+        # value: code, codes are positions in the lists
+        self._string_codes: dict = {}
+        self.strings: list = []
+        self._kpi_codes: dict = {}
+        self.kpis: list = []
+        # (question, ((option, score), ...)): position in questions
+        self._question_ids: dict = {}
+        # (question string code, option string codes, option scores)
+        self.questions: list = []
+        # template key, see encode: position in templates
+        self._template_ids: dict = {}
+        # (type, normalisation, dev types, RIBA stages as enum values, good practice, leading practice,
+        # upper bound, lower bound, reporting only, question ids or None)
+        self.templates: list = []
+        # id(func): func if it can be pickled, None otherwise
+        self._funcs: dict = {}
+
+    def _string(self, value):
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _question(self, question: str, options: tuple):
+        key = (question, options)
+        question_id = self._question_ids.get(key)
+        if question_id is None:
+            question_id = self._question_ids[key] = len(self.questions)
+            self.questions.append((self._string(question), tuple(self._string(x[0]) for x in options),
+                                   tuple(x[1] for x in options)))
+        return question_id
+
+    def _template(self, kpi, question_ids: tuple):
+        # enum members are singletons, keying on their ids avoids hashing them; values only for new templates
+        key = (id(kpi._type), id(kpi._normalisation), tuple(map(id, kpi._development_types)),
+               tuple(map(id, kpi._riba_stages)), kpi._good_practice_thr, kpi._leading_practice_thr,
+               kpi._upper_bound, kpi._lower_bound, kpi._reporting_only, question_ids)
+        template_id = self._template_ids.get(key)
+        if template_id is None:
+            template_id = self._template_ids[key] = len(self.templates)
+            self.templates.append((kpi._type.value, kpi._normalisation.value,
+                                   tuple(x.value for x in kpi._development_types),
+                                   tuple(x.value for x in kpi._riba_stages)) + key[4:])
+        return template_id
+
+    def _func(self, func):
+        if id(func) not in self._funcs:
+            try:
+                pickle.dumps(func)
+                self._funcs[id(func)] = func
+            except (pickle.PicklingError, AttributeError, TypeError):
+                self._funcs[id(func)] = None
+        return self._funcs[id(func)]
+
+    def _numbers_set(self, input_args: dict):
+        func = self._func(input_args['func'])
+        if func is not None:
+            return input_args['vals'], func
+        # the error is kept for the KPI, as it would be by the evaluation of the project
+        try:
+            return {_RAW: input_args['func'](input_args['vals'])}, _precomputed
+        except Exception as e:
+            return {_ERROR: error_message(e)}, _precomputed
+
+    def encode(self, project_identifier: str, project: SdfProject):
+        '''
+        :return: (project_identifier, riba stage value, dev type value, KPI codes, template ids, reply codes,
+        values of the NUMBER and NUMBERS_SET KPIs), the KPIs and replies in the order of project.kpis
+        '''
+        kpi_codes = []
+        template_ids = []
+        replies = []
+        values = []
+        for kpi_identifier, kpi in project.kpis.items():
+            question_ids = None
+            if kpi._type in QUESTION_TYPES:
+                question_ids = []
+                for question, options in kpi._input_args['questions'].items():
+                    options = dict(options)
+                    reply = options.pop('reply', _MISSING)
+                    question_ids.append(self._question(question, tuple(options.items())))
+                    replies.append(-1 if reply is _MISSING else self._string(reply))
+                question_ids = tuple(question_ids)
+            elif kpi._type == KpiTypes.NUMBERS_SET:
+                values.append(self._numbers_set(kpi._input_args))
+            else:
+                values.append(kpi._input_args['val'])
+
+            template_ids.append(self._template(kpi, question_ids))
+            code = self._kpi_codes.get(kpi_identifier)
+            if code is None:
+                code = self._kpi_codes[kpi_identifier] = len(self.kpis)
+                self.kpis.append(kpi_identifier)
+            kpi_codes.append(code)
+
+        return (project_identifier, project.get_riba_stage().value, project.get_dev_type().value,
+                np.array(kpi_codes, dtype=np.int32), np.array(template_ids, dtype=np.int32),
+                np.array(replies, dtype=np.int32), values)
+
+
+def _decode(encoded: tuple, strings: list, kpis: list, questions: list, templates: list):
+    '''
+    :param questions: (question string, {option: score}) per question id, resolved from _Encoder.questions
+    :return: SdfProject built from the output of _Encoder.encode
+    '''
+    _, riba_stage, dev_type, kpi_codes, template_ids, replies, values = encoded
+    project = SdfProject(riba_stage=RibaStages(riba_stage), dev_type=DevelopmentTypes(dev_type))
+
+    replies = iter(replies.tolist())
+    values = iter(values)
+    for kpi_code, template_id in zip(kpi_codes.tolist(), template_ids.tolist()):
+        (kpi_type, normalisation, dev_types, riba_stages, good_practice, leading_practice, upper_bound, lower_bound,
+         reporting_only, question_ids) = templates[template_id]
+        kpi_type = KpiTypes(kpi_type)
+
+        if question_ids is not None:
+            input_args = {'questions': {}}
+            for question_id in question_ids:
+                question, options = questions[question_id]
+                reply = next(replies)
+                input_args['questions'][question] = dict(options) if reply < 0 else dict(options, reply=strings[reply])
+        elif kpi_type == KpiTypes.NUMBERS_SET:
+            vals, func = next(values)
+            input_args = {'vals': vals, 'func': func}
+        else:
+            input_args = {'val': next(values)}
+
+        project.add_kpi(kpi_identifier=kpis[kpi_code], kpi_type=kpi_type, input_args=input_args,
+                        development_types=[DevelopmentTypes(x) for x in dev_types],
+                        riba_stages=[RibaStages(x) for x in riba_stages], good_practice=good_practice,
+                        leading_practice=leading_practice, upper_bound_norm=upper_bound,
+                        lower_bound_norm=lower_bound, reporting_only=reporting_only,
+                        normalisation=NormalisationTypes(normalisation))
+
+    return project
+
+
+def _evaluate(table: SdfResultTable, failed: dict, project_identifier: str, project: SdfProject):
+    try:
+        results = project.evaluate_all()
+    except Exception as e:
+        failed[project_identifier] = f'{type(e).__name__}: {e}'
+        return
+    table.add_results(project_identifier, results)
+
+
+def _evaluate_chunk(args):
+    strings, kpis, questions, templates, chunk = args
+    questions = [(strings[question], {strings[x]: score for x, score in zip(names, scores)})
+                 for question, names, scores in questions]
+    table = SdfResultTable(capacity=sum(len(x[3]) for x in chunk))
+    failed = {}
+    for encoded in chunk:
+        try:
+            project = _decode(encoded, strings, kpis, questions, templates)
+        except Exception as e:
+            failed[encoded[0]] = f'{type(e).__name__}: {e}'
+            continue
+        _evaluate(table, failed, encoded[0], project)
+    return table, failed
+
+
+def _evaluate_inherited(args):
+    start, stop = args
+    table = SdfResultTable(capacity=sum(len(x[1].kpis) for x in _projects[start:stop]))
+    failed = {}
+    for project_identifier, project in _projects[start:stop]:
+        _evaluate(table, failed, project_identifier, project)
+    return table, failed
+
+
+class SdfBatchRunner:
+    def __init__(self, processes: int = None, chunk_size: int = None, mp_context=None):
+        '''
+        Evaluates all KPIs of many projects, e.g. to re-score a whole portfolio, across a process pool. The
+        projects are split in chunks of consecutive projects; each worker returns the results of a chunk as an
+        SdfResultTable, and the tables are concatenated in project order.
+        When worker processes are forked, they inherit the projects and only chunk bounds are sent. Otherwise
+        projects are sent in a compact encoding (see _Encoder), each chunk submitted as soon as it is encoded.
+        Either way the given SdfProject objects are not modified, the workers evaluate their own copies
+        :param processes: size of the process pool, None for the number of CPUs; 1 to evaluate the projects
+        in process, one after the other. The projects are then evaluated in place, as by
+        SdfProject.evaluate_all, which stores the scores and evaluation times in them; the same applies to a
+        single project
+        :param chunk_size: number of projects per chunk; by default the projects are split in
+        CHUNKS_PER_PROCESS chunks per process
+        :param mp_context: multiprocessing context or start method name of the worker processes, by default
+        chosen for each run by default_context
+        '''
+        self.processes: int = processes
+        self.chunk_size: int = chunk_size
+        self.mp_context = multiprocessing.get_context(mp_context) if isinstance(mp_context, str) else mp_context
+        # project_identifier: error message, for projects whose evaluation raised an exception
+        self.failed: Dict[str, str] = {}
+
+    def _num_processes(self):
+        return self.processes if self.processes is not None else os.cpu_count() or 1
+
+    def _submit_encoded(self, executor: ProcessPoolExecutor, projects: Dict[str, SdfProject], chunk_size: int):
+        encoder = _Encoder()
+        futures = []
+        chunk = []
+        for i, (project_identifier, project) in enumerate(projects.items()):
+            try:
+                chunk.append(encoder.encode(project_identifier, project))
+            except Exception as e:
+                self.failed[project_identifier] = f'{type(e).__name__}: {e}'
+            if chunk and (len(chunk) == chunk_size or i == len(projects) - 1):
+                # copies, the lists keep growing while the chunk is waiting to be pickled
+                futures.append(executor.submit(_evaluate_chunk, (tuple(encoder.strings), tuple(encoder.kpis),
+                                                                 tuple(encoder.questions),
+                                                                 tuple(encoder.templates), chunk)))
+                chunk = []
+        return futures
+
+    def run(self, projects: Dict[str, SdfProject]):
+        '''
+        :param projects: dict {project_identifier: SdfProject}, e.g. SdfPortfolio.projects
+        :return: SdfResultTable of the results of all projects, in the order of projects; projects whose
+        evaluation raised an exception are left out and listed in failed
+        '''
+        self.failed = {}
+        table = SdfResultTable(capacity=sum(len(x.kpis) for x in projects.values()))
+        processes = self._num_processes()
+        if processes == 1 or len(projects) < 2:
+            for project_identifier, project in projects.items():
+                _evaluate(table, self.failed, project_identifier, project)
+            return table
+
+        chunk_size = self.chunk_size or max(math.ceil(len(projects) / (processes * CHUNKS_PER_PROCESS)), 1)
+        context = self.mp_context or default_context()
+        if context.get_start_method() == 'fork':
+            items = list(projects.items())
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_inherit,
+                                     initargs=(items,)) as executor:
+                futures = [executor.submit(_evaluate_inherited, (i, i + chunk_size))
+                           for i in range(0, len(items), chunk_size)]
+                self._gather(table, futures)
+        else:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+                self._gather(table, self._submit_encoded(executor, projects, chunk_size))
+
+        return table
+
+    def _gather(self, table: SdfResultTable, futures: list):
+        for future in futures:
+            chunk_table, failed = future.result()
+            table.extend(chunk_table)
+            self.failed.update(failed)
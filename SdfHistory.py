@@ -0,0 +1,200 @@
+import datetime
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from SdfProject import SdfProject
+from KpiEnums import KpiStatus, RibaStages
+
+
+class SdfScoreHistory:
+    def __init__(self, capacity: int = 1024):
+        '''
+        Append-only store of KPI score snapshots. Scores are kept in columnar arrays, one row per
+        (project, KPI, timestamp); each (project, KPI) series keeps its row positions sorted by timestamp,
+        so as-of and trend queries do not scan the full history
+        :param capacity: initial number of rows allocated, grows by doubling
+        '''
+        self._size: int = 0
+        self._project = np.zeros(capacity, dtype=np.int32)
+        self._kpi = np.zeros(capacity, dtype=np.int32)
+        self._timestamp = np.zeros(capacity, dtype=np.float64)
+        self._riba_stage = np.zeros(capacity, dtype=np.int8)
+        self._raw_score = np.zeros(capacity, dtype=np.float64)
+        self._final_score = np.zeros(capacity, dtype=np.float64)
+        self._status = np.zeros(capacity, dtype=np.int8)
+
+        # identifier: code, codes are positions in the lists
+        self._project_codes: Dict[str, int] = {}
+        self._projects: List[str] = []
+        self._kpi_codes: Dict[str, int] = {}
+        self._kpis: List[str] = []
+
+        # (project code, kpi code): (row positions, timestamps), both sorted by timestamp
+        self._series: Dict[Tuple[int, int], Tuple[List[int], List[float]]] = {}
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _intern(value: str, codes: dict, values: list):
+        if value not in codes:
+            codes[value] = len(values)
+            values.append(value)
+        return codes[value]
+
+    @staticmethod
+    def _to_timestamp(timestamp):
+        if timestamp is None:
+            return datetime.datetime.now().timestamp()
+        if isinstance(timestamp, datetime.datetime):
+            return timestamp.timestamp()
+        return float(timestamp)
+
+    def _grow(self):
+        capacity = 2 * len(self._timestamp)
+        for name in ['_project', '_kpi', '_timestamp', '_riba_stage', '_raw_score', '_final_score', '_status']:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def append(self, project_identifier: str, kpi_identifier: str, riba_stage: RibaStages, raw_score: float,
+               final_score: float, status: KpiStatus, timestamp=None):
+        '''
+        Appends one score snapshot
+        :param timestamp: datetime or POSIX timestamp; now if None
+        :return: row position of the snapshot
+        '''
+        if self._size == len(self._timestamp):
+            self._grow()
+
+        project_code = self._intern(project_identifier, self._project_codes, self._projects)
+        kpi_code = self._intern(kpi_identifier, self._kpi_codes, self._kpis)
+        timestamp = self._to_timestamp(timestamp)
+
+        row = self._size
+        self._project[row] = project_code
+        self._kpi[row] = kpi_code
+        self._timestamp[row] = timestamp
+        self._riba_stage[row] = riba_stage.value
+        self._raw_score[row] = np.nan if raw_score is None else raw_score
+        self._final_score[row] = np.nan if final_score is None else final_score
+        self._status[row] = status.value
+        self._size += 1
+
+        key = (project_code, kpi_code)
+        if key not in self._series:
+            self._series[key] = ([], [])
+        rows, timestamps = self._series[key]
+        # Snapshots normally arrive in order, only out of order ones need an insertion
+        position = bisect_right(timestamps, timestamp)
+        rows.insert(position, row)
+        timestamps.insert(position, timestamp)
+
+        return row
+
+    def record(self, project_identifier: str, project: SdfProject, results: dict = None, timestamp=None):
+        '''
+        Appends a snapshot of all evaluated KPIs of a project
+        :param results: output of SdfProject.evaluate_all, evaluated here if not provided
+        :return: number of snapshots appended
+        '''
+        if results is None:
+            results = project.evaluate_all()
+
+        timestamp = self._to_timestamp(timestamp)
+        for kpi_identifier in results:
+            self.append(project_identifier=project_identifier,
+                        kpi_identifier=kpi_identifier,
+                        riba_stage=project.get_riba_stage(),
+                        raw_score=results[kpi_identifier]['raw_score'],
+                        final_score=results[kpi_identifier]['final_score'],
+                        status=results[kpi_identifier]['status'],
+                        timestamp=timestamp)
+
+        return len(results)
+
+    def _row_as_dict(self, row: int):
+        return {
+            'timestamp': datetime.datetime.fromtimestamp(self._timestamp[row]),
+            'riba_stage': RibaStages(int(self._riba_stage[row])),
+            'raw_score': None if np.isnan(self._raw_score[row]) else float(self._raw_score[row]),
+            'final_score': None if np.isnan(self._final_score[row]) else int(self._final_score[row]),
+            'status': KpiStatus(int(self._status[row]))
+        }
+
+    def as_of(self, project_identifier: str, timestamp, kpi_identifier: str = None):
+        '''
+        Latest snapshot at or before the timestamp, per KPI of the project
+        :param kpi_identifier: restrict to one KPI, all KPIs recorded for the project if None
+        :return: dict {kpi_identifier: {'timestamp', 'riba_stage', 'raw_score', 'final_score', 'status'}}
+        '''
+        if project_identifier not in self._project_codes:
+            return {}
+        project_code = self._project_codes[project_identifier]
+        timestamp = self._to_timestamp(timestamp)
+
+        if kpi_identifier is not None:
+            if kpi_identifier not in self._kpi_codes:
+                return {}
+            kpi_codes = [self._kpi_codes[kpi_identifier]]
+        else:
+            kpi_codes = range(len(self._kpis))
+
+        out = {}
+        for kpi_code in kpi_codes:
+            if (project_code, kpi_code) not in self._series:
+                continue
+            rows, timestamps = self._series[(project_code, kpi_code)]
+            position = bisect_right(timestamps, timestamp)
+            if position:
+                out[self._kpis[kpi_code]] = self._row_as_dict(rows[position - 1])
+
+        return out
+
+    def trend(self, project_identifier: str, kpi_identifier: str, start=None, end=None):
+        '''
+        Score series of one KPI of a project, ordered by timestamp
+        :param start: optional lower bound on the timestamp, inclusive
+        :param end: optional upper bound on the timestamp, inclusive
+        :return: dict of np.ndarray: timestamp, riba_stage, raw_score, final_score, status (enum values)
+        '''
+        key = (self._project_codes.get(project_identifier), self._kpi_codes.get(kpi_identifier))
+        rows, timestamps = self._series.get(key, ([], []))
+
+        first = 0 if start is None else bisect_left(timestamps, self._to_timestamp(start))
+        last = len(timestamps) if end is None else bisect_right(timestamps, self._to_timestamp(end))
+        rows = np.asarray(rows[first:last], dtype=np.int64)
+
+        return {
+            'timestamp': self._timestamp[rows],
+            'riba_stage': self._riba_stage[rows],
+            'raw_score': self._raw_score[rows],
+            'final_score': self._final_score[rows],
+            'status': self._status[rows]
+        }
+
+
+if __name__ == '__main__':
+    from KpiEnums import KpiTypes, DevelopmentTypes
+
+    history = SdfScoreHistory(capacity=2)
+    project = SdfProject(riba_stage=RibaStages.ONE, dev_type=DevelopmentTypes.RESIDENTIAL)
+    project.add_kpi(kpi_identifier='VP1',
+                    kpi_type=KpiTypes.NUMBER,
+                    input_args={'val': 50},
+                    development_types=[DevelopmentTypes.RESIDENTIAL],
+                    riba_stages=[RibaStages.ONE, RibaStages.TWO, RibaStages.THREE],
+                    good_practice=65,
+                    leading_practice=85)
+
+    start = datetime.datetime(2022, 1, 1)
+    for week, (stage, val) in enumerate([(RibaStages.ONE, 50), (RibaStages.TWO, 70), (RibaStages.THREE, 90)]):
+        project.set_riba_stage(stage)
+        project.kpis['VP1']._input_args['val'] = val
+        history.record('test_project', project, timestamp=start + datetime.timedelta(weeks=week))
+
+    print(history.as_of('test_project', start + datetime.timedelta(days=10)))
+    print(history.trend('test_project', 'VP1'))
@@ -1,5 +1,17 @@
+import numpy as np
+
 from abc import ABC
-from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages
+from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages, NormalisationTypes
+import KpiNormalisation
+import Instrumentation
+
+# Largest discrete score domain for which a normalisation lookup table is precomputed
+MAX_NORM_LUT_SIZE = 4096
+
+
+def error_message(e: Exception):
+    ''' Message of an exception collected per KPI: assertion messages as they are, other exceptions with their type '''
+    return str(e) if isinstance(e, AssertionError) else f'{type(e).__name__}: {e}'
 
 
 class KpiBase(ABC):
@@ -31,6 +43,10 @@ class KpiBase(ABC):
         ''' Normalise the value range to a standard 0-100 '''
         pass
 
+    def set_normalisation(self, normalisation: NormalisationTypes):
+        ''' Select the strategy used to normalise the raw score '''
+        pass
+
     def set_riba_stages(self, riga_stages: list):
         ''' Set riba_stages to which this KPI applies '''
         pass
@@ -70,22 +86,24 @@ class SdfKpiInput:
             assert 'questions' in self._input_args
             for question in self._input_args['questions']:
                 question_dict = self._input_args['questions'][question]
-                assert question_dict['reply']
+                # a question can be left unanswered, its reply is asserted when the raw score is calculated
+                assert 'reply' not in question_dict or question_dict['reply']
 
             if self._type == KpiTypes.CHECKBOXES or self._type == KpiTypes.BINARY:
                 if self._type == KpiTypes.BINARY:
                     # Only one question is expected
                     assert len(list(self._input_args['questions'].keys())) == 1
 
-                # Only two reply options: yes, no + 'reply'
+                # Only two reply options: yes, no
                 for question in list(self._input_args['questions'].keys()):
-                    assert len(list(self._input_args['questions'][question])) == 3
+                    assert len([x for x in self._input_args['questions'][question] if x != 'reply']) == 2
 
 
 class SdfKpi(KpiBase, SdfKpiInput):
     def __init__(self, kpi_type: KpiTypes, input_args: dict, development_types: list, riba_stages: list,
                  good_practice: float = None, leading_practice: float = None,
-                 upper_bound_norm: int = None, lower_bound_norm: int = None, reporting_only: bool = False):
+                 upper_bound_norm: int = None, lower_bound_norm: int = None, reporting_only: bool = False,
+                 normalisation: NormalisationTypes = NormalisationTypes.PRACTICE):
         super(SdfKpi, self).__init__(kpi_type, input_args)
 
         self._riba_stages: list = self.add_riba_stages(riba_stages)
@@ -98,13 +116,19 @@ class SdfKpi(KpiBase, SdfKpiInput):
         self._good_practice_thr: float = good_practice
         self._leading_practice_thr: float = leading_practice
         self._reporting_only: bool = reporting_only
+        self._normalisation: NormalisationTypes = normalisation
+
+        # Precomputed normalisation for questionnaire KPIs: final = lut[raw - offset]. Reset on any change
+        # affecting the normalisation
+        self._norm_lut: np.ndarray = None
+        self._norm_lut_offset: int = None
 
         self._raw_score: float = None
         self._final_score: int = None
         self._final_status: KpiStatus = KpiStatus.UNDEFINED
 
     def ready(self):
-        if self._final_score:
+        if self._final_score is not None:
             return True
         else:
             return False
@@ -118,10 +142,36 @@ class SdfKpi(KpiBase, SdfKpiInput):
     def set_evaluation_range(self, lower_bound: int, upper_bound: int):
         self._upper_bound = upper_bound
         self._lower_bound = lower_bound
+        self._norm_lut = None
 
     def set_practice_thr(self, good_practice: float, leading_practice: float):
         self._good_practice_thr = good_practice
         self._leading_practice_thr = leading_practice
+        self._norm_lut = None
+
+    def set_normalisation(self, normalisation: NormalisationTypes):
+        assert normalisation in KpiNormalisation.NORMALISATION_STRATEGIES, \
+            f'Unknown normalisation strategy: {normalisation}'
+        self._normalisation = normalisation
+        self._norm_lut = None
+
+    def get_normalisation(self):
+        return self._normalisation
+
+    def normalisation_args(self):
+        ''' Arguments of the normalisation strategy, as expected by KpiNormalisation.normalise '''
+        return {
+            'lower_bound': self._lower_bound,
+            'upper_bound': self._upper_bound,
+            'good_practice': self._good_practice_thr,
+            'leading_practice': self._leading_practice_thr
+        }
+
+    def check_normalisation_args(self):
+        _, required_args = KpiNormalisation.NORMALISATION_STRATEGIES[self._normalisation]
+        args = self.normalisation_args()
+        for arg in required_args:
+            assert args[arg] is not None, f'[{arg}] is required by the {self._normalisation} normalisation'
 
     def get_raw_score(self):
         return self._raw_score
@@ -151,18 +201,57 @@ class SdfKpi(KpiBase, SdfKpiInput):
         return out
 
     def normalise(self, val: float):
-        if self._type in [KpiTypes.NUMBER, KpiTypes.NUMBERS_SET, KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]:
-            if val < self._good_practice_thr:
-                norm = int(val * 50./self._good_practice_thr + 0.5)
-            elif self._good_practice_thr < val <= self._leading_practice_thr:
-                norm = int(50. + 50.*((self._leading_practice_thr - val)/(self._leading_practice_thr - self._good_practice_thr)) + 0.5)
-            else:
-                norm = 100
-        else:
-            norm = None
-            raise NotImplementedError('Linear normalisation yet to be implemented')
+        if self._type not in [KpiTypes.NUMBER, KpiTypes.NUMBERS_SET, KpiTypes.QUIZ, KpiTypes.CHECKBOXES,
+                              KpiTypes.BINARY]:
+            raise NotImplementedError(f'Normalisation is not implemented for the KPI type: {self._type}')
+
+        if self._type in [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]:
+            if self._norm_lut is None:
+                self.build_norm_lut()
+            if self._norm_lut is not None and float(val).is_integer():
+                position = int(val) - self._norm_lut_offset
+                if 0 <= position < len(self._norm_lut):
+                    return int(self._norm_lut[position])
+
+        self.check_normalisation_args()
+        return int(KpiNormalisation.normalise(self._normalisation, val, **self.normalisation_args())[0])
+
+    def build_norm_lut(self):
+        '''
+        Precomputes the normalised score for every raw score a questionnaire KPI can take, so normalisation
+        becomes a single array lookup. Only built when all option scores are integers and the score domain
+        is at most MAX_NORM_LUT_SIZE values
+        :return: True if the table was built, False otherwise
+        '''
+        questions = self._input_args.get('questions')
+        if not questions:
+            return False
+
+        min_score = 0
+        max_score = 0
+        for question in questions:
+            scores = [questions[question][x] for x in questions[question] if x != 'reply']
+            if not scores or not all(float(x).is_integer() for x in scores):
+                return False
+            min_score += int(min(scores))
+            max_score += int(max(scores))
+
+        if max_score - min_score + 1 > MAX_NORM_LUT_SIZE:
+            return False
+
+        try:
+            self.check_normalisation_args()
+        except AssertionError:
+            return False
 
-        return norm
+        domain = np.arange(min_score, max_score + 1)
+        try:
+            self._norm_lut = KpiNormalisation.normalise(self._normalisation, domain, **self.normalisation_args())
+        except ZeroDivisionError:
+            # undefined for part of the domain, scores are normalised one by one and raise only when reached
+            return False
+        self._norm_lut_offset = min_score
+        return True
 
     def evaluate(self):
         # Evaluate the raw score, final score and status
@@ -183,7 +272,7 @@ class SdfKpi(KpiBase, SdfKpiInput):
         return True
 
     def calculate_status(self):
-        assert self._raw_score, 'Raw score is required to define the KPI Status'
+        assert self._raw_score is not None, 'Raw score is required to define the KPI Status'
 
         if self._reporting_only:
             self._final_status = KpiStatus.REPORTING_ONLY
@@ -193,7 +282,7 @@ class SdfKpi(KpiBase, SdfKpiInput):
             self._final_status = KpiStatus.UNDEFINED
             return
 
-        if self._good_practice_thr < self._raw_score < self._leading_practice_thr:
+        if self._good_practice_thr <= self._raw_score < self._leading_practice_thr:
             self._final_status = KpiStatus.GOOD_PRACTICE
         elif self._raw_score >= self._leading_practice_thr:
             self._final_status = KpiStatus.LEADING_PRACTICE
@@ -202,23 +291,137 @@ class SdfKpi(KpiBase, SdfKpiInput):
         else:
             raise RuntimeError('Status evaluation error: out of bounds')
 
-    def evaluate_number(self):
-        assert 'val' in self._input_args.keys(), 'Key [val] needs to be in the input arguments'
+    def status_batch(self, raw_scores: np.ndarray):
+        '''
+        Vectorised version of calculate_status for a set of alternative raw scores of this KPI
+        :param raw_scores: raw scores
+        :return: list of KpiStatus, one per raw score
+        '''
+        raw_scores = np.asarray(raw_scores, dtype=np.float64)
+
+        if self._reporting_only:
+            return [KpiStatus.REPORTING_ONLY] * len(raw_scores)
+
+        if not self._good_practice_thr and not self._leading_practice_thr:
+            return [KpiStatus.UNDEFINED] * len(raw_scores)
+
+        codes = np.where(raw_scores >= self._leading_practice_thr, KpiStatus.LEADING_PRACTICE.value,
+                         np.where(raw_scores >= self._good_practice_thr, KpiStatus.GOOD_PRACTICE.value,
+                                  KpiStatus.NEEDS_IMPROVEMENT.value))
+        return [KpiStatus(int(x)) for x in codes]
+
+    def normalise_batch(self, raw_scores: np.ndarray):
+        '''
+        Normalises a set of alternative raw scores of this KPI, through the lookup table when available
+        :param raw_scores: raw scores
+        :return: np.ndarray of int, normalised scores
+        '''
+        raw_scores = np.asarray(raw_scores, dtype=np.float64)
+
+        if self._type in [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]:
+            if self._norm_lut is None:
+                self.build_norm_lut()
+            if self._norm_lut is not None:
+                positions = raw_scores - self._norm_lut_offset
+                if np.all((positions >= 0) & (positions < len(self._norm_lut)) & (positions == np.round(positions))):
+                    return self._norm_lut[positions.astype(np.int64)]
+
+        self.check_normalisation_args()
+        return KpiNormalisation.normalise(self._normalisation, raw_scores, **self.normalisation_args())
+
+    def option_score_matrix(self):
+        '''
+        Option scores of a questionnaire KPI as a matrix: one row per question, one column per reply option,
+        padded with NaN where a question has fewer options
+        :return: (questions, options per question, score matrix, column of the current reply per question)
+        '''
+        assert self._type in [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY], \
+            f'Option scores are only available for questionnaire KPIs. KPI type: {self._type}'
+        assert 'questions' in self._input_args.keys(), 'Key [questions] needs to be in the input arguments'
 
-        self._raw_score = self._input_args['val']
+        questions_dict = self._input_args['questions']
+        questions = list(questions_dict.keys())
+        options = [[x for x in questions_dict[question] if x != 'reply'] for question in questions]
+
+        max_options = max([len(x) for x in options]) if options else 0
+        scores = np.full((len(questions), max_options), np.nan)
+        replies = np.zeros(len(questions), dtype=np.int64)
+        for i, question in enumerate(questions):
+            reply = questions_dict[question].get('reply')
+            assert reply in options[i], f'Reply is not available in the list of selectable options: {question}'
+            replies[i] = options[i].index(reply)
+            scores[i, :len(options[i])] = [questions_dict[question][x] for x in options[i]]
+
+        return questions, options, scores, replies
+
+    def sensitivity(self):
+        '''
+        Effect of every single-answer change of a questionnaire KPI: all alternative replies are evaluated
+        together from the option score matrix, the KPI itself is not modified
+        :return: list of dicts {'question', 'reply', 'alternative', 'raw_score', 'delta', 'final_score', 'status'},
+                 one per alternative reply
+        '''
+        questions, options, scores, replies = self.option_score_matrix()
+        if not questions:
+            return []
+
+        rows = np.arange(len(questions))
+        current_scores = scores[rows, replies]
+        current_raw = current_scores.sum()
+
+        # delta of replacing the reply of question q with option o
+        deltas = scores - current_scores[:, None]
+        alternative = ~np.isnan(scores)
+        alternative[rows, replies] = False
+
+        question_ids, option_ids = np.nonzero(alternative)
+        delta_vals = deltas[question_ids, option_ids]
+        raw_scores = current_raw + delta_vals
+        final_scores = self.normalise_batch(raw_scores)
+        statuses = self.status_batch(raw_scores)
+
+        out = []
+        for i in range(len(question_ids)):
+            question_id = question_ids[i]
+            out.append({
+                'question': questions[question_id],
+                'reply': options[question_id][replies[question_id]],
+                'alternative': options[question_id][option_ids[i]],
+                'raw_score': float(raw_scores[i]),
+                'delta': float(delta_vals[i]),
+                'final_score': int(final_scores[i]),
+                'status': statuses[i]
+            })
+
+        return out
+
+    def evaluate_number(self):
+        self._raw_score = self.raw_number()
         self._final_score = self.normalise(self._raw_score)
 
     def evaluate_numbers_set(self):
+        self._raw_score = self.raw_numbers_set()
+        self._final_score = self.normalise(self._raw_score)
+
+    def evaluate_questions(self):
+        self._raw_score = self.raw_questions()
+        self._final_score = self.normalise(self._raw_score)
+
+    def raw_number(self):
+        assert 'val' in self._input_args.keys(), 'Key [val] needs to be in the input arguments'
+
+        return self._input_args['val']
+
+    def raw_numbers_set(self):
         assert 'vals' in self._input_args.keys(), 'Key [vals] needs to be in the input arguments'
         assert 'func' in self._input_args.keys(), 'Key [func] needs to be in the input arguments'
 
         vals = self._input_args['vals']
         function = self._input_args['func']
 
-        self._raw_score = function(vals)
-        self._final_score = self.normalise(self._raw_score)
+        return function(vals)
 
-    def evaluate_questions(self):
+    def raw_questions(self):
         assert 'questions' in self._input_args.keys(), 'Key [questions] needs to be in the input arguments'
 
         questions = self._input_args['questions']
@@ -241,5 +444,88 @@ class SdfKpi(KpiBase, SdfKpiInput):
 
             cum_score += questions[question][reply]
 
-        self._raw_score = cum_score
-        self._final_score = self.normalise(self._raw_score)
+        return cum_score
+
+    def calculate_raw_score(self):
+        if self._type == KpiTypes.NUMBER:
+            return self.raw_number()
+        elif self._type == KpiTypes.NUMBERS_SET:
+            return self.raw_numbers_set()
+        elif self._type in [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]:
+            return self.raw_questions()
+        else:
+            raise RuntimeError('Cannot evaluate KPI. KPI type is not defined')
+
+    @staticmethod
+    def evaluate_batch(kpis: dict):
+        '''
+        Evaluates KPIs of the same type in a single pass: raw scores are collected first, then the scores
+        are normalised together per normalisation strategy and the statuses are defined
+        :param kpis: dict {kpi_identifier: SdfKpi}; all KPIs are expected to be of the same KpiTypes
+        :return: dict {kpi_identifier: error message} for the KPIs that failed the evaluation, see error_message
+        '''
+        errors = {}
+        evaluated = []
+        raw_scores = []
+        for kpi_identifier in kpis:
+            kpi = kpis[kpi_identifier]
+            try:
+                raw_score = kpi.calculate_raw_score()
+                assert raw_score is not None, 'Raw score could not be calculated'
+                kpi.check_normalisation_args()
+            except Exception as e:
+                kpi._raw_score = None
+                kpi._final_score = None
+                kpi._final_status = KpiStatus.UNDEFINED
+                errors[kpi_identifier] = error_message(e)
+                continue
+
+            kpi._raw_score = raw_score
+            evaluated.append(kpi_identifier)
+            raw_scores.append(raw_score)
+
+        if not evaluated:
+            return errors
+
+        # Normalise together all KPIs sharing a normalisation strategy
+        strategies = {}
+        for kpi_identifier, raw_score in zip(evaluated, raw_scores):
+            normalisation = kpis[kpi_identifier].get_normalisation()
+            if normalisation not in strategies:
+                strategies[normalisation] = ([], [])
+            strategies[normalisation][0].append(kpi_identifier)
+            strategies[normalisation][1].append(raw_score)
+
+        final_scores = {}
+        for normalisation in strategies:
+            identifiers, vals = strategies[normalisation]
+            args = {}
+            for arg in ['lower_bound', 'upper_bound', 'good_practice', 'leading_practice']:
+                args[arg] = [kpis[x].normalisation_args()[arg] for x in identifiers]
+            try:
+                final_scores.update(zip(identifiers, KpiNormalisation.normalise(normalisation, vals, **args)))
+            except Exception:
+                # normalised one by one, so only the KPIs with undefined scores fail
+                for kpi_identifier, raw_score in zip(identifiers, vals):
+                    try:
+                        final_scores[kpi_identifier] = kpis[kpi_identifier].normalise(raw_score)
+                    except Exception as e:
+                        kpis[kpi_identifier]._final_score = None
+                        kpis[kpi_identifier]._final_status = KpiStatus.UNDEFINED
+                        errors[kpi_identifier] = error_message(e)
+
+        for kpi_identifier in evaluated:
+            if kpi_identifier not in final_scores:
+                continue
+            kpi = kpis[kpi_identifier]
+            kpi._final_score = int(final_scores[kpi_identifier])
+            try:
+                kpi.calculate_status()
+            except Exception as e:
+                kpi._final_status = KpiStatus.UNDEFINED
+                errors[kpi_identifier] = error_message(e)
+
+        return errors
+
+
+Instrumentation.register(SdfKpi, ['evaluate', 'normalise', 'normalise_batch', 'evaluate_batch'])
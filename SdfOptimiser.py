@@ -0,0 +1,235 @@
+import heapq
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, KpiStatus
+
+# Largest raw score gap solved with the exact dynamic programme, larger gaps use the greedy solution
+MAX_DP_STATES = 100000
+
+
+class SdfOptimiser:
+    def __init__(self, project: SdfProject, effort: Dict[Tuple[str, str, str], float] = None,
+                 default_effort: float = 1.):
+        '''
+        Finds the cheapest set of questionnaire reply changes lifting the project's questionnaire KPIs to a
+        target status. KPIs do not share questions, so each KPI is solved on its own as a multiple-choice
+        knapsack: at most one new reply per question, minimum total effort, raw score reaching the threshold
+        :param project: project to optimise, it is not modified
+        :param effort: {(kpi_identifier, question, reply option): effort of changing the reply to this option}
+        :param default_effort: effort of the changes not listed in effort
+        '''
+        self.project: SdfProject = project
+        self.effort: Dict[Tuple[str, str, str], float] = effort if effort else {}
+        self.default_effort: float = default_effort
+
+    def get_effort(self, kpi_identifier: str, question: str, option: str):
+        return self.effort.get((kpi_identifier, question, option), self.default_effort)
+
+    def candidates(self, kpi_identifier: str):
+        '''
+        Reply changes improving the raw score of a KPI
+        :return: (questions, options, current raw score, list per question of [(option index, gain, effort)])
+        '''
+        questions, options, scores, replies = self.project.kpis[kpi_identifier].option_score_matrix()
+        rows = np.arange(len(questions))
+        current_scores = scores[rows, replies]
+
+        moves = []
+        for i, question in enumerate(questions):
+            question_moves = []
+            for j, option in enumerate(options[i]):
+                gain = scores[i, j] - current_scores[i]
+                if gain > 0:
+                    question_moves.append((j, float(gain), float(self.get_effort(kpi_identifier, question, option))))
+            moves.append(question_moves)
+
+        return questions, options, float(current_scores.sum()), moves
+
+    @staticmethod
+    def solve_dp(moves: list, need: int, deadline: float):
+        '''
+        Exact minimum effort for integer gains. dp[g] is the minimum effort reaching a gain of g, gains above
+        need are capped at need
+        :return: list of (question index, option index); None if unreachable or out of time
+        '''
+        dp = np.full(need + 1, np.inf)
+        dp[0] = 0.
+        states = np.arange(need + 1)
+        history = []
+
+        for question_moves in moves:
+            if time.perf_counter() > deadline:
+                return None
+            new_dp = dp.copy()
+            choice = np.full(need + 1, -1, dtype=np.int64)
+            prev = states.copy()
+            for option, gain, effort in question_moves:
+                gain = int(gain)
+                # states reaching below the cap move by gain
+                free = need - gain
+                if free > 0:
+                    cand = dp[:free] + effort
+                    target = states[:free] + gain
+                    better = cand < new_dp[target]
+                    new_dp[target[better]] = cand[better]
+                    choice[target[better]] = option
+                    prev[target[better]] = states[:free][better]
+                # all states within gain of the cap reach the cap
+                first = max(free, 0)
+                best = first + int(np.argmin(dp[first:]))
+                if dp[best] + effort < new_dp[need]:
+                    new_dp[need] = dp[best] + effort
+                    choice[need] = option
+                    prev[need] = best
+            dp = new_dp
+            history.append((choice, prev))
+
+        if not np.isfinite(dp[need]):
+            return None
+
+        changes = []
+        state = need
+        for question in range(len(history) - 1, -1, -1):
+            choice, prev = history[question]
+            if choice[state] >= 0:
+                changes.append((question, int(choice[state])))
+            state = prev[state]
+
+        return changes[::-1]
+
+    @staticmethod
+    def solve_greedy(moves: list, need: float):
+        '''
+        Approximate solution: starting from the current replies, repeatedly takes the reply change with the best
+        additional gain per additional effort over all questions, until the gain is reached. A question already
+        changed can be changed again to an option of higher gain. Changes no longer needed once the gain is
+        reached are dropped, most costly first
+        :return: list of (question index, option index); None if unreachable, i.e. the best options of all
+        questions together fall short of need
+        '''
+        if sum(max(x[1] for x in question_moves) for question_moves in moves if question_moves) < need:
+            return None
+
+        # question index: (option index, gain, effort) of the change made to the question
+        chosen = {}
+        # question index: number of changes made, heap entries of older versions are stale
+        versions = {}
+        heap = []
+
+        def push(question: int):
+            _, current_gain, current_effort = chosen.get(question, (None, 0., 0.))
+            for option, gain, effort in moves[question]:
+                if gain > current_gain:
+                    ratio = (gain - current_gain) / max(effort - current_effort, 1e-12)
+                    heapq.heappush(heap, (-ratio, question, versions.get(question, 0), option, gain, effort))
+
+        for question in range(len(moves)):
+            push(question)
+
+        total = 0.
+        while total < need and heap:
+            _, question, version, option, gain, effort = heapq.heappop(heap)
+            if version != versions.get(question, 0):
+                continue
+            total += gain - chosen.get(question, (None, 0., 0.))[1]
+            chosen[question] = (option, gain, effort)
+            versions[question] = version + 1
+            push(question)
+
+        if total < need:
+            return None
+        for question in sorted(chosen, key=lambda x: -chosen[x][2]):
+            if total - chosen[question][1] >= need:
+                total -= chosen.pop(question)[1]
+
+        return sorted((question, chosen[question][0]) for question in chosen)
+
+    def solve(self, target: KpiStatus = KpiStatus.GOOD_PRACTICE, time_budget: float = 1.):
+        '''
+        :param target: KpiStatus.GOOD_PRACTICE or KpiStatus.LEADING_PRACTICE
+        :param time_budget: seconds; once exceeded, the remaining KPIs are solved greedily
+        :return: dict {'changes': list of {'kpi', 'question', 'reply', 'alternative', 'effort'},
+                       'total_effort', 'unreachable': list of KPI identifiers, 'optimal': bool}
+        '''
+        assert target in [KpiStatus.GOOD_PRACTICE, KpiStatus.LEADING_PRACTICE], \
+            'Target status must be GOOD_PRACTICE or LEADING_PRACTICE'
+        deadline = time.perf_counter() + time_budget
+
+        out = {'changes': [], 'total_effort': 0., 'unreachable': [], 'optimal': True}
+        for kpi_identifier in self.project.kpis:
+            kpi = self.project.kpis[kpi_identifier]
+            if kpi._type not in [KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]:
+                continue
+            if kpi._reporting_only or not self.project.kpi_isValid(kpi_identifier):
+                continue
+
+            threshold = kpi._good_practice_thr if target == KpiStatus.GOOD_PRACTICE else kpi._leading_practice_thr
+            if threshold is None:
+                continue
+
+            questions, options, current_raw, moves = self.candidates(kpi_identifier)
+            need = threshold - current_raw
+            if need <= 0:
+                continue
+
+            changes = None
+            integer_gains = all(float(x[1]).is_integer() for question_moves in moves for x in question_moves)
+            if integer_gains and need <= MAX_DP_STATES and time.perf_counter() < deadline:
+                changes = self.solve_dp(moves, int(np.ceil(need)), deadline)
+                if changes is None and time.perf_counter() > deadline:
+                    out['optimal'] = False
+                    changes = self.solve_greedy(moves, need)
+            else:
+                out['optimal'] = False
+                changes = self.solve_greedy(moves, need)
+
+            if changes is None:
+                out['unreachable'].append(kpi_identifier)
+                continue
+
+            replies = self.project.kpis[kpi_identifier]._input_args['questions']
+            for question, option in changes:
+                effort = self.get_effort(kpi_identifier, questions[question], options[question][option])
+                out['changes'].append({
+                    'kpi': kpi_identifier,
+                    'question': questions[question],
+                    'reply': replies[questions[question]]['reply'],
+                    'alternative': options[question][option],
+                    'effort': effort
+                })
+                out['total_effort'] += effort
+
+        return out
+
+
+if __name__ == '__main__':
+    from random import randint, seed
+    from KpiEnums import DevelopmentTypes, RibaStages
+
+    seed(0)
+    project = SdfProject(riba_stage=RibaStages.TWO, dev_type=DevelopmentTypes.RESIDENTIAL)
+    effort = {}
+    for k in range(5):
+        questions = {}
+        for q in range(100):
+            question = f'KPI {k} question {q}'
+            questions[question] = {'red': 0, 'orange': 1, 'green': 2, 'reply': 'red'}
+            effort[(f'Q{k}', question, 'orange')] = randint(1, 5)
+            effort[(f'Q{k}', question, 'green')] = randint(2, 10)
+        project.add_kpi(kpi_identifier=f'Q{k}',
+                        kpi_type=KpiTypes.QUIZ,
+                        input_args={'questions': questions},
+                        development_types=[DevelopmentTypes.RESIDENTIAL],
+                        riba_stages=[RibaStages.TWO],
+                        good_practice=120,
+                        leading_practice=180)
+
+    optimiser = SdfOptimiser(project=project, effort=effort)
+    start = time.perf_counter()
+    solution = optimiser.solve(target=KpiStatus.GOOD_PRACTICE, time_budget=2.)
+    print(f'Changes: {len(solution["changes"])}, total effort: {solution["total_effort"]}, '
+          f'optimal: {solution["optimal"]}, time: {time.perf_counter() - start:.3f}s')
@@ -0,0 +1,126 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Tuple
+
+from SdfProject import SdfProject
+from KpiEnums import DevelopmentTypes, RibaStages
+
+
+class SdfPortfolio:
+    def __init__(self):
+        '''
+        Index of KPI final scores over many projects, used to rank a project against comparable projects,
+        i.e. projects with the same development type at the same RIBA stage.
+        Scores are kept in sorted lists per (KPI identifier, development type, RIBA stage)
+        '''
+        self.projects: Dict[str, SdfProject] = {}
+        # (kpi_identifier, dev_type, riba_stage): sorted final scores
+        self._scores: Dict[Tuple[str, DevelopmentTypes, RibaStages], List[float]] = {}
+        # project_identifier: {kpi_identifier: (key in _scores, final score)}
+        self._project_scores: Dict[str, dict] = {}
+
+    def add_project(self, project_identifier: str, project: SdfProject):
+        assert project_identifier not in self.projects, f'Project already in the portfolio: {project_identifier}'
+        self.projects[project_identifier] = project
+        self._project_scores[project_identifier] = {}
+        self.update_project(project_identifier)
+
+    def remove_project(self, project_identifier: str):
+        assert project_identifier in self.projects, f'Project not in the portfolio: {project_identifier}'
+        for kpi_identifier in list(self._project_scores[project_identifier].keys()):
+            self._remove_score(project_identifier, kpi_identifier)
+        del self._project_scores[project_identifier]
+        del self.projects[project_identifier]
+
+    def update_project(self, project_identifier: str, results: dict = None):
+        '''
+        (Re)scores the project and updates its entries in the index; only the changed scores are moved
+        :param project_identifier: identifier of a project in the portfolio
+        :param results: output of SdfProject.evaluate_all, evaluated here if not provided
+        :return: Nothing
+        '''
+        assert project_identifier in self.projects, f'Project not in the portfolio: {project_identifier}'
+        project = self.projects[project_identifier]
+        if results is None:
+            results = project.evaluate_all()
+
+        current = self._project_scores[project_identifier]
+        for kpi_identifier in list(current.keys()):
+            if kpi_identifier not in results or results[kpi_identifier]['final_score'] is None:
+                self._remove_score(project_identifier, kpi_identifier)
+
+        for kpi_identifier in results:
+            final_score = results[kpi_identifier]['final_score']
+            if final_score is None:
+                continue
+            key = (kpi_identifier, project.get_dev_type(), project.get_riba_stage())
+            if kpi_identifier in current and current[kpi_identifier] == (key, final_score):
+                continue
+            if kpi_identifier in current:
+                self._remove_score(project_identifier, kpi_identifier)
+
+            if key not in self._scores:
+                self._scores[key] = []
+            insort(self._scores[key], final_score)
+            current[kpi_identifier] = (key, final_score)
+
+    def _remove_score(self, project_identifier: str, kpi_identifier: str):
+        key, final_score = self._project_scores[project_identifier].pop(kpi_identifier)
+        scores = self._scores[key]
+        del scores[bisect_left(scores, final_score)]
+        if not scores:
+            del self._scores[key]
+
+    def percentile(self, kpi_identifier: str, final_score: float, dev_type: DevelopmentTypes,
+                   riba_stage: RibaStages):
+        '''
+        Percentile of a score among the scores of comparable projects, ties count as half
+        :return: percentile between 0 and 100; None if there are no comparable scores
+        '''
+        scores = self._scores.get((kpi_identifier, dev_type, riba_stage))
+        if not scores:
+            return None
+
+        below = bisect_left(scores, final_score)
+        equal = bisect_right(scores, final_score) - below
+        return 100. * (below + 0.5 * equal) / len(scores)
+
+    def get_percentile(self, project_identifier: str, kpi_identifier: str):
+        ''' Percentile of a project's KPI final score among comparable projects, None if not scored '''
+        assert project_identifier in self.projects, f'Project not in the portfolio: {project_identifier}'
+        if kpi_identifier not in self._project_scores[project_identifier]:
+            return None
+
+        key, final_score = self._project_scores[project_identifier][kpi_identifier]
+        return self.percentile(kpi_identifier, final_score, dev_type=key[1], riba_stage=key[2])
+
+    def get_percentiles(self, project_identifier: str):
+        ''' {kpi_identifier: (final score, percentile)} for all scored KPIs of the project '''
+        assert project_identifier in self.projects, f'Project not in the portfolio: {project_identifier}'
+        out = {}
+        for kpi_identifier in self._project_scores[project_identifier]:
+            final_score = self._project_scores[project_identifier][kpi_identifier][1]
+            out[kpi_identifier] = (final_score, self.get_percentile(project_identifier, kpi_identifier))
+        return out
+
+    def num_comparable(self, kpi_identifier: str, dev_type: DevelopmentTypes, riba_stage: RibaStages):
+        return len(self._scores.get((kpi_identifier, dev_type, riba_stage), []))
+
+
+if __name__ == '__main__':
+    from random import randint
+    from KpiEnums import KpiTypes
+
+    portfolio = SdfPortfolio()
+    for i in range(20):
+        project = SdfProject(riba_stage=RibaStages.FIVE, dev_type=DevelopmentTypes.COMMERCIAL)
+        project.add_kpi(kpi_identifier='VP1',
+                        kpi_type=KpiTypes.NUMBER,
+                        input_args={'val': randint(0, 100)},
+                        development_types=[DevelopmentTypes.COMMERCIAL],
+                        riba_stages=[RibaStages.FIVE],
+                        good_practice=65,
+                        leading_practice=85)
+        portfolio.add_project(project_identifier=f'project_{i}', project=project)
+
+    for i in range(3):
+        print(f'project_{i}: {portfolio.get_percentiles(f"project_{i}")}')
@@ -1,7 +1,10 @@
+import time
 import warnings
 
+from typing import Dict
 from SdfKpi import SdfKpi
-from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages
+from SdfResultTable import SdfResultTable
+from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages, NormalisationTypes
 
 
 class SdfProject:
@@ -10,12 +13,20 @@ class SdfProject:
         # only set once
         self._dev_type: DevelopmentTypes = dev_type
         self.kpis: dict = {}
+        # KpiTypes: wall time [s] of the last evaluate_all, per type batch
+        self.evaluation_times: Dict[KpiTypes, float] = {}
 
     def set_riba_stage(self, new_riba_stage: RibaStages):
         self._current_riba_stage = new_riba_stage
 
         # TODO: trigger reevaluation of all KPIs
 
+    def get_riba_stage(self):
+        return self._current_riba_stage
+
+    def get_dev_type(self):
+        return self._dev_type
+
     def get_raw_score(self, kpi_identifier: str):
         if not self.verify_kpi_identifier(kpi_identifier):
             return None
@@ -39,7 +50,8 @@ class SdfProject:
 
     def add_kpi(self, kpi_identifier: str, kpi_type: KpiTypes, input_args: dict, development_types: list,
                 riba_stages: list, good_practice: float = None, leading_practice: float = None,
-                upper_bound_norm: int = None, lower_bound_norm: int = None, reporting_only: bool = False):
+                upper_bound_norm: int = None, lower_bound_norm: int = None, reporting_only: bool = False,
+                normalisation: NormalisationTypes = NormalisationTypes.PRACTICE):
 
         assert kpi_identifier not in self.kpis.keys(), f'Cannot add KPI as this KPI identifier ' \
                                                        f'already exists: {kpi_identifier}'
@@ -52,7 +64,8 @@ class SdfProject:
                      leading_practice=leading_practice,
                      upper_bound_norm=upper_bound_norm,
                      lower_bound_norm=lower_bound_norm,
-                     reporting_only=reporting_only)
+                     reporting_only=reporting_only,
+                     normalisation=normalisation)
 
         self.kpis[kpi_identifier] = kpi
 
@@ -75,26 +88,105 @@ class SdfProject:
 
         return True
 
+    def evaluate_all(self):
+        '''
+        Evaluates all KPIs applicable to the current RIBA stage and development type in a single pass.
+        KPIs are grouped by KpiTypes so that each type is evaluated as one batch. Exceptions, e.g. raised by the
+        func of a NUMBERS_SET KPI, are collected per KPI instead of aborting the evaluation
+        :return: dict {kpi_identifier: {'type', 'raw_score', 'final_score', 'status', 'error'}}
+        '''
+        batches = {}
+        for kpi_identifier in self.kpis:
+            if not self.kpi_isValid(kpi_identifier):
+                continue
+            kpi_type = self.kpis[kpi_identifier]._type
+            if kpi_type not in batches:
+                batches[kpi_type] = {}
+            batches[kpi_type][kpi_identifier] = self.kpis[kpi_identifier]
+
+        self.evaluation_times = {}
+        errors = {}
+        for kpi_type in batches:
+            start = time.perf_counter()
+            errors.update(SdfKpi.evaluate_batch(batches[kpi_type]))
+            self.evaluation_times[kpi_type] = time.perf_counter() - start
+
+        results = {}
+        for kpi_type in batches:
+            for kpi_identifier in batches[kpi_type]:
+                kpi = self.kpis[kpi_identifier]
+                results[kpi_identifier] = {
+                    'type': kpi_type,
+                    'raw_score': kpi.get_raw_score(),
+                    'final_score': kpi.get_final_score(),
+                    'status': kpi.get_status(),
+                    'error': errors.get(kpi_identifier)
+                }
+
+        return results
+
+    def export_results(self, project_identifier: str, results: dict = None, table: SdfResultTable = None):
+        '''
+        All KPI results of the project in columnar form, see SdfResultTable for the pandas, json and file outputs
+        :param project_identifier: identifier of the project in the table
+        :param results: output of evaluate_all, evaluated here if not provided
+        :param table: table to append the results to, e.g. to export many projects together; a new one if None
+        :return: SdfResultTable
+        '''
+        if results is None:
+            results = self.evaluate_all()
+        if table is None:
+            table = SdfResultTable(capacity=len(results))
+        table.add_results(project_identifier, results)
+
+        return table
+
+    def sensitivity(self, kpi_identifier: str, status: KpiStatus = None):
+        '''
+        Score and status changes for every alternative reply of a questionnaire KPI, see SdfKpi.sensitivity
+        :param kpi_identifier: identifier of a QUIZ, CHECKBOXES or BINARY KPI
+        :param status: if given, only the alternatives resulting in this status are returned
+        :return: list of alternatives; None if the KPI does not exist or does not apply to the project
+        '''
+        if not self.verify_kpi_identifier(kpi_identifier):
+            return None
+        if not self.kpi_isValid(kpi_identifier):
+            return None
+
+        alternatives = self.kpis[kpi_identifier].sensitivity()
+        if status is not None:
+            alternatives = [x for x in alternatives if x['status'] == status]
+
+        return alternatives
+
+    def get_evaluation_times(self):
+        return self.evaluation_times
+
     def verify_kpi_identifier(self, kpi_identifier: str):
-        return kpi_identifier in self.kpis.keys(), f'KPI identified is not in the list of KPIs: {kpi_identifier}'
+        ''' :return: True if the KPI exists, otherwise warns and returns False '''
+        if kpi_identifier not in self.kpis.keys():
+            warnings.warn(f'KPI identified is not in the list of KPIs: {kpi_identifier}')
+            return False
+        return True
 
     def print_summary(self, kpi_identifier: str, in_val: dict = None, kpi_type: KpiTypes = None):
         in_val = in_val if in_val else 'Unknown'
         kpi_type = kpi_type if kpi_type else 'Unknown'
+        self.evaluate_kpi(kpi_identifier)
+        kpi = self.kpis[kpi_identifier]
         print(f'\nKPI Summary:'
               f'\nKPI Identifier: {kpi_identifier}'
               f'\nKPI type:       {kpi_type}'
               f'\nInput val:      {in_val}'
-              f'\nRaw score:      {self.get_raw_score(kpi_identifier)}'
-              f'\nFinal score:    {self.get_final_score(kpi_identifier)}'
-              f'\nFinal status:   {self.get_status(kpi_identifier)}')
+              f'\nRaw score:      {kpi.get_raw_score()}'
+              f'\nFinal score:    {kpi.get_final_score()}'
+              f'\nFinal status:   {kpi.get_status()}')
 
 
 # TODO: Test normalisation
 # TODO: Add RIBA stages and Dev Types
 # TODO: Add KPI name
 # TODO: Add min applicability score to kpi, i.e KPIs below this score will be marked as unapplicable
-# TODO: Add selectable normaliation strategy to kpi
 
 if __name__ == '__main__':
     TEST_KPI_NUMBER = False
@@ -252,3 +344,8 @@ if __name__ == '__main__':
 
         project.evaluate_kpi(kpi_identifier=_kpi['identifier'])
         project.print_summary(kpi_identifier=_kpi['identifier'], kpi_type=_kpi['type'], in_val=_kpi['input'])
+
+    results = project.evaluate_all()
+    for _identifier in results:
+        print(f'{_identifier}: {results[_identifier]}')
+    print(f'Evaluation times: {project.get_evaluation_times()}')
@@ -0,0 +1,133 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from SdfProject import SdfProject
+
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+def object_nbytes(obj, seen: set = None):
+    '''
+    Approximate memory footprint of an object and everything it references: containers, numpy arrays and
+    the attributes of plain objects are followed, shared objects are counted once
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return int(sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(object_nbytes(k, seen) + object_nbytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(object_nbytes(x, seen) for x in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type) and not callable(obj):
+        size += object_nbytes(vars(obj), seen)
+    return int(size)
+
+
+class SdfProjectCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        '''
+        Evaluated projects kept in least recently used order, so repeated requests for the same project skip
+        building and evaluating its KPIs. Each project is cached with a version given by the caller, e.g. the
+        modification time of its stored inputs; a lookup with another version evaluates the project again.
+        Least recently used projects are dropped once their total size (see object_nbytes) exceeds max_bytes
+        :param max_bytes: size limit of the cached projects
+        '''
+        self.max_bytes: int = max_bytes
+        # project_identifier: (version, SdfProject, evaluate_all results, bytes), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._nbytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, project_identifier: str):
+        return project_identifier in self._entries
+
+    def get(self, project_identifier: str, version, loader: Callable[[], SdfProject] = None):
+        '''
+        :param project_identifier: identifier of the project
+        :param version: version of the project inputs; a cached project with another version is replaced
+        :param loader: builds the project on a miss, it is then evaluated and cached
+        :return: (SdfProject, results of SdfProject.evaluate_all); (None, None) on a miss without loader
+        '''
+        with self._lock:
+            entry = self._entries.get(project_identifier)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(project_identifier)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        if loader is None:
+            return None, None
+        project = loader()
+        return project, self.put(project_identifier, project, version)
+
+    def put(self, project_identifier: str, project: SdfProject, version, results: dict = None):
+        '''
+        Caches a project, replacing any other version of it
+        :param results: output of project.evaluate_all, evaluated here if not provided
+        :return: results
+        '''
+        if results is None:
+            results = project.evaluate_all()
+        nbytes = object_nbytes((project, results))
+
+        with self._lock:
+            if project_identifier in self._entries:
+                self._remove(project_identifier)
+            self._entries[project_identifier] = (version, project, results, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return results
+
+    def _remove(self, project_identifier: str):
+        self._nbytes -= self._entries.pop(project_identifier)[3]
+
+    def invalidate(self, project_identifier: str):
+        ''' :return: True if the project was cached '''
+        with self._lock:
+            if project_identifier not in self._entries:
+                return False
+            self._remove(project_identifier)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        '''
+        :return: dict with hits, misses, evictions, hit_rate, entries, bytes and max_bytes
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'entries': len(self._entries),
+            'bytes': self._nbytes,
+            'max_bytes': self.max_bytes
+        }
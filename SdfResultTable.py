@@ -0,0 +1,265 @@
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from KpiEnums import KpiTypes, KpiStatus
+
+# Columns of the table and their dtypes; enums are stored as their values, missing scores as NaN
+COLUMNS = {
+    'project': np.int32,
+    'kpi': np.int32,
+    'type': np.int8,
+    'raw_score': np.float64,
+    'final_score': np.float64,
+    'status': np.int8
+}
+# Enum columns: enum class whose values they store
+ENUMS = {
+    'type': KpiTypes,
+    'status': KpiStatus
+}
+RESULTS_VERSION = 1
+
+
+class SdfResultTable:
+    def __init__(self, capacity: int = 1024):
+        '''
+        KPI results of many projects in columnar arrays, one row per (project, KPI). Project and KPI
+        identifiers are stored as codes, positions in the projects and kpis lists
+        :param capacity: initial number of rows allocated, grows by doubling
+        '''
+        self._size: int = 0
+        # column name: array of capacity rows, see COLUMNS
+        self._columns: Dict[str, np.ndarray] = {name: np.zeros(max(capacity, 1), dtype=dtype)
+                                                for name, dtype in COLUMNS.items()}
+
+        # identifier: code, codes are positions in the lists
+        self._project_codes: Dict[str, int] = {}
+        self.projects: List[str] = []
+        self._kpi_codes: Dict[str, int] = {}
+        self.kpis: List[str] = []
+
+        # row: error message of the evaluation, only for the rows that failed
+        self.errors: Dict[int, str] = {}
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # only the used rows are pickled, e.g. when returned by a worker process
+        state = self.__dict__.copy()
+        state['_columns'] = {name: self.column(name).copy() for name in self._columns}
+        return state
+
+    @staticmethod
+    def _intern(value: str, codes: dict, values: list):
+        if value not in codes:
+            codes[value] = len(values)
+            values.append(value)
+        return codes[value]
+
+    def _reserve(self, num_rows: int):
+        capacity = len(self._columns['project'])
+        if self._size + num_rows <= capacity:
+            return
+        while capacity < self._size + num_rows:
+            capacity *= 2
+        for name, old in self._columns.items():
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            self._columns[name] = new
+
+    def column(self, name: str):
+        ''' :return: view of the used rows of a column, see COLUMNS '''
+        assert name in self._columns, f'Unknown result column: {name}'
+        return self._columns[name][:self._size]
+
+    def append(self, project_identifier: str, kpi_identifier: str, kpi_type: KpiTypes, raw_score: float,
+               final_score: float, status: KpiStatus, error: str = None):
+        '''
+        :return: row position of the result
+        '''
+        self._reserve(1)
+        row = self._size
+        self._columns['project'][row] = self._intern(project_identifier, self._project_codes, self.projects)
+        self._columns['kpi'][row] = self._intern(kpi_identifier, self._kpi_codes, self.kpis)
+        self._columns['type'][row] = kpi_type.value
+        self._columns['raw_score'][row] = np.nan if raw_score is None else raw_score
+        self._columns['final_score'][row] = np.nan if final_score is None else final_score
+        self._columns['status'][row] = status.value
+        if error is not None:
+            self.errors[row] = error
+        self._size += 1
+
+        return row
+
+    def add_results(self, project_identifier: str, results: dict):
+        '''
+        :param results: output of SdfProject.evaluate_all
+        :return: number of rows appended
+        '''
+        for kpi_identifier in results:
+            result = results[kpi_identifier]
+            self.append(project_identifier=project_identifier,
+                        kpi_identifier=kpi_identifier,
+                        kpi_type=result['type'],
+                        raw_score=result['raw_score'],
+                        final_score=result['final_score'],
+                        status=result['status'],
+                        error=result['error'])
+
+        return len(results)
+
+    def extend(self, other: 'SdfResultTable'):
+        '''
+        Appends all rows of another table; its project and KPI codes are translated to the codes of this table
+        :return: number of rows appended
+        '''
+        num_rows = len(other)
+        self._reserve(num_rows)
+        project_map = np.array([self._intern(x, self._project_codes, self.projects) for x in other.projects],
+                               dtype=np.int32)
+        kpi_map = np.array([self._intern(x, self._kpi_codes, self.kpis) for x in other.kpis], dtype=np.int32)
+
+        rows = slice(self._size, self._size + num_rows)
+        for name in self._columns:
+            self._columns[name][rows] = other.column(name)
+        if num_rows:
+            self._columns['project'][rows] = project_map[other.column('project')]
+            self._columns['kpi'][rows] = kpi_map[other.column('kpi')]
+        for row, error in other.errors.items():
+            self.errors[self._size + row] = error
+        self._size += num_rows
+
+        return num_rows
+
+    def project_rows(self, project_identifier: str):
+        ''' :return: row positions of the results of a project '''
+        if project_identifier not in self._project_codes:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.column('project') == self._project_codes[project_identifier])
+
+    def project_results(self, project_identifier: str):
+        '''
+        :return: dict {kpi_identifier: {'type', 'raw_score', 'final_score', 'status', 'error'}}, as returned
+        by SdfProject.evaluate_all
+        '''
+        out = {}
+        for row in self.project_rows(project_identifier):
+            raw_score = self._columns['raw_score'][row]
+            final_score = self._columns['final_score'][row]
+            out[self.kpis[self._columns['kpi'][row]]] = {
+                'type': KpiTypes(int(self._columns['type'][row])),
+                'raw_score': None if np.isnan(raw_score) else float(raw_score),
+                'final_score': None if np.isnan(final_score) else int(final_score),
+                'status': KpiStatus(int(self._columns['status'][row])),
+                'error': self.errors.get(int(row))
+            }
+
+        return out
+
+    @staticmethod
+    def enum_codes():
+        ''' :return: dict {enum column: {enum name: value}}, to decode the type and status columns '''
+        return {name: {x.name: x.value for x in enum} for name, enum in ENUMS.items()}
+
+    def columns(self):
+        '''
+        :return: dict {column name: array}, views of the used rows without copy, see COLUMNS; rows appended
+        afterwards are not included
+        '''
+        return {name: self.column(name) for name in self._columns}
+
+    def to_pandas(self, categorical: bool = False):
+        '''
+        :param categorical: project and kpi columns as pd.Categorical of the identifiers rather than codes; the
+        codes are then copied
+        :return: pd.DataFrame sharing the arrays of the table, one row per result. Codes are decoded with the
+        projects and kpis lists and enum_codes
+        '''
+        columns = self.columns()
+        if categorical:
+            columns['project'] = pd.Categorical.from_codes(columns['project'], categories=self.projects)
+            columns['kpi'] = pd.Categorical.from_codes(columns['kpi'], categories=self.kpis)
+        return pd.DataFrame(columns, copy=False)
+
+    def to_dict(self):
+        '''
+        Compact json serialisable form: one list per column, enum values instead of names, None for missing
+        scores, identifiers once in the projects and kpis lists
+        :return: dict {'version', 'projects', 'kpis', 'enums', 'columns', 'errors'}
+        '''
+        columns = {}
+        for name, values in self.columns().items():
+            columns[name] = values.tolist()
+            if values.dtype.kind == 'f':
+                for row in np.flatnonzero(np.isnan(values)).tolist():
+                    columns[name][row] = None
+
+        return {
+            'version': RESULTS_VERSION,
+            'projects': self.projects,
+            'kpis': self.kpis,
+            'enums': self.enum_codes(),
+            'columns': columns,
+            'errors': {str(row): error for row, error in self.errors.items()}
+        }
+
+    def to_json(self, path: str = None):
+        '''
+        :param path: file to write the results to
+        :return: to_dict as a json string
+        '''
+        text = json.dumps(self.to_dict(), separators=(',', ':'))
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        ''' :param data: output of to_dict '''
+        assert data.get('version') == RESULTS_VERSION, f'Unsupported results version: {data.get("version")}'
+        num_rows = len(data['columns']['project'])
+        table = cls(capacity=num_rows)
+        for name, dtype in COLUMNS.items():
+            values = data['columns'][name]
+            if np.dtype(dtype).kind == 'f':
+                values = [np.nan if x is None else x for x in values]
+            table._columns[name][:num_rows] = np.asarray(values, dtype=dtype)
+        table._size = num_rows
+        table.projects = list(data['projects'])
+        table._project_codes = {x: i for i, x in enumerate(table.projects)}
+        table.kpis = list(data['kpis'])
+        table._kpi_codes = {x: i for i, x in enumerate(table.kpis)}
+        table.errors = {int(row): error for row, error in data['errors'].items()}
+        return table
+
+    def save(self, path: str):
+        '''
+        Writes the columns, identifiers and errors to an uncompressed .npz file, loaded without parsing
+        :param path: file path, '.npz' is appended by numpy if missing
+        '''
+        rows = sorted(self.errors)
+        np.savez(path, version=np.array(RESULTS_VERSION), projects=np.array(self.projects, dtype=str),
+                 kpis=np.array(self.kpis, dtype=str), error_rows=np.array(rows, dtype=np.int64),
+                 errors=np.array([self.errors[x] for x in rows], dtype=str), **self.columns())
+
+    @classmethod
+    def load(cls, path: str):
+        ''' :param path: file written by save '''
+        with np.load(path) as data:
+            assert int(data['version']) == RESULTS_VERSION, f'Unsupported results version: {int(data["version"])}'
+            num_rows = len(data['project'])
+            table = cls(capacity=num_rows)
+            for name in COLUMNS:
+                table._columns[name][:num_rows] = data[name]
+            table._size = num_rows
+            table.projects = data['projects'].tolist()
+            table._project_codes = {x: i for i, x in enumerate(table.projects)}
+            table.kpis = data['kpis'].tolist()
+            table._kpi_codes = {x: i for i, x in enumerate(table.kpis)}
+            table.errors = dict(zip(data['error_rows'].tolist(), data['errors'].tolist()))
+        return table
@@ -0,0 +1,156 @@
+import datetime
+from typing import List
+
+import numpy as np
+
+from DataColumn import DataColumn
+from data_types import InforecastDataTypes
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, DevelopmentTypes, RibaStages
+
+
+# dtypes cycled through by make_columns after the id column
+MIXED_DTYPES = [InforecastDataTypes.STR, InforecastDataTypes.FLOAT64, InforecastDataTypes.INT64,
+                InforecastDataTypes.DATE, InforecastDataTypes.BOOL]
+START_DATE = datetime.datetime(2022, 1, 1)
+
+
+def make_columns(num_cols: int, num_options: int = 8):
+    '''
+    Tracker columns of mixed dtypes: a unique 'WPId' string first, then the dtypes of MIXED_DTYPES in turn.
+    Every other string column is restricted to num_options options
+    :param num_cols: total number of columns, including WPId
+    :return: list of DataColumn
+    '''
+    cols = [DataColumn(dtype=InforecastDataTypes.STR, name='WPId')]
+    for i in range(1, num_cols):
+        dtype = MIXED_DTYPES[(i - 1) % len(MIXED_DTYPES)]
+        col = DataColumn(dtype=dtype, name=f'{dtype.name.lower()} {i}')
+        if dtype == InforecastDataTypes.STR and (i - 1) // len(MIXED_DTYPES) % 2 == 0:
+            col.set_options([f'option_{x}' for x in range(num_options)])
+        cols.append(col)
+    return cols
+
+
+def make_values(col: DataColumn, num_rows: int, rng: np.random.Generator, null_ratio: float = 0.05):
+    '''
+    Random valid values of a column; about null_ratio of them are None
+    :return: list of python or numpy scalars, as passed to InforecastTracker.add_row
+    '''
+    dtype = col.get_type()
+    if col.get_tag() == 'WPId':
+        return [f'WP{i}' for i in range(num_rows)]
+
+    if col.get_options():
+        options = col.get_options()
+        values = [options[x] for x in rng.integers(0, len(options), num_rows)]
+    elif dtype == InforecastDataTypes.STR:
+        values = [f'note {x}' for x in rng.integers(0, num_rows, num_rows)]
+    elif dtype == InforecastDataTypes.FLOAT64:
+        values = list(np.round(rng.uniform(0, 1e5, num_rows), 2))
+    elif dtype == InforecastDataTypes.INT64:
+        values = list(rng.integers(0, 1000, num_rows).astype(np.int64))
+    elif dtype == InforecastDataTypes.DATE:
+        values = [START_DATE + datetime.timedelta(days=int(x)) for x in rng.integers(0, 3650, num_rows)]
+    else:
+        values = list(rng.random(num_rows) < 0.5)
+
+    missing = rng.random(num_rows) < null_ratio
+    return [None if m else v for v, m in zip(values, missing)]
+
+
+def make_rows(cols: List[DataColumn], num_rows: int, seed: int = 0, null_ratio: float = 0.05):
+    '''
+    :return: list of row dicts {col_tag: value}, missing values left out
+    '''
+    rng = np.random.default_rng(seed)
+    values = {col.get_tag(): make_values(col, num_rows, rng, null_ratio) for col in cols}
+    return [{tag: values[tag][i] for tag in values if values[tag][i] is not None} for i in range(num_rows)]
+
+
+def make_wp_hierarchy(depth: int, fan_out: int, seed: int = 0):
+    '''
+    Work package tree: one root per fan_out at level 0, each work package having fan_out children down to
+    level depth - 1. Ids are '<level>.<number>', 'parent' holds the id of the parent, empty for roots
+    :return: (columns, rows); rows are ordered parents first
+    '''
+    rng = np.random.default_rng(seed)
+    cols = [DataColumn(dtype=InforecastDataTypes.STR, name='WPId'),
+            DataColumn(dtype=InforecastDataTypes.STR, name='parent'),
+            DataColumn(dtype=InforecastDataTypes.INT64, name='level'),
+            DataColumn(dtype=InforecastDataTypes.FLOAT64, name='cost')]
+
+    rows = []
+    parents = ['']
+    for level in range(depth):
+        children = []
+        for parent in parents:
+            for _ in range(fan_out):
+                wp_id = f'{level}.{len(children)}'
+                children.append(wp_id)
+                rows.append({'WPId': wp_id, 'parent': parent, 'level': np.int64(level),
+                             'cost': np.float64(round(rng.uniform(0, 1e4), 2))})
+        parents = children
+    return cols, rows
+
+
+def rollup(wp_ids: list, parents: list, costs: list):
+    '''
+    Total cost of each work package including all its descendants
+    :param wp_ids: work package ids, parents before their children as in make_wp_hierarchy
+    :param parents: id of the parent of each work package, empty or None for roots
+    :param costs: own cost of each work package, None counted as 0
+    :return: dict {WPId: total cost}
+    '''
+    totals = {wp_id: cost if cost is not None else 0. for wp_id, cost in zip(wp_ids, costs)}
+    # children come after their parent, walking backwards adds each subtree before its parent is reached
+    for wp_id, parent in zip(reversed(wp_ids), reversed(parents)):
+        if parent:
+            totals[parent] += totals[wp_id]
+    return totals
+
+
+def make_kpi_args(kpi_type: KpiTypes, rng: np.random.Generator, num_questions: int = 5):
+    '''
+    :return: dict of SdfProject.add_kpi arguments with random inputs of the given type
+    '''
+    if kpi_type == KpiTypes.NUMBER:
+        return {'input_args': {'val': int(rng.integers(0, 100))}, 'good_practice': 65, 'leading_practice': 85,
+                'upper_bound_norm': 100, 'lower_bound_norm': 0}
+    if kpi_type == KpiTypes.NUMBERS_SET:
+        return {'input_args': {'vals': {'cars': int(rng.integers(0, 100)), 'vans': int(rng.integers(0, 20))},
+                               'func': lambda x: x['cars'] * 50 + x['vans'] * 100},
+                'good_practice': 4000, 'leading_practice': 6000, 'upper_bound_norm': 7000, 'lower_bound_norm': 0}
+
+    if kpi_type == KpiTypes.QUIZ:
+        options = {'red': 0, 'orange': 1, 'green': 2}
+    else:
+        options = {'yes': 1, 'no': 0}
+    if kpi_type == KpiTypes.BINARY:
+        num_questions = 1
+    replies = list(options.keys())
+    questions = {f'Question {i}': dict(options, reply=replies[int(rng.integers(0, len(replies)))])
+                 for i in range(num_questions)}
+    upper = max(options.values()) * num_questions
+    return {'input_args': {'questions': questions}, 'good_practice': upper * 0.6, 'leading_practice': upper,
+            'upper_bound_norm': upper, 'lower_bound_norm': 0}
+
+
+def make_portfolio(num_projects: int, num_kpis: int, seed: int = 0):
+    '''
+    Projects at RIBA stage FIVE with num_kpis KPIs each, the KPI types taken in turn
+    :return: dict {project_identifier: SdfProject}
+    '''
+    rng = np.random.default_rng(seed)
+    kpi_types = [KpiTypes.NUMBER, KpiTypes.NUMBERS_SET, KpiTypes.QUIZ, KpiTypes.CHECKBOXES, KpiTypes.BINARY]
+    dev_types = [DevelopmentTypes.COMMERCIAL, DevelopmentTypes.RESIDENTIAL, DevelopmentTypes.MASTERPLAN]
+
+    projects = {}
+    for p in range(num_projects):
+        project = SdfProject(riba_stage=RibaStages.FIVE, dev_type=dev_types[p % len(dev_types)])
+        for k in range(num_kpis):
+            kpi_type = kpi_types[k % len(kpi_types)]
+            project.add_kpi(kpi_identifier=f'KPI{k}', kpi_type=kpi_type, development_types=dev_types,
+                            riba_stages=[RibaStages.FIVE], **make_kpi_args(kpi_type, rng))
+        projects[f'P{p}'] = project
+    return projects
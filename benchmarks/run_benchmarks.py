@@ -0,0 +1,281 @@
+'''
+Benchmarks of tracker ingestion, validation, persistence, amends, work package rollups and KPI scoring on
+synthetic data (see generators.py). Each case is run several times on fresh inputs, setup excluded, and the
+timings are stored as json. Runs of two versions are compared with --compare:
+
+    python benchmarks/run_benchmarks.py --rows 1000 10000 --out before.json
+    python benchmarks/run_benchmarks.py --rows 1000 10000 --out after.json --compare before.json
+'''
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'may_july22_relevant'), os.path.dirname(os.path.abspath(__file__))]
+
+import numpy as np
+import pandas as pd
+
+import generators
+from InforecastTracker import InforecastTracker
+from MaterializedViews import MaterializedView
+from SdfBatchRunner import SdfBatchRunner
+from SdfPortfolio import SdfPortfolio
+
+
+RESULTS_VERSION = 1
+# median time ratio to the baseline above which a case is reported as a regression
+DEFAULT_THRESHOLD = 1.2
+_tracker_ids = itertools.count()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(suite: str, case: str, params: dict, items: int, setup, run, repeat: int):
+    '''
+    Times run(setup()) repeat times
+    :param items: number of items processed by one run, e.g. rows, to report a throughput
+    :return: result dict
+    '''
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    return {
+        'suite': suite,
+        'case': case,
+        'params': params,
+        'items': items,
+        'times_s': times,
+        'min_s': best,
+        'median_s': statistics.median(times),
+        'items_per_s': items / best if best > 0 else None
+    }
+
+
+def new_tracker(work_dir: str, cols: list, sharding: dict = None):
+    tracker = InforecastTracker()
+    assert tracker.init(name=f'bench {next(_tracker_ids)}', data_columns=cols,
+                        metadata={'project_dir': work_dir}, sharding=sharding), 'Tracker could not be initialised'
+    return tracker
+
+
+def bench_tracker(work_dir: str, num_rows: int, num_cols: int, repeat: int, seed: int):
+    ''' Ingest, validate, save, load and amend of a tracker of num_rows x num_cols mixed columns '''
+    params = {'rows': num_rows, 'cols': num_cols}
+    rows = generators.make_rows(generators.make_columns(num_cols), num_rows, seed=seed)
+    results = []
+
+    def filled():
+        tracker = new_tracker(work_dir, generators.make_columns(num_cols))
+        tracker.add_rows(rows)
+        return tracker
+
+    results.append(measure('tracker', 'ingest', params, num_rows,
+                           lambda: new_tracker(work_dir, generators.make_columns(num_cols)),
+                           lambda t: t.add_rows(rows), repeat))
+
+    tracker = filled()
+
+    def validate(_):
+        for tag in tracker.cols:
+            tracker.cols[tag].validate_array(*tracker.data_table.get_column(tag))
+    results.append(measure('tracker', 'validate', params, num_rows * num_cols, lambda: None, validate, repeat))
+
+    for compress in [False, True]:
+        case = 'compressed' if compress else 'csv'
+        results.append(measure('tracker', f'save_{case}', params, num_rows, lambda: tracker,
+                               lambda t: t.save(compress=compress), repeat))
+
+        def load(t):
+            t.open(tracker.dir)
+            t.cols
+            t.data_table
+            t.change_table
+        results.append(measure('tracker', f'load_{case}', params, num_rows, InforecastTracker, load, repeat))
+
+    rng = np.random.default_rng(seed)
+    num_amends = min(num_rows, 1000)
+    float_col = next(tag for tag in tracker.cols if tracker.cols[tag].get_type().name == 'FLOAT64')
+    amends = [(int(x), np.float64(y)) for x, y in zip(rng.integers(0, num_rows, num_amends),
+                                                    rng.uniform(0, 1e5, num_amends))]
+
+    def amend(t):
+        for index_val, value in amends:
+            t.amend_val(index_val=index_val, col_tag=float_col, value=value)
+    results.append(measure('tracker', 'amend', dict(params, amends=num_amends), num_amends, filled, amend, repeat))
+    return results
+
+
+def bench_rollup(work_dir: str, depth: int, fan_out: int, repeat: int, seed: int):
+    ''' Cost rollup over a work package hierarchy: per parent view, then totals including all descendants '''
+    cols, rows = generators.make_wp_hierarchy(depth, fan_out, seed=seed)
+    params = {'depth': depth, 'fan_out': fan_out}
+    tracker = new_tracker(work_dir, cols)
+    tracker.add_rows(rows)
+
+    def run(_):
+        view = MaterializedView(name='children', group_by=['parent'],
+                                aggs={'children_cost': ('cost', 'sum'), 'children': ('cost', 'count')})
+        tracker.add_view(view)
+        tracker.get_view(view.name)
+        del tracker.views[view.name]
+        generators.rollup(*(tracker.data_table.get_column(x)[0].tolist() for x in ['WPId', 'parent', 'cost']))
+    return [measure('hierarchy', 'rollup', params, len(rows), lambda: None, run, repeat)]
+
+
+def bench_kpis(num_projects: int, num_kpis: int, repeat: int, seed: int, processes: int = None):
+    '''
+    Evaluation of all KPIs of a portfolio of projects, one project after the other and with SdfBatchRunner,
+    then their ranking in an SdfPortfolio
+    '''
+    params = {'projects': num_projects, 'kpis': num_kpis}
+    items = num_projects * num_kpis
+
+    def evaluate(projects):
+        for project in projects.values():
+            project.evaluate_all()
+
+    def rank(projects):
+        portfolio = SdfPortfolio()
+        for identifier in projects:
+            portfolio.add_project(identifier, projects[identifier])
+        for identifier in projects:
+            portfolio.get_percentiles(identifier)
+
+    def evaluated():
+        projects = generators.make_portfolio(num_projects, num_kpis, seed=seed)
+        evaluate(projects)
+        return projects
+
+    runner = SdfBatchRunner(processes=processes)
+    return [measure('kpi', 'evaluate', params, items,
+                    lambda: generators.make_portfolio(num_projects, num_kpis, seed=seed), evaluate, repeat),
+            measure('kpi', 'batch', dict(params, processes=runner._num_processes()), items,
+                    lambda: generators.make_portfolio(num_projects, num_kpis, seed=seed), runner.run, repeat),
+            measure('kpi', 'rank', params, items, evaluated, rank, repeat)]
+
+
+def run_all(args):
+    work_dir = tempfile.mkdtemp(prefix='inforecast_bench_')
+    results = []
+    try:
+        for num_rows in args.rows:
+            for num_cols in args.cols:
+                results += bench_tracker(work_dir, num_rows, num_cols, args.repeat, args.seed)
+        for depth in args.depth:
+            results += bench_rollup(work_dir, depth, args.fan_out, args.repeat, args.seed)
+        for num_projects in args.projects:
+            results += bench_kpis(num_projects, args.kpis, args.repeat, args.seed, args.processes)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+
+def case_key(result: dict):
+    return result['suite'], result['case'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD):
+    '''
+    Median time of each case relative to the baseline run
+    :return: pd.DataFrame with one row per case present in both runs, and the regression flag
+    '''
+    base = {case_key(x): x for x in baseline['results']}
+    rows = []
+    for result in results['results']:
+        key = case_key(result)
+        if key not in base:
+            continue
+        ratio = result['median_s'] / base[key]['median_s'] if base[key]['median_s'] else None
+        rows.append({'suite': key[0], 'case': key[1], 'params': key[2], 'baseline_s': base[key]['median_s'],
+                     'median_s': result['median_s'], 'ratio': ratio,
+                     'regression': ratio is not None and ratio > threshold})
+    return pd.DataFrame(rows, columns=['suite', 'case', 'params', 'baseline_s', 'median_s', 'ratio', 'regression'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000], help='tracker sizes')
+    parser.add_argument('--cols', type=int, nargs='+', default=[10], help='tracker widths, WPId included')
+    parser.add_argument('--depth', type=int, nargs='+', default=[3, 5], help='work package hierarchy depths')
+    parser.add_argument('--fan-out', type=int, default=6, help='children per work package')
+    parser.add_argument('--projects', type=int, nargs='+', default=[10, 100], help='portfolio sizes')
+    parser.add_argument('--kpis', type=int, default=25, help='KPIs per project')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='process pool size of the batch KPI evaluation, the number of CPUs by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='smallest sizes only, to check the suite runs')
+    parser.add_argument('--out', default=None, help='results file, benchmarks/results/<commit>.json by default')
+    parser.add_argument('--compare', default=None, help='results file of a baseline run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='median time ratio reported as a regression')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.rows, args.cols, args.depth, args.projects, args.repeat = [1000], [10], [3], [10], 1
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    warnings.simplefilter('ignore')
+    results = run_all(args)
+
+    out = args.out
+    if out is None:
+        out = os.path.join(REPO_DIR, 'benchmarks', 'results', f'{results["meta"]["commit"] or "local"}.json')
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(pd.DataFrame(results['results'])[['suite', 'case', 'params', 'min_s', 'median_s', 'items_per_s']])
+        print(f'Results written to: {out}')
+        if args.compare:
+            with open(args.compare) as f:
+                comparison = compare(results, json.load(f), args.threshold)
+            print(comparison)
+            if comparison['regression'].any():
+                print(f'Regressions above x{args.threshold}: {int(comparison["regression"].sum())}')
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
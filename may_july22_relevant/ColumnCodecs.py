@@ -0,0 +1,272 @@
+import datetime
+import json
+import os
+import time
+import zlib
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from helper_fundtions import atomic_write
+
+
+# delta: first differences of integer or date values, for monotonic columns such as the index
+# dictionary: distinct values plus narrow integer codes, for option columns
+# zlib: general purpose codec for the rest
+CODECS = ['delta', 'dictionary', 'zlib']
+ZLIB_LEVEL = 6
+FILE_EXT = '.npz'
+
+
+def _narrow(values: np.ndarray):
+    ''' Smallest integer dtype holding all the values '''
+    if not len(values):
+        return values.astype(np.int8)
+    lo, hi = values.min(), values.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def _pack(arr: np.ndarray):
+    return np.frombuffer(zlib.compress(arr.tobytes(), ZLIB_LEVEL), dtype=np.uint8)
+
+
+def _unpack(payload: np.ndarray, dtype: str):
+    return np.frombuffer(zlib.decompress(payload.tobytes()), dtype=np.dtype(dtype))
+
+
+def _pack_objects(values: np.ndarray):
+    '''
+    Python dates as int64 microseconds, strings, numbers and booleans as json. Other objects are refused: files
+    are read back without executing anything, so nothing is pickled
+    :return: (kind, payload)
+    '''
+    items = [x.item() if isinstance(x, np.generic) else x for x in values.tolist()]
+    present = [x for x in items if x is not None]
+    if present and all(isinstance(x, datetime.datetime) for x in present):
+        stamps = pd.to_datetime(pd.Series(items, dtype=object)).to_numpy('datetime64[us]')
+        return 'pydatetime', _pack(stamps.view(np.int64))
+    for x in present:
+        if not isinstance(x, (str, int, float, bool)):
+            raise TypeError(f'Object column values cannot be stored: {type(x).__name__}')
+    return 'json', np.frombuffer(zlib.compress(json.dumps(items).encode(), ZLIB_LEVEL), dtype=np.uint8)
+
+
+def _unpack_objects(payload: np.ndarray, kind: str):
+    if kind == 'pydatetime':
+        stamps = _unpack(payload, '<i8').view('datetime64[us]')
+        out = np.empty(len(stamps), dtype=object)
+        present = ~np.isnat(stamps)
+        out[present] = pd.DatetimeIndex(stamps[present]).to_pydatetime()
+        return out
+    if kind != 'json':
+        raise ValueError(f'Unsupported encoding of an object column: {kind}')
+    items = json.loads(zlib.decompress(payload.tobytes()).decode())
+    out = np.empty(len(items), dtype=object)
+    out[:] = items
+    return out
+
+
+def choose_codec(dtype: np.dtype, is_index: bool = False, is_date: bool = False, has_options: bool = False):
+    '''
+    Codec for a column given its storage: delta for the index and date columns, dictionary for option
+    columns, zlib otherwise
+    '''
+    dtype = np.dtype(dtype)
+    if (is_index or is_date) and (dtype.kind in 'iumM' or dtype == object):
+        return 'delta'
+    if has_options:
+        return 'dictionary'
+    return 'zlib'
+
+
+def encode_column(values: np.ndarray, valid: np.ndarray, codec: str):
+    '''
+    :param values: column values; entries where valid is False are not encoded
+    :param valid: bool array, True where a value is present
+    :param codec: one of CODECS
+    :return: (meta dict, {part name: np.uint8 array}); meta is json serialisable
+    '''
+    assert codec in CODECS, f'Unknown codec: {codec}'
+    values = np.asarray(values)
+    valid = np.asarray(valid, dtype=bool)
+    meta = {'codec': codec, 'dtype': values.dtype.str, 'n': int(len(values))}
+    parts = {'validity': _pack(np.packbits(valid, bitorder='little'))}
+
+    if codec == 'delta':
+        if values.dtype == object:
+            # python dates, stored as microseconds
+            meta['kind'] = 'pydatetime'
+            values = pd.to_datetime(pd.Series(np.where(valid, values, None))).to_numpy('datetime64[us]')
+        ints = values.view(np.int64) if values.dtype.kind in 'mM' else values.astype(np.int64)
+        # missing entries repeat the previous value so they cost a zero delta
+        ints = np.where(valid, ints, 0)
+        if not valid.all():
+            last = np.maximum.accumulate(np.where(valid, np.arange(len(ints)), 0))
+            ints = ints[last]
+        deltas = _narrow(np.diff(ints, prepend=np.int64(0)))
+        meta['width'] = deltas.dtype.str
+        parts['values'] = _pack(deltas)
+    elif codec == 'dictionary':
+        codes, uniques = pd.factorize(pd.Series(values[valid], dtype=object if values.dtype == object else None))
+        all_codes = np.zeros(len(values), dtype=np.int64)
+        all_codes[valid] = codes
+        all_codes = _narrow(all_codes)
+        meta['width'] = all_codes.dtype.str
+        parts['values'] = _pack(all_codes)
+        uniques = np.asarray(uniques, dtype=values.dtype if values.dtype != object else object)
+        if values.dtype == object:
+            meta['kind'], parts['uniques'] = _pack_objects(uniques)
+        else:
+            parts['uniques'] = _pack(uniques)
+    elif values.dtype == object:
+        meta['kind'], parts['values'] = _pack_objects(np.where(valid, values, None))
+    elif values.dtype.kind in 'iu':
+        narrow = _narrow(np.where(valid, values, 0))
+        meta['width'] = narrow.dtype.str
+        parts['values'] = _pack(narrow)
+    else:
+        parts['values'] = _pack(values)
+
+    return meta, parts
+
+
+def decode_column(meta: dict, parts: dict):
+    '''
+    Reverse of encode_column
+    :return: (values, valid)
+    '''
+    n = meta['n']
+    valid = np.unpackbits(_unpack(parts['validity'], 'u1'), bitorder='little')[:n].astype(bool)
+    dtype = np.dtype(meta['dtype'])
+
+    if meta['codec'] == 'delta':
+        ints = np.cumsum(_unpack(parts['values'], meta['width']).astype(np.int64))
+        if meta.get('kind') == 'pydatetime':
+            values = np.empty(n, dtype=object)
+            values[valid] = pd.DatetimeIndex(ints[valid].astype('datetime64[us]')).to_pydatetime()
+        elif dtype.kind in 'mM':
+            values = ints.view(dtype)
+        else:
+            values = ints.astype(dtype)
+    elif meta['codec'] == 'dictionary':
+        codes = _unpack(parts['values'], meta['width']).astype(np.int64)
+        if dtype == object:
+            uniques = _unpack_objects(parts['uniques'], meta['kind'])
+        else:
+            uniques = _unpack(parts['uniques'], meta['dtype'])
+        values = np.empty(n, dtype=dtype) if dtype == object else np.zeros(n, dtype=dtype)
+        values[valid] = uniques[codes[valid]]
+    elif dtype == object:
+        values = _unpack_objects(parts['values'], meta['kind'])
+    elif 'width' in meta:
+        values = _unpack(parts['values'], meta['width']).astype(dtype)
+    else:
+        values = _unpack(parts['values'], meta['dtype']).copy()
+
+    return values, valid
+
+
+def _raw_nbytes(values: np.ndarray, valid: np.ndarray):
+    ''' Uncompressed size of a column: fixed width values, or the utf-8 text of objects, plus one byte per row '''
+    if values.dtype == object:
+        return int(sum(len(str(x).encode()) for x in values[valid]) + len(values))
+    return int(values.nbytes + len(valid))
+
+
+def save_columns(path: str, columns: Dict[str, tuple], meta: dict = None):
+    '''
+    Writes columns to a single .npz file, each column encoded with its own codec. Parts are stored as separate
+    members of the archive so columns can be read on their own
+    :param path: file path, FILE_EXT is appended if missing
+    :param columns: {column name: (values, valid, codec)}
+    :param meta: extra json serialisable information stored in the header
+    :return: dict {column name: {'codec', 'raw_bytes', 'encoded_bytes', 'ratio', 'encode_mb_s'}}
+    '''
+    if not path.endswith(FILE_EXT):
+        path += FILE_EXT
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    header = {'columns': {}, 'meta': meta if meta else {}}
+    arrays = {}
+    stats = {}
+    for i, col in enumerate(columns):
+        values, valid, codec = columns[col]
+        start = time.perf_counter()
+        col_meta, parts = encode_column(values, valid, codec)
+        elapsed = time.perf_counter() - start
+
+        # member names must be valid file names inside the archive, columns are referred to by position
+        col_meta['parts'] = {}
+        for part in parts:
+            member = f'c{i}_{part}'
+            arrays[member] = parts[part]
+            col_meta['parts'][part] = member
+        header['columns'][col] = col_meta
+
+        raw = _raw_nbytes(np.asarray(values), np.asarray(valid, dtype=bool))
+        encoded = int(sum(x.nbytes for x in parts.values()))
+        stats[col] = {
+            'codec': codec,
+            'raw_bytes': raw,
+            'encoded_bytes': encoded,
+            'ratio': raw / encoded if encoded else None,
+            'encode_mb_s': raw / elapsed / 1e6 if elapsed > 0 else None
+        }
+
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    # parts are compressed already
+    with atomic_write(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+    return stats
+
+
+class ColumnFile:
+    def __init__(self, path: str):
+        '''
+        Reader of a file written by save_columns. Only the header is read when opening,
+        each column is decompressed when it is first requested
+        '''
+        if not path.endswith(FILE_EXT):
+            path += FILE_EXT
+        assert os.path.exists(path), f'Column file not found: {path}'
+        self.path: str = path
+        self._npz = np.load(path, allow_pickle=False)
+        header = json.loads(self._npz['header'].tobytes().decode())
+        self.columns: Dict[str, dict] = header['columns']
+        self.meta: dict = header['meta']
+        # column name: {'decode_mb_s'}
+        self.stats: Dict[str, dict] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._npz.close()
+
+    def num_rows(self):
+        return next(iter(self.columns.values()))['n'] if self.columns else 0
+
+    def read(self, col: str):
+        '''
+        :return: (values, valid) of a column
+        '''
+        assert col in self.columns, f'Column not in the file: {col}'
+        col_meta = self.columns[col]
+        start = time.perf_counter()
+        parts = {part: self._npz[member] for part, member in col_meta['parts'].items()}
+        values, valid = decode_column(col_meta, parts)
+        elapsed = time.perf_counter() - start
+        raw = _raw_nbytes(values, valid)
+        self.stats[col] = {'decode_mb_s': raw / elapsed / 1e6 if elapsed > 0 else None}
+        return values, valid
@@ -0,0 +1,557 @@
+import os
+import sys
+import warnings
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import ColumnCodecs
+from StringPool import StringPool
+from Table import Table
+from data_types import InforecastDataTypes
+from helper_fundtions import Instrumentation
+
+
+def column_dtype(dtype: InforecastDataTypes):
+    '''
+    numpy dtype used to store a column of the given InforecastDataTypes.
+    Numbers, booleans and numpy dates are stored natively, anything else as python objects
+    '''
+    try:
+        np_dtype = np.dtype(dtype.value)
+    except TypeError:
+        return np.dtype(object)
+
+    if np_dtype.kind in 'biufmM':
+        return np_dtype
+    return np.dtype(object)
+
+
+def aggregate_values(values: np.ndarray, valid: np.ndarray, func: str = 'sum'):
+    '''
+    Aggregates the present values of a column
+    :param func: one of 'sum', 'mean', 'min', 'max', 'count'
+    :return: aggregated value, None if there are no values
+    '''
+    values = values[valid]
+    if func == 'count':
+        return int(len(values))
+    if not len(values):
+        return None
+    if func == 'sum':
+        return values.sum()
+    if func == 'mean':
+        return values.mean()
+    if func == 'min':
+        return values.min()
+    if func == 'max':
+        return values.max()
+    raise RuntimeError(f'Unknown aggregation: {func}')
+
+
+def filter_positions(table, predicates: list, positions: np.ndarray = None):
+    '''
+    Row positions matching all predicates, each predicate evaluated only on the rows matching the previous ones
+    :param table: table with a get_column(col, codes, positions) method, see TrackerQuery.Predicate.mask
+    :param predicates: list of TrackerQuery.Predicate
+    :param positions: row positions to filter, all rows if None
+    :return: np.int64 array of positions
+    '''
+    for predicate in predicates:
+        if positions is not None and not len(positions):
+            break
+        mask = predicate.mask(table, positions)
+        positions = np.flatnonzero(mask) if positions is None else positions[mask]
+    return positions if positions is not None else np.arange(table.num_rows())
+
+
+class TypedColumn:
+    def __init__(self, dtype: np.dtype, capacity: int = 16):
+        '''
+        Growable typed buffer with a validity bitmap: bit i is set when row i holds a value,
+        missing values are not stored as None objects
+        :param dtype: numpy dtype of the values
+        :param capacity: number of rows initially allocated, grows by doubling
+        '''
+        self.dtype: np.dtype = np.dtype(dtype)
+        self._size: int = 0
+        self._values: np.ndarray = self._allocate(capacity)
+        self._validity: np.ndarray = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+
+    def __len__(self):
+        return self._size
+
+    def _allocate(self, capacity: int):
+        if self.dtype == object:
+            return np.empty(capacity, dtype=object)
+        return np.zeros(capacity, dtype=self.dtype)
+
+    def _grow(self, capacity: int):
+        values = self._allocate(capacity)
+        values[:self._size] = self._values[:self._size]
+        self._values = values
+
+        validity = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        validity[:len(self._validity)] = self._validity
+        self._validity = validity
+
+    def append(self, value):
+        if self._size == len(self._values):
+            self._grow(max(2 * len(self._values), 16))
+        self._size += 1
+        self.set(self._size - 1, value)
+
+    def extend(self, values: np.ndarray, valid: np.ndarray):
+        '''
+        Appends many values at once
+        :param values: array of values, entries where valid is False are ignored
+        :param valid: bool array, same length as values
+        '''
+        self._extend_raw(values, valid)
+
+    def _extend_raw(self, values: np.ndarray, valid: np.ndarray):
+        new_size = self._size + len(values)
+        if new_size > len(self._values):
+            capacity = max(len(self._values), 16)
+            while capacity < new_size:
+                capacity *= 2
+            self._grow(capacity)
+
+        valid = np.asarray(valid, dtype=bool)
+        bits = np.concatenate([self.validity(), valid])
+
+        start = self._size
+        self._size = new_size
+        if self.dtype == object:
+            values = np.asarray(values, dtype=object)
+            self._values[start:new_size] = np.where(valid, values, None)
+        else:
+            self._values[start:new_size] = np.asarray(values, dtype=self.dtype)
+
+        packed = np.packbits(bits, bitorder='little')
+        self._validity[:len(packed)] = packed
+
+    def compact(self, keep: np.ndarray):
+        '''
+        Drops rows in one pass
+        :param keep: bool array over the current rows, False for the rows to drop
+        '''
+        values = self.values()[keep]
+        valid = self.validity()[keep]
+        self._size = 0
+        self._extend_raw(values, valid)
+
+    def set(self, position: int, value):
+        assert 0 <= position < self._size, f'Row position out of range: {position}'
+        if value is None:
+            self._validity[position >> 3] &= np.uint8(~(1 << (position & 7)) & 0xFF)
+            if self.dtype == object:
+                self._values[position] = None
+            return
+
+        self._values[position] = value
+        self._validity[position >> 3] |= np.uint8(1 << (position & 7))
+
+    def is_valid(self, position: int):
+        return bool(self._validity[position >> 3] & (1 << (position & 7)))
+
+    def get(self, position: int):
+        assert 0 <= position < self._size, f'Row position out of range: {position}'
+        if not self.is_valid(position):
+            return None
+        return self._values[position]
+
+    def values(self):
+        ''' View of the stored values; entries of missing values are undefined '''
+        return self._values[:self._size]
+
+    def decoded(self, positions: np.ndarray = None):
+        '''
+        Column values as seen by users of the table; same as values() except for pooled columns
+        :param positions: row positions, all rows if None
+        '''
+        return self.values() if positions is None else self.values()[positions]
+
+    def validity(self, positions: np.ndarray = None):
+        '''
+        Bool array, True where a value is present
+        :param positions: row positions, all rows if None; only their bits are read
+        '''
+        if positions is None:
+            return np.unpackbits(self._validity, bitorder='little')[:self._size].astype(bool)
+        positions = np.asarray(positions, dtype=np.int64)
+        return ((self._validity[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def null_count(self):
+        return int(self._size - self.validity().sum())
+
+    def nbytes(self):
+        ''' Memory used by the column: values buffer, bitmap and, for object columns, the objects themselves '''
+        total = self._values.nbytes + self._validity.nbytes
+        if self.dtype == object:
+            total += sum(sys.getsizeof(x) for x in self.values() if x is not None)
+        return int(total)
+
+    def take(self, positions: np.ndarray = None):
+        '''
+        Values at the given row positions with missing values as NA, ready for pandas
+        :param positions: row positions, all rows if None
+        '''
+        values = self.values() if positions is None else self.values()[positions]
+        valid = self.validity(positions)
+
+        if self.dtype.kind in 'iu':
+            return pd.arrays.IntegerArray(values.copy(), ~valid)
+        elif self.dtype.kind == 'b':
+            return pd.arrays.BooleanArray(values.copy(), ~valid)
+        elif self.dtype.kind == 'f':
+            return np.where(valid, values, np.nan)
+        elif self.dtype.kind in 'mM':
+            return np.where(valid, values, np.array('NaT', dtype=self.dtype))
+        return values.copy()
+
+    def to_series(self, index=None):
+        ''' pandas Series with missing values as NA '''
+        return pd.Series(self.take(), index=index)
+
+
+class PooledColumn(TypedColumn):
+    def __init__(self, pool: StringPool, capacity: int = 16):
+        '''
+        String column storing StringPool codes instead of the strings: repeated values cost one integer per row
+        :param pool: pool shared by the pooled columns of a tracker
+        '''
+        super(PooledColumn, self).__init__(np.int64, capacity)
+        self.pool: StringPool = pool
+
+    def extend(self, values: np.ndarray, valid: np.ndarray):
+        valid = np.asarray(valid, dtype=bool)
+        self._extend_raw(self.pool.intern_array(values, valid), valid)
+
+    def extend_codes(self, codes: np.ndarray, valid: np.ndarray):
+        ''' Appends codes already in the pool, e.g. when loading a saved table '''
+        self._extend_raw(codes, valid)
+
+    def set(self, position: int, value):
+        super(PooledColumn, self).set(position, None if value is None else self.pool.intern(value))
+
+    def get(self, position: int):
+        code = super(PooledColumn, self).get(position)
+        return None if code is None else self.pool.get(code)
+
+    def decoded(self, positions: np.ndarray = None):
+        ''' Object array of strings, None for missing values; only the strings at positions if given '''
+        codes = self.values() if positions is None else self.values()[positions]
+        return self.pool.decode(codes, self.validity(positions))
+
+    def take(self, positions: np.ndarray = None):
+        return self.decoded(positions)
+
+    def codes_series(self, index=None):
+        ''' pandas Series of the codes, missing values as NA '''
+        return pd.Series(super(PooledColumn, self).take(), index=index)
+
+
+class ColumnarTable(Table):
+    def __init__(self):
+        '''
+        Table storing each column in a TypedColumn instead of a DataFrame. Rows are appended in place,
+        the DataFrame is only built when the table is saved or exported
+        '''
+        super(ColumnarTable, self).__init__()
+        self._columns: Dict[str, TypedColumn] = {}
+        self._dtypes: Dict[str, np.dtype] = {}
+        # index value: row position
+        self._positions: dict = {}
+        self._index_values: TypedColumn = None
+        self._num_rows: int = 0
+        # shared by the pooled columns
+        self.pool: StringPool = None
+
+    def create_table(self, columns: list, index: str = None, dtypes: Dict[str, np.dtype] = None,
+                     pooled: list = None, pool: StringPool = None):
+        '''
+        :param columns: list of column names, including the index column
+        :param index: column used as index, None to index rows by position
+        :param dtypes: {column name: numpy dtype}; columns not listed are stored as objects
+        :param pooled: string columns stored as codes of a StringPool, see PooledColumn
+        :param pool: pool of the pooled columns, a new one if None
+        :return: Nothing
+        '''
+        assert len(columns) > 0
+        assert type(columns[0]) is str, f'List of strings is expected as input. Got: {columns[0].type}'
+        dtypes = dtypes if dtypes else {}
+
+        self._index = index
+        self._cols_list = columns
+        self._dtypes = {}
+        self._columns = {}
+        pooled = pooled if pooled else []
+        self.pool = pool if pool is not None or not pooled else StringPool()
+        for col in columns:
+            self._dtypes[col] = np.dtype(dtypes.get(col, object))
+            if col in pooled and col != index:
+                self._columns[col] = PooledColumn(self.pool)
+            elif col != index:
+                self._columns[col] = TypedColumn(self._dtypes[col])
+
+        self._index_values = TypedColumn(self._dtypes[index] if index else np.int64)
+        self._positions = {}
+        self._num_rows = 0
+
+    def num_rows(self):
+        return self._num_rows
+
+    def insert_row(self, new_row: dict):
+        assert self._columns or self._index_values is not None
+        row_cols = list(new_row.keys())
+        assert sorted(row_cols) == sorted(self._cols_list), 'Row columns do not match the table columns'
+
+        if self._index:
+            assert self._index in new_row.keys(), 'Table index not found in the row being inserted'
+            index = new_row[self._index]
+        else:
+            index = self._num_rows
+        assert index not in self._positions, f'Index value already in the table: {index}'
+
+        self._positions[index] = self._num_rows
+        self._index_values.append(index)
+        for col in self._columns:
+            self._columns[col].append(new_row[col])
+        self._num_rows += 1
+
+    def delete_rows(self, index_values: list):
+        '''
+        Removes rows; the remaining rows keep their order, their positions shift
+        :param index_values: index values of the rows to remove
+        :return: Nothing
+        '''
+        if not index_values:
+            return
+
+        keep = np.ones(self._num_rows, dtype=bool)
+        keep[[self.get_position(x) for x in index_values]] = False
+
+        self._index_values.compact(keep)
+        for col in self._columns:
+            self._columns[col].compact(keep)
+        self._num_rows = int(keep.sum())
+        self._positions = {x: i for i, x in enumerate(self._index_values.values().tolist())}
+
+    def has_index(self, indx):
+        return indx in self._positions
+
+    def get_position(self, indx):
+        assert indx in self._positions, f'Index value not in the table: {indx}'
+        return self._positions[indx]
+
+    def get_index_name(self):
+        return self._index_values.values()
+
+    def get_pooled(self):
+        ''' Names of the pooled columns '''
+        return [col for col in self._columns if isinstance(self._columns[col], PooledColumn)]
+
+    def set_pool(self, pool: StringPool):
+        ''' Points the pooled columns to another pool holding the same codes, e.g. after unpickling '''
+        self.pool = pool
+        for col in self.get_pooled():
+            self._columns[col].pool = pool
+
+    def get_value(self, indx, col: str):
+        return self._columns[col].get(self.get_position(indx))
+
+    def set_value(self, indx, col: str, val):
+        self._columns[col].set(self.get_position(indx), val)
+
+    def get_row(self, indx):
+        position = self.get_position(indx)
+        row = {col: self._columns[col].get(position) for col in self._columns}
+        if self._index:
+            row[self._index] = indx
+        return row
+
+    def iter_rows(self):
+        ''' Yields (index value, row dict) for all rows, in insertion order '''
+        columns = {col: (self._columns[col].decoded(), self._columns[col].validity()) for col in self._columns}
+        for position, indx in enumerate(self._index_values.values().tolist()):
+            row = {col: columns[col][0][position] if columns[col][1][position] else None for col in columns}
+            if self._index:
+                row[self._index] = indx
+            yield indx, row
+
+    def take(self, col: str, positions: np.ndarray = None):
+        ''' Values of a column at the given row positions, missing values as NA '''
+        return self._columns[col].take(positions)
+
+    def get_column(self, col: str, codes: bool = False, positions: np.ndarray = None):
+        '''
+        :param codes: True to get the pool codes of a pooled column instead of the strings
+        :param positions: row positions to read, all rows if None; other rows are not decoded
+        :return: (values, validity) numpy arrays over the rows; values where validity is False are undefined
+        '''
+        column = self._columns[col]
+        if codes:
+            values = column.values() if positions is None else column.values()[positions]
+        else:
+            values = column.decoded(positions)
+        return values, column.validity(positions)
+
+    def aggregate(self, col: str, func: str = 'sum'):
+        ''' Aggregates the present values of a column, see aggregate_values '''
+        values, valid = self.get_column(col)
+        return aggregate_values(values, valid, func)
+
+    def filter(self, predicates: list, positions: np.ndarray = None):
+        ''' Row positions matching all predicates, see filter_positions '''
+        return filter_positions(self, predicates, positions)
+
+    def validate_columns(self, validators: dict):
+        '''
+        :param validators: {column name: ValidationRules.ColumnValidator}
+        :return: dict {column name: list of index values holding invalid values}
+        '''
+        index_values = self.get_index_name()
+        out = {}
+        for col in validators:
+            values, valid = self.get_column(col)
+            ok = validators[col].validate_array(values, valid)
+            out[col] = index_values[~ok].tolist()
+        return out
+
+    def memory_usage(self):
+        ''' {column name: bytes}, including the index column; the string pool is not included '''
+        out = {col: self._columns[col].nbytes() for col in self._columns}
+        out[self._index if self._index else 'index'] = self._index_values.nbytes()
+        return out
+
+    def to_dataframe(self, codes: bool = False):
+        '''
+        :param codes: True to output the pool codes of the pooled columns instead of the strings
+        '''
+        index = pd.Index(self._index_values.values().copy(), name=self._index)
+        data = {}
+        for col in self._columns:
+            if codes and isinstance(self._columns[col], PooledColumn):
+                data[col] = self._columns[col].codes_series(index=index)
+            else:
+                data[col] = self._columns[col].to_series(index=index)
+        return pd.DataFrame(data, index=index)
+
+    def from_dataframe(self, df: pd.DataFrame, index: str = None, dtypes: Dict[str, np.dtype] = None,
+                       pooled: list = None, pool: StringPool = None, codes: bool = False):
+        '''
+        Replaces the content of the table with a DataFrame, one column at a time
+        :param df: data; if index is given, the DataFrame index holds the index values
+        :param pooled: string columns to store in a StringPool, see create_table
+        :param codes: True if the pooled columns of df hold codes of the given pool instead of strings
+        '''
+        columns = list(df.columns) + ([index] if index else [])
+        self.create_table(columns=columns, index=index, dtypes=dtypes, pooled=pooled, pool=pool)
+
+        valid_index = np.ones(len(df), dtype=bool)
+        if index:
+            self._index_values.extend(df.index.to_numpy(), valid_index)
+            self._positions = {x: i for i, x in enumerate(df.index.tolist())}
+        else:
+            self._index_values.extend(np.arange(len(df)), valid_index)
+            self._positions = {i: i for i in range(len(df))}
+
+        for col in df.columns:
+            series = df[col]
+            valid = series.notna().to_numpy()
+            dtype = self._dtypes[col]
+            if codes and isinstance(self._columns[col], PooledColumn):
+                self._columns[col].extend_codes(series.to_numpy(dtype=np.int64, na_value=0), valid)
+                continue
+            if dtype == object:
+                values = series.to_numpy(dtype=object)
+            else:
+                values = series.to_numpy(dtype=dtype, na_value=np.zeros(1, dtype=dtype)[0])
+            self._columns[col].extend(values, valid)
+
+        self._num_rows = len(df)
+
+    def save_table(self, table_path: str, table_name: str):
+        '''
+        Saves the table as csv; pooled columns are written as codes, the pool itself is saved separately
+        '''
+        self._table = self.to_dataframe(codes=True)
+        super(ColumnarTable, self).save_table(table_path=table_path, table_name=table_name)
+        self._table = None
+
+    def save_compressed(self, table_path: str, table_name: str, codecs: Dict[str, str] = None):
+        '''
+        Saves the table as a single .npz file, each column compressed with its own codec (see ColumnCodecs).
+        Pooled columns are written as codes, the pool itself is saved separately
+        :param codecs: {column name: codec}; the index defaults to delta encoding, other columns to zlib
+        :return: dict {column name: compression stats}, see ColumnCodecs.save_columns
+        '''
+        codecs = codecs if codecs else {}
+        index = self._index if self._index else 'index'
+        columns = {index: (self._index_values.values(), self._index_values.validity(), codecs.get(index, 'delta'))}
+        for col in self._columns:
+            columns[col] = (self._columns[col].values(), self._columns[col].validity(), codecs.get(col, 'zlib'))
+
+        meta = {'index': self._index, 'pooled': self.get_pooled()}
+        return ColumnCodecs.save_columns(os.path.join(table_path, table_name), columns, meta=meta)
+
+    def load_compressed(self, table_path: str, table_name: str, dtypes: Dict[str, np.dtype] = None,
+                        pool: StringPool = None):
+        '''
+        Loads a table written by save_compressed
+        :param dtypes: {column name: numpy dtype}; by default the dtypes stored in the file
+        :param pool: StringPool holding the codes of the pooled columns, loaded beforehand
+        :return: dict {column name: {'decode_mb_s'}}
+        '''
+        with ColumnCodecs.ColumnFile(os.path.join(table_path, table_name)) as column_file:
+            index = column_file.meta['index']
+            pooled = column_file.meta['pooled']
+            columns = list(column_file.columns.keys())
+            dtypes = dtypes if dtypes else {}
+            dtypes = {col: dtypes.get(col, object if col in pooled else column_file.columns[col]['dtype'])
+                      for col in columns}
+            self.create_table(columns=columns, index=index, dtypes=dtypes, pooled=pooled, pool=pool)
+
+            values, valid = column_file.read(columns[0])
+            self._index_values.extend(values, valid)
+            self._positions = {x: i for i, x in enumerate(values.tolist())}
+            for col in columns[1:]:
+                values, valid = column_file.read(col)
+                if col in pooled:
+                    self._columns[col].extend_codes(values, valid)
+                else:
+                    self._columns[col].extend(values, valid)
+            self._num_rows = len(self._positions)
+            return dict(column_file.stats)
+
+    def load_table(self, table_path: str, table_name: str, index: str = None, dtypes: Dict[str, np.dtype] = None,
+                   pooled: list = None, pool: StringPool = None, parse_dates: list = None):
+        '''
+        :param pooled: columns saved as codes of the pool
+        :param pool: StringPool holding the saved codes, loaded beforehand
+        :param parse_dates: object columns holding python datetimes, written as text in the csv
+        '''
+        super(ColumnarTable, self).load_table(table_path=table_path, table_name=table_name)
+        df = self._table
+        self._table = None
+
+        # to_csv writes the index as the first column
+        index_col = df.columns[0]
+        df = df.set_index(index_col)
+        if index and index_col != index:
+            warnings.warn(f'Index column in the file ({index_col}) differs from the expected one: {index}')
+        for col in parse_dates if parse_dates else []:
+            dates = pd.to_datetime(df[col])
+            valid = dates.notna().to_numpy()
+            values = np.empty(len(df), dtype=object)
+            values[valid] = pd.DatetimeIndex(dates[valid]).to_pydatetime()
+            df[col] = pd.Series(values, index=df.index, dtype=object)
+
+        self.from_dataframe(df, index=index if index else None, dtypes=dtypes, pooled=pooled, pool=pool,
+                            codes=True)
+
+
+Instrumentation.register(ColumnarTable, ['insert_row', 'save_table', 'load_table', 'save_compressed',
+                                        'load_compressed'])
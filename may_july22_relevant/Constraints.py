@@ -0,0 +1,227 @@
+import warnings
+from typing import Dict, List
+
+
+class Constraint:
+    def __init__(self, name: str, cols: list):
+        '''
+        Base class of tracker constraints. Changes are described as (old_row, new_row): old_row is None for an
+        insert and new_row is None for a delete. Rows are dicts {col_tag: value}, missing values are None
+        :param name: name used in violation messages
+        :param cols: tags of the columns the constraint depends on; changes to other columns are not checked
+        '''
+        self.name: str = name
+        self.cols: list = cols
+
+    def check(self, old_row: dict, new_row: dict):
+        ''' Returns a violation message if the change breaks the constraint, None otherwise '''
+        return None
+
+    def apply(self, index_val, old_row: dict, new_row: dict):
+        ''' Updates the constraint state once the change is accepted '''
+        pass
+
+    def reset(self):
+        ''' Clears the constraint state '''
+        pass
+
+
+class RowConstraint(Constraint):
+    def __init__(self, name: str, cols: list, predicate):
+        '''
+        Predicate over the values of a single row, e.g. start_date_forecast <= end_date_forecast
+        :param predicate: f(*values of cols, in the order of cols) -> bool; only called when all values are present
+        '''
+        super(RowConstraint, self).__init__(name=name, cols=cols)
+        self.predicate = predicate
+
+    def check(self, old_row: dict, new_row: dict):
+        if new_row is None:
+            return None
+
+        vals = [new_row.get(col) for col in self.cols]
+        if any(x is None for x in vals):
+            return None
+        if not self.predicate(*vals):
+            return f'Constraint [{self.name}] failed for values: {dict(zip(self.cols, vals))}'
+        return None
+
+
+class UniqueConstraint(Constraint):
+    def __init__(self, name: str, col: str):
+        '''
+        Values of the column are unique, missing values are not compared. Keeps a hash index value: index value,
+        which can be referenced by ForeignKeyConstraint
+        '''
+        super(UniqueConstraint, self).__init__(name=name, cols=[col])
+        self.col: str = col
+        self.hash_index: dict = {}
+
+    def lookup(self, value):
+        ''' Index value of the row holding the value, None if not present '''
+        return self.hash_index.get(value)
+
+    def check(self, old_row: dict, new_row: dict):
+        if new_row is None:
+            return None
+
+        value = new_row.get(self.col)
+        if value is None:
+            return None
+        if old_row is not None and old_row.get(self.col) == value:
+            return None
+        if value in self.hash_index:
+            return f'Constraint [{self.name}] failed: value already exists in [{self.col}]: {value}'
+        return None
+
+    def apply(self, index_val, old_row: dict, new_row: dict):
+        if old_row is not None and old_row.get(self.col) is not None:
+            self.hash_index.pop(old_row[self.col], None)
+        if new_row is not None and new_row.get(self.col) is not None:
+            self.hash_index[new_row[self.col]] = index_val
+
+    def reset(self):
+        self.hash_index = {}
+
+
+class ForeignKeyConstraint(Constraint):
+    def __init__(self, name: str, col: str, ref: UniqueConstraint):
+        '''
+        Values of the column must exist in the column indexed by ref, in this or another tracker.
+        Only changes to the referencing column are checked, deleting a referenced row is not prevented
+        :param ref: unique constraint of the referenced column
+        '''
+        super(ForeignKeyConstraint, self).__init__(name=name, cols=[col])
+        self.col: str = col
+        self.ref: UniqueConstraint = ref
+
+    def check(self, old_row: dict, new_row: dict):
+        if new_row is None:
+            return None
+
+        value = new_row.get(self.col)
+        if value is None or value in self.ref.hash_index:
+            return None
+        # a row may reference itself, e.g. a root work package being its own parent
+        if self.ref.col in new_row and new_row[self.ref.col] == value and self.ref.check(old_row, new_row) is None:
+            return None
+        return f'Constraint [{self.name}] failed: [{self.col}] value not found in [{self.ref.col}]: {value}'
+
+
+class AggregateConstraint(Constraint):
+    def __init__(self, name: str, group_col: str, value_col: str, key_col: str, limit_col: str):
+        '''
+        Sum of value_col over the rows of a group must not exceed the limit of the row identified by the group,
+        e.g. the sum of child costs (group_col: parent, value_col: cost) not exceeding the parent budget
+        (key_col: WPId, limit_col: budget). Sums and limits are kept per group and updated by deltas
+        '''
+        super(AggregateConstraint, self).__init__(name=name, cols=[group_col, value_col, key_col, limit_col])
+        self.group_col: str = group_col
+        self.value_col: str = value_col
+        self.key_col: str = key_col
+        self.limit_col: str = limit_col
+        # group: sum of value_col
+        self.sums: dict = {}
+        # key: limit
+        self.limits: dict = {}
+
+    def _effects(self, old_row: dict, new_row: dict):
+        ''' Changes to the group sums and limits caused by replacing old_row with new_row '''
+        sum_deltas = {}
+        limit_changes = {}
+
+        for row, sign in [(old_row, -1), (new_row, 1)]:
+            if row is None:
+                continue
+            group = row.get(self.group_col)
+            value = row.get(self.value_col)
+            if group is not None and value is not None:
+                sum_deltas[group] = sum_deltas.get(group, 0) + sign * value
+
+        if old_row is not None and old_row.get(self.key_col) is not None:
+            limit_changes[old_row[self.key_col]] = None
+        if new_row is not None and new_row.get(self.key_col) is not None:
+            limit_changes[new_row[self.key_col]] = new_row.get(self.limit_col)
+
+        return sum_deltas, limit_changes
+
+    def check(self, old_row: dict, new_row: dict):
+        sum_deltas, limit_changes = self._effects(old_row, new_row)
+
+        for group in set(sum_deltas.keys()) | set(limit_changes.keys()):
+            total = self.sums.get(group, 0) + sum_deltas.get(group, 0)
+            limit = limit_changes[group] if group in limit_changes else self.limits.get(group)
+            if limit is not None and total > limit:
+                return f'Constraint [{self.name}] failed: sum of [{self.value_col}] for [{self.group_col}] = ' \
+                       f'{group} would be {total}, limit: {limit}'
+        return None
+
+    def apply(self, index_val, old_row: dict, new_row: dict):
+        sum_deltas, limit_changes = self._effects(old_row, new_row)
+
+        for group in sum_deltas:
+            self.sums[group] = self.sums.get(group, 0) + sum_deltas[group]
+        for key in limit_changes:
+            if limit_changes[key] is None:
+                self.limits.pop(key, None)
+            else:
+                self.limits[key] = limit_changes[key]
+
+    def reset(self):
+        self.sums = {}
+        self.limits = {}
+
+
+class ConstraintEngine:
+    def __init__(self):
+        self.constraints: Dict[str, Constraint] = {}
+
+    def add(self, constraint: Constraint, rows: list = None):
+        '''
+        Adds a constraint and builds its state from the existing rows
+        :param rows: list of (index value, row) already in the tracker
+        :return: list of violation messages; the constraint is only added if there are none
+        '''
+        assert constraint.name not in self.constraints, f'Constraint already exists: {constraint.name}'
+        constraint.reset()
+
+        violations = []
+        for index_val, row in rows if rows else []:
+            violation = constraint.check(None, row)
+            if violation:
+                violations.append(violation)
+            constraint.apply(index_val, None, row)
+
+        if violations:
+            constraint.reset()
+        else:
+            self.constraints[constraint.name] = constraint
+        return violations
+
+    def remove(self, name: str):
+        if name not in self.constraints:
+            warnings.warn(f'Constraint not found: {name}')
+            return False
+        del self.constraints[name]
+        return True
+
+    def check(self, old_row: dict, new_row: dict, changed_cols: list = None):
+        '''
+        :param changed_cols: only the constraints depending on these columns are checked; all if None
+        :return: list of violation messages
+        '''
+        violations = []
+        for constraint in self._relevant(changed_cols):
+            violation = constraint.check(old_row, new_row)
+            if violation:
+                violations.append(violation)
+        return violations
+
+    def apply(self, index_val, old_row: dict, new_row: dict, changed_cols: list = None):
+        for constraint in self._relevant(changed_cols):
+            constraint.apply(index_val, old_row, new_row)
+
+    def _relevant(self, changed_cols: list) -> List[Constraint]:
+        if changed_cols is None:
+            return list(self.constraints.values())
+        return [x for x in self.constraints.values() if any(col in changed_cols for col in x.cols)]
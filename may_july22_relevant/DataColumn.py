@@ -2,8 +2,9 @@ import warnings
 
 from typing import List
 
-from helper_fundtions import generate_tag
-from data_types import InforecastDataTypes
+from helper_fundtions import generate_tag, Instrumentation
+from data_types import InforecastDataTypes, NUM_TYPES
+from ValidationRules import ColumnValidator
 
 
 class DataColumn:
@@ -20,6 +21,10 @@ class DataColumn:
         self.limit: () = None
         self.options: List[dtype] = []
         self.num_options: int = 0
+        # regex the whole value has to match, strings only
+        self.pattern: str = None
+        # compiled from dtype, limit, options and pattern; reset whenever one of them is set
+        self._validator: ColumnValidator = None
 
         # default limit for strings, #chars
         if dtype == InforecastDataTypes.STR:
@@ -30,7 +35,8 @@ class DataColumn:
               f'Column Tag    : {self.tag}\n'
               f'Column Type   : {self.dtype}\n'
               f'Column limit  : {self.limit}\n'
-              f'Column options: {self.options}')
+              f'Column options: {self.options}\n'
+              f'Column pattern: {self.pattern}')
 
     def get_name(self):
         return self.name
@@ -47,37 +53,43 @@ class DataColumn:
     def get_options(self):
         return self.options
 
-    def type_isValid(self, value):
-        return InforecastDataTypes(type(value)) == self.dtype
+    def get_pattern(self):
+        return self.pattern
 
-    def limit_isValid(self, value):
-        if not self.limit:
-            return True
+    def get_validator(self):
+        ''' Validator compiled from the current column constraints, cached until they change '''
+        if self._validator is None:
+            self._validator = ColumnValidator(dtype=self.dtype, limit=self.limit, options=self.options,
+                                              pattern=self.pattern)
+        return self._validator
 
-        if self.dtype == InforecastDataTypes.STR:
-            value = len(value)
+    def type_isValid(self, value):
+        return self.get_validator().type_isValid(value)
 
-        return self.limit[1] > value > self.limit[0]
+    def limit_isValid(self, value):
+        return self.get_validator().limit_isValid(value)
 
     def option_isValid(self, value):
-        if not self.options:
-            return True
-        return value in self.options
+        return self.get_validator().option_isValid(value)
 
     def validate(self, value):
-        if not self.type_isValid(value):
-            return False
-        if not self.limit_isValid(value):
-            return False
-        if not self.option_isValid(value):
-            return False
+        return self.get_validator()(value)
 
-        return True
+    def validate_array(self, values, valid=None):
+        '''
+        Validates many values at once
+        :param values: np.ndarray of values
+        :param valid: bool array, False for missing values which are not validated
+        :return: bool array, True where the value is missing or valid
+        '''
+        return self.get_validator().validate_array(values, valid)
 
     def set_options(self, options: []):
         if not options:
             warnings.warn("Setting column options to an empty list")
             self.options = []
+            self.num_options = 0
+            self._validator = None
             return True
 
         for val in options:
@@ -89,6 +101,16 @@ class DataColumn:
 
         self.options = options
         self.num_options = len(self.options)
+        self._validator = None
+        return True
+
+    def set_pattern(self, pattern: str):
+        if self.dtype != InforecastDataTypes.STR:
+            warnings.warn('At this stage, patterns can only be set for strings')
+            return False
+
+        self.pattern = pattern
+        self._validator = None
         return True
 
     def set_limit(self, limit_dict: dict):
@@ -114,6 +136,11 @@ class DataColumn:
             warnings.warn('At this stage, limits can only be set for numbers and strings')
             self.limit = None
 
+        self._validator = None
+
+
+Instrumentation.register(DataColumn, ['validate', 'validate_array'])
+
 
 if __name__ == '__main__':
     a = DataColumn(dtype=InforecastDataTypes.INT64, name='Test Number')
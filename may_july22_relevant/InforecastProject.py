@@ -1,17 +1,33 @@
 import warnings
-from InforecastTracker import InforecastTracker
+from InforecastTracker import InforecastTracker, read_manifest, manifest_path
+from TrackerCache import TrackerCache
+from TrackerQuery import Predicate, may_match
+from ValidationTable import parse_value
+from data_types import InforecastDataTypes
+from helper_fundtions import generate_tag
+import pandas as pd
+import json
 import os
-from typing import List
+from typing import Dict, List
 
 
 PROJECTS_BASE_DIR = '/test_dir/projects'
+CATALOG_VERSION = 1
 
 
 class InforecastProject:
-    def __int__(self, name):
-        self._trackers: List[InforecastTracker] = []
+    def __init__(self, name: str, base_dir: str = PROJECTS_BASE_DIR, cache: TrackerCache = None):
+        '''
+        :param cache: cache shared with other projects to keep the opened trackers in; without one, the trackers
+                      opened stay loaded as long as the project
+        '''
+        # tracker tag: InforecastTracker created or opened by the project and not kept in the cache
+        self._trackers: Dict[str, InforecastTracker] = {}
+        self.cache: TrackerCache = cache
         self.name: str = name
-        self.dir: str = os.path.join(PROJECTS_BASE_DIR, name)
+        self.dir: str = os.path.join(base_dir, name)
+        # tracker tag: cached tracker information, see catalog_entry
+        self.catalog: Dict[str, dict] = {}
 
     def init(self):
         '''
@@ -25,7 +41,178 @@ class InforecastProject:
             return False
 
         os.makedirs(self.dir)
+        self.save_catalog()
+        return True
+
+    def open(self):
+        '''
+        Opens an existing project from its catalog; the catalog is rebuilt from the tracker manifests if missing
+        or out of date
+        :return: True on success, False otherwise
+        '''
+        if not os.path.isdir(self.dir):
+            warnings.warn(f'Project directory not found: {self.dir}')
+            return False
+
+        self.catalog = {}
+        if os.path.isfile(self.catalog_path()):
+            with open(self.catalog_path()) as f:
+                catalog = json.load(f)
+            if catalog['version'] == CATALOG_VERSION:
+                self.catalog = catalog['trackers']
+        self.refresh_catalog()
+        return True
+
+    def catalog_path(self):
+        return os.path.join(self.dir, generate_tag(self.name) + '_catalog.json')
+
+    def save_catalog(self):
+        with open(self.catalog_path(), 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'trackers': self.catalog}, f, indent=1)
+
+    @staticmethod
+    def catalog_entry(manifest: dict, manifest_mtime: float):
+        '''
+        Information kept for a tracker, taken from its manifest
+        :return: dict with name, num_rows, schema, column stats, size (bytes of all files), modified (latest file
+                 modification time) and manifest_mtime used to detect saves made outside the project
+        '''
+        files = manifest['files']
+        return {
+            'name': manifest['name'],
+            'num_rows': manifest['num_rows'],
+            'schema': manifest['schema'],
+            'stats': manifest['stats'],
+            'size': sum(x['size'] for x in files.values()),
+            'modified': max([x['mtime'] for x in files.values()] + [manifest_mtime]),
+            'manifest_mtime': manifest_mtime
+        }
+
+    def update_tracker(self, tracker: InforecastTracker):
+        '''
+        Updates the catalog entry of a tracker after it is saved; registered as a save callback of the trackers
+        added or opened through the project
+        '''
+        self.catalog[tracker.tag] = self.catalog_entry(tracker.manifest, os.path.getmtime(manifest_path(tracker.dir)))
+        self.save_catalog()
+
+    def refresh_catalog(self):
+        '''
+        Brings the catalog up to date with the tracker directories: only the manifests saved since the catalog
+        entry was made are read
+        :return: list of the tags of the updated entries
+        '''
+        updated = []
+        found = set()
+        for tag in sorted(os.listdir(self.dir)):
+            tracker_dir = os.path.join(self.dir, tag)
+            path = manifest_path(tracker_dir)
+            if not os.path.isfile(path):
+                continue
+            found.add(tag)
+            mtime = os.path.getmtime(path)
+            if tag in self.catalog and self.catalog[tag]['manifest_mtime'] == mtime:
+                continue
+            self.catalog[tag] = self.catalog_entry(read_manifest(tracker_dir), mtime)
+            updated.append(tag)
+
+        for tag in set(self.catalog) - found:
+            del self.catalog[tag]
+            updated.append(tag)
+
+        if updated:
+            self.save_catalog()
+        return updated
+
+    def add_tracker(self, name: str, data_columns: list, index: str = None, sharding: dict = None,
+                    string_pool=True):
+        '''
+        Creates a tracker in the project directory, see InforecastTracker.init
+        :return: InforecastTracker; None on failure
+        '''
+        tracker = InforecastTracker()
+        if not tracker.init(name=name, data_columns=data_columns, metadata={'project_dir': self.dir}, index=index,
+                            sharding=sharding, string_pool=string_pool):
+            return None
+
+        tracker.on_save.append(self.update_tracker)
+        tracker.save()
+        self._trackers[tracker.tag] = tracker
+        return tracker
+
+    def get_tracker(self, tag: str):
+        '''
+        Tracker of the project, opened lazily on first use (see InforecastTracker.open)
+        :return: InforecastTracker; None if the project has no such tracker
+        '''
+        if tag in self._trackers:
+            return self._trackers[tag]
+        if tag not in self.catalog:
+            warnings.warn(f'Tracker not found in the project: {tag}')
+            return None
+
+        if self.cache is not None:
+            tracker = self.cache.get(self.dir, tag)
+            if tracker is not None and self.update_tracker not in tracker.on_save:
+                tracker.on_save.append(self.update_tracker)
+            return tracker
+
+        tracker = InforecastTracker()
+        if not tracker.open(os.path.join(self.dir, tag)):
+            return None
+        tracker.on_save.append(self.update_tracker)
+        self._trackers[tag] = tracker
+        return tracker
+
+    def _loaded(self, tag: str):
+        ''' Tracker of the project already in memory, None if it would have to be read '''
+        if tag in self._trackers:
+            return self._trackers[tag]
+        return self.cache.peek(self.dir, tag) if self.cache is not None else None
+
+    def list_trackers(self):
+        return sorted(self.catalog.keys())
+
+    def overview(self):
+        '''
+        Summary of the trackers answered from the catalog, no data file is read
+        :return: pd.DataFrame, one row per tracker
+        '''
+        rows = [{
+            'tag': tag,
+            'name': entry['name'],
+            'num_rows': entry['num_rows'],
+            'num_cols': len(entry['schema']),
+            'size': entry['size'],
+            'modified': pd.Timestamp(entry['modified'], unit='s')
+        } for tag, entry in sorted(self.catalog.items())]
+        return pd.DataFrame(rows, columns=['tag', 'name', 'num_rows', 'num_cols', 'size', 'modified'])
+
+    def get_column_stats(self, tag: str):
+        ''' {col_tag: {'min', 'max', 'null_count', 'count'}} of a tracker as of its last save '''
+        return self.catalog[tag]['stats'] if tag in self.catalog else None
+
+    def prune(self, predicate: Predicate, trackers: List[str] = None):
+        '''
+        Trackers whose saved column statistics allow rows matching the predicate, answered from the catalog
+        (see TrackerQuery.may_match). Opened trackers with unsaved changes are always kept
+        :param trackers: tags to consider, all trackers if None
+        :return: list of tracker tags
+        '''
+        out = []
+        for tag in trackers if trackers is not None else self.list_trackers():
+            if tag not in self.catalog:
+                continue
+            tracker = self._loaded(tag)
+            if tracker is not None and tracker.is_modified():
+                out.append(tag)
+                continue
+
+            schema = self.catalog[tag]['schema']
+
+            def parse(col_tag, value):
+                return parse_value(InforecastDataTypes[schema[col_tag]], value)
 
-    def add_tracker(self):
-        # init tracker
-        pass
\ No newline at end of file
+            if may_match(predicate, self.catalog[tag]['stats'], parse):
+                out.append(tag)
+        return out
@@ -1,19 +1,106 @@
 from typing import Dict, List
-from ValidationTable import InforecastValidationTable
+from ValidationTable import InforecastValidationTable, parse_value
 from DataColumn import DataColumn
 import data_types
-from helper_fundtions import generate_tag
+from data_types import InforecastDataTypes
+from helper_fundtions import generate_tag, atomic_write, Instrumentation
 from Table import Table
+from ColumnarTable import ColumnarTable, column_dtype, aggregate_values
+from ColumnCodecs import choose_codec, FILE_EXT
+from ShardedTable import ShardedTable
+from Constraints import Constraint, ConstraintEngine, UniqueConstraint
+from TrackerQuery import Field, Query, QueryPlan, Predicate, may_match
+from MaterializedViews import MaterializedView
+from StringPool import StringPool
+from TrackerSnapshots import TrackerSnapshots, DEFAULT_CHUNK_ROWS, DEFAULT_FREQ
+import TrackerDiff
+import numpy as np
 import os
+import json
+import datetime
+import zlib
 import warnings
 import shutil
 
 
+CHANGE_TABLE_COLS = ['change_id', 'timestamp', 'op', 'row_index', 'col', 'old', 'new']
+MANIFEST_VERSION = 1
+
+
+def manifest_path(tracker_dir: str):
+    return os.path.join(tracker_dir, os.path.basename(os.path.normpath(tracker_dir)) + '_manifest.json')
+
+
+def read_manifest(tracker_dir: str):
+    '''
+    Reads the small json file describing a saved tracker: schema, row count, data format and the size,
+    modification time and crc32 checksum of each file
+    :param tracker_dir: directory of the tracker
+    :return: dict; None if the directory holds no manifest
+    '''
+    path = manifest_path(tracker_dir)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def stat_value(value):
+    ''' json serialisable form of a column statistic: numpy scalars as python numbers, dates as iso text '''
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def file_checksum(path: str):
+    ''' crc32 of a file, read in chunks '''
+    checksum = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            checksum = zlib.crc32(chunk, checksum)
+    return checksum
+
+
 class InforecastTracker:
     def __init__(self):
-        self.data_table: Table = Table()
-        self.change_table = Table()
+        # parts of an opened tracker not read from disk yet: 'data', 'cols', 'changes', 'views', and
+        # 'constraints' to rebuild on the data read back
+        self._pending: set = set()
+        # manifest of the last save or open, see read_manifest
+        self.manifest: dict = None
+        # changes since the last save or open
+        self._modified: bool = False
+        # functions called with the tracker after each save, e.g. to update a project catalog
+        self.on_save: list = []
+        # False if a file did not match the manifest when read
+        self._consistent: bool = True
+        # id of the last write-ahead log entry applied to the data, see TrackerLog
+        self.wal_last_id: str = None
+
+        # ColumnarTable, or ShardedTable when the tracker is sharded
+        self.data_table: ColumnarTable = ColumnarTable()
+        self.change_table: ColumnarTable = ColumnarTable()
+        # record every accepted change in change_table
+        self.log_changes: bool = True
         self.col_validation_table = InforecastValidationTable()
+        self.constraints: ConstraintEngine = ConstraintEngine()
+        # query shape: QueryPlan
+        self._query_plans: dict = {}
+        # view name: MaterializedView
+        self.views: Dict[str, MaterializedView] = {}
+        # interned values of the STR columns, None if the tracker does not pool strings
+        self.string_pool: StringPool = None
+        # periodic states of the data, None until the first snapshot; read from disk when first used after open
+        self._snapshots: TrackerSnapshots = None
+        # col_tag: compression stats of the last compressed save, see ColumnCodecs.save_columns
+        self.io_stats: dict = {}
+        # 'csv', 'npz' or 'sharded', and whether the data was compressed, set when the data is saved
+        self._data_format: str = None
+        self._compress: bool = False
 
         # tag: DataColumn
         self.cols: Dict[str, DataColumn] = {}
@@ -24,13 +111,19 @@ class InforecastTracker:
         self.index: str = 'index'
         self.next_ind_val: int = 0
 
-    def init(self, name: str, data_columns: [], metadata: dict, index: str = None):
+    def init(self, name: str, data_columns: [], metadata: dict, index: str = None, sharding: dict = None,
+             string_pool=True):
         '''
         Function that initialises the tracker from scratch
         :param name: Name of the tracker
         :param data_columns: a list of DataColumn object that will be used to initialise the columns
         :param metadata: a dict with additional information; required: project_dir
         :param index: column to be used as index in the table, None to ignore
+        :param sharding: optional ShardedTable arguments to split the data into shards, e.g. {'shard_size': 10**6}
+                         or {'key_col': <col_tag>, 'num_shards': 8}; None for a single table
+        :param string_pool: True to store the values of all STR columns once in a StringPool, rows holding integer
+                            codes; or a list of the STR column tags to pool, e.g. leaving out unique ids; False to
+                            disable. The pool is saved as a separate dictionary file
         :return: Nothing
         '''
         if not data_columns:
@@ -42,6 +135,7 @@ class InforecastTracker:
 
         self.name = name
         self.tag = generate_tag(name)
+        self.metadata = metadata
         if index:
             self.index = index
 
@@ -61,15 +155,252 @@ class InforecastTracker:
         os.makedirs(self.dir)
 
         col_names = [x.get_tag() for x in data_columns] + [self.index]
-        self.data_table.create_table(columns=col_names, index=self.index)
+        dtypes = {x.get_tag(): column_dtype(x.get_type()) for x in data_columns}
+        dtypes[self.index] = np.dtype(np.int64)
+        pooled = []
+        if string_pool:
+            self.string_pool = StringPool()
+            pooled = [x.get_tag() for x in data_columns if x.get_type() == InforecastDataTypes.STR and
+                      (string_pool is True or x.get_tag() in string_pool)]
+        if sharding:
+            self.data_table = ShardedTable(**sharding)
+        self.data_table.create_table(columns=col_names, index=self.index, dtypes=dtypes, pooled=pooled,
+                                     pool=self.string_pool)
 
         # Create and save validation table, including drop-downs
         self.col_validation_table.init(data_cols=self.cols)
 
-        # TODO: Create and save changes table
+        # Changes table: one row per accepted insert, amended value or delete
+        self.change_table.create_table(columns=CHANGE_TABLE_COLS, index='change_id',
+                                       dtypes={'change_id': np.int64, 'timestamp': np.float64,
+                                               'row_index': np.int64})
+
+        return True
+
+    @property
+    def data_table(self):
+        if 'data' in self._pending:
+            self._load_data()
+        return self._data_table
+
+    @data_table.setter
+    def data_table(self, table):
+        self._data_table = table
+
+    @property
+    def change_table(self):
+        if 'changes' in self._pending:
+            self._load_changes()
+        return self._change_table
+
+    @change_table.setter
+    def change_table(self, table):
+        self._change_table = table
+
+    @property
+    def cols(self):
+        if 'cols' in self._pending:
+            self._load_cols()
+        return self._cols
+
+    @cols.setter
+    def cols(self, cols):
+        self._cols = cols
+
+    @property
+    def constraints(self):
+        if 'constraints' in self._pending:
+            self._rebuild_constraints()
+        return self._constraints
+
+    @constraints.setter
+    def constraints(self, constraints):
+        self._constraints = constraints
+
+    @property
+    def views(self):
+        if 'views' in self._pending:
+            self._load_views()
+        return self._views
+
+    @views.setter
+    def views(self, views):
+        self._views = views
+
+    def open(self, tracker_dir: str):
+        '''
+        Opens a saved tracker reading only its manifest. Column definitions, data, change log and views are read
+        from disk the first time they are used; constraints declared on this tracker are then rebuilt on the data
+        read back
+        :param tracker_dir: directory of the tracker, as written by save
+        :return: True on success, False otherwise
+        '''
+        manifest = read_manifest(tracker_dir)
+        if manifest is None:
+            warnings.warn(f'No tracker manifest found in: {tracker_dir}')
+            return False
+        if manifest['version'] > MANIFEST_VERSION:
+            warnings.warn(f'Tracker saved with a newer manifest version: {manifest["version"]}')
+            return False
+
+        self.manifest = manifest
+        self.dir = tracker_dir
+        self.name = manifest['name']
+        self.tag = manifest['tag']
+        self.index = manifest['index']
+        self.next_ind_val = manifest['next_ind_val']
+        self.metadata = manifest['metadata']
+        self._data_format = manifest['format']
+        self._compress = manifest['compressed']
+        self.string_pool = None
+        if isinstance(self._data_table, ShardedTable):
+            # stops its worker processes
+            self._data_table.close()
+        self._data_table = None
+        self._change_table = None
+        self._cols = {}
+        self._pending = {'data', 'cols', 'changes', 'views'}
+        if self._constraints.constraints:
+            self._pending.add('constraints')
+        self._modified = False
+        self._consistent = True
+        self._snapshots = None
+        self.wal_last_id = manifest['wal_last_id']
+
+        return True
+
+    def close(self, save: bool = True):
+        '''
+        Frees the loaded data; the tracker can still be used, its parts are read again when needed
+        :param save: save first if there are unsaved changes
+        :return: True on success, False if there would be nothing to read back
+        '''
+        if save and self._modified:
+            self.save(compress=self._compress)
+        if self.manifest is None:
+            warnings.warn('Tracker cannot be closed before it is saved')
+            return False
+        if self._modified:
+            warnings.warn('Closing the tracker discards unsaved changes')
+
+        return self.open(self.dir)
+
+    def is_modified(self):
+        ''' True if there are changes since the last save or open '''
+        return self._modified
+
+    def is_loaded(self, part: str):
+        ''' True if the part ('data', 'cols', 'changes', 'views' or 'constraints') is in memory '''
+        return part not in self._pending
+
+    def _verify(self, prefix: str):
+        '''
+        Warns about the files starting with prefix whose content changed since the manifest was written,
+        and marks the tracker as inconsistent (see is_consistent)
+        '''
+        files = self.manifest['files']
+        for name in files:
+            if not name.startswith(prefix):
+                continue
+            path = os.path.join(self.dir, name)
+            if not os.path.isfile(path):
+                warnings.warn(f'Tracker file missing: {path}')
+                self._consistent = False
+            elif os.path.getsize(path) != files[name]['size'] or file_checksum(path) != files[name]['crc32']:
+                warnings.warn(f'Tracker file changed since it was saved: {path}')
+                self._consistent = False
+
+    def is_consistent(self):
+        ''' False if a file read since open did not match the manifest, e.g. replaced by a concurrent save '''
+        return self._consistent
+
+    def reload(self):
+        '''
+        Reopens the tracker from its directory, then rebuilds constraints on the new data and reads the views
+        :return: True on success, False otherwise
+        '''
+        if not self.open(self.dir):
+            return False
 
+        if 'constraints' in self._pending:
+            self._rebuild_constraints()
+        if 'views' in self._pending:
+            self._load_views()
         return True
 
+    def _rebuild_constraints(self):
+        ''' Adds the constraints again, built from the current data; those it violates are dropped '''
+        self._pending.discard('constraints')
+        constraints = list(self._constraints.constraints.values())
+        self._constraints = ConstraintEngine()
+        for constraint in constraints:
+            self.add_constraint(constraint)
+
+    def _load_views(self):
+        self._pending.discard('views')
+        saved = self.manifest.get('views', {})
+        # declared on this tracker since the last save, built from the data read back
+        declared = [x for x in self._views.values() if x.name not in saved]
+        self._views = {}
+        for name in saved:
+            self._views[name] = MaterializedView.load(table_path=self.dir, table_name=saved[name])
+            self._verify(saved[name])
+        for view in declared:
+            self.add_view(view)
+
+    def _get_dtypes(self):
+        dtypes = {tag: column_dtype(InforecastDataTypes[name]) for tag, name in self.manifest['schema'].items()}
+        dtypes[self.index] = np.dtype(np.int64)
+        return dtypes
+
+    def _load_data(self):
+        self._pending.discard('data')
+        name = self.tag + '_data'
+        if self.manifest['string_pool']:
+            self.string_pool = StringPool()
+            self.string_pool.load(table_path=self.dir, table_name=self.tag + '_strings')
+            self._verify(self.tag + '_strings')
+
+        data_format = self.manifest['format']
+        dtypes = self._get_dtypes()
+        pooled = self.manifest['pooled']
+        # csv files hold dates as text
+        dates = [tag for tag, name in self.manifest['schema'].items() if name == InforecastDataTypes.DATE.name]
+        if data_format == 'sharded':
+            # sharding parameters are read from the shards descriptor
+            self._data_table = ShardedTable(shard_size=1)
+            self._data_table.load_table(table_path=self.dir, table_name=name, dtypes=dtypes, pooled=pooled,
+                                        pool=self.string_pool, parse_dates=dates)
+        elif data_format == 'npz':
+            self._data_table = ColumnarTable()
+            self._data_table.load_compressed(table_path=self.dir, table_name=name, dtypes=dtypes,
+                                             pool=self.string_pool)
+        else:
+            self._data_table = ColumnarTable()
+            self._data_table.load_table(table_path=self.dir, table_name=name + '.csv', index=self.index,
+                                        dtypes=dtypes, pooled=pooled, pool=self.string_pool, parse_dates=dates)
+        # checked after reading, a file replaced meanwhile is detected
+        self._verify(name)
+
+    def _load_cols(self):
+        self._pending.discard('cols')
+        name = self.tag + '_validation'
+        cols = self.col_validation_table.load_columns(table_path=self.dir, table_name=name)
+        self._verify(name)
+        if cols is None:
+            warnings.warn(f'Column definitions could not be read from: {name}')
+            cols = {}
+        self._cols = cols
+
+    def _load_changes(self):
+        self._pending.discard('changes')
+        name = self.tag + '_changes'
+        self._change_table = ColumnarTable()
+        self._change_table.load_table(table_path=self.dir, table_name=name + '.csv', index='change_id',
+                                      dtypes={'change_id': np.int64, 'timestamp': np.float64,
+                                              'row_index': np.int64})
+        self._verify(name)
+
     def add_row(self, data: Dict[str, InforecastDataTypes]):
         '''
         Adds empty row to the table, then adds values to columns present in "data" param
@@ -94,11 +425,19 @@ class InforecastTracker:
                     row[item] = data[item]
                     new_entry = True
                 else:
+                    Instrumentation.count('InforecastTracker.invalid_values')
                     warnings.warn(f'Failed validation. Item: {data[item]} cannot be added to col with tag: {item}\n'
                                   f'(Name: {self.cols[item].get_name()}). Required type: {self.cols[item].get_type()}')
 
         if new_entry:
+            violations = self.constraints.check(old_row=None, new_row=row)
+            if violations:
+                Instrumentation.count('InforecastTracker.constraint_violations')
+                warnings.warn(f'Row cannot be added, constraints failed:\n' + '\n'.join(violations))
+                return False
+
             self.data_table.insert_row(new_row=row)
+            self.on_change(index_val=row[self.index], old_row=None, new_row=row)
             return True
         else:
             warnings.warn('There were no valid entries to add to the table')
@@ -121,7 +460,7 @@ class InforecastTracker:
         Change an existing value given index and col
         :param index_val:
         :param col_tag:
-        :param value:
+        :param value: new value, None to clear the value
         :return: true on success, false otherwise
         '''
 
@@ -130,15 +469,180 @@ class InforecastTracker:
             return False
 
         # validate the value to be inserted
-        if not self.cols[col_tag].validate(value):
+        if value is not None and not self.cols[col_tag].validate(value):
+            Instrumentation.count('InforecastTracker.invalid_values')
             warnings.warn(f'Validation failed. Provided value is not compatible with the column: {value}, type: {type(value)}'
                           f'\nRequired type: {self.cols[col_tag].get_type()}')
             return False
 
+        old_row = self.data_table.get_row(index_val)
+        new_row = dict(old_row)
+        new_row[col_tag] = value
+        violations = self.constraints.check(old_row=old_row, new_row=new_row, changed_cols=[col_tag])
+        if violations:
+            Instrumentation.count('InforecastTracker.constraint_violations')
+            warnings.warn(f'Value cannot be amended, constraints failed:\n' + '\n'.join(violations))
+            return False
+
         self.data_table.set_value(indx=index_val, col=col_tag, val=value)
+        self.on_change(index_val=index_val, old_row=old_row, new_row=new_row, changed_cols=[col_tag])
+
+        return True
+
+    def on_change(self, index_val, old_row: dict, new_row: dict, changed_cols: list = None):
+        '''
+        Propagates an accepted row change to the state derived from the data: constraints and views, and records
+        it in the change log
+        :param old_row: row before the change, None for an insert
+        :param new_row: row after the change, None for a delete
+        :param changed_cols: tags of the changed columns, None if the whole row changed
+        :return: Nothing
+        '''
+        self._modified = True
+        self.constraints.apply(index_val=index_val, old_row=old_row, new_row=new_row, changed_cols=changed_cols)
+        if self.log_changes:
+            self.log_change(index_val=index_val, old_row=old_row, new_row=new_row, changed_cols=changed_cols)
+
+        for view in self.views.values():
+            if changed_cols is None or any(col in changed_cols for col in view.cols()):
+                view.apply(old_row=old_row, new_row=new_row)
+
+    def log_change(self, index_val, old_row: dict, new_row: dict, changed_cols: list = None):
+        '''
+        Records a change in the change table: one entry for an insert or a delete (with the deleted row as old),
+        one entry per changed column for an update
+        '''
+        timestamp = datetime.datetime.now().timestamp()
+        entries = []
+        if old_row is None:
+            entries.append(('insert', None, None, None))
+        elif new_row is None:
+            entries.append(('delete', None, str(old_row), None))
+        else:
+            for col in changed_cols if changed_cols else self.cols:
+                if old_row.get(col) != new_row.get(col):
+                    entries.append(('update', col, old_row.get(col), new_row.get(col)))
+
+        for op, col, old, new in entries:
+            self.change_table.insert_row({
+                'change_id': self.change_table.num_rows(),
+                'timestamp': timestamp,
+                'op': op,
+                'row_index': index_val,
+                'col': col,
+                'old': old,
+                'new': new
+            })
+
+    def get_changes(self):
+        ''' Change log as a pd.DataFrame '''
+        return self.change_table.to_dataframe()
+
+    def delete_rows(self, index_vals: list):
+        '''
+        Removes rows from the table. Constraints and views are updated, deletes are recorded in the change log
+        :param index_vals: index values of the rows to remove
+        :return: True on success, False if an index value is not in the table
+        '''
+        for index_val in index_vals:
+            if not self.data_table.has_index(index_val):
+                warnings.warn(f'Index value not in the table: {index_val}')
+                return False
+
+        old_rows = [(index_val, self.data_table.get_row(index_val)) for index_val in index_vals]
+        self.data_table.delete_rows(list(index_vals))
+        for index_val, old_row in old_rows:
+            self.on_change(index_val=index_val, old_row=old_row, new_row=None)
+
+        return True
+
+    def diff(self, incoming, key: str = None):
+        ''' Row-level differences with an incoming table, see TrackerDiff.diff '''
+        return TrackerDiff.diff(tracker=self, incoming=incoming, key=key)
+
+    def apply_diff(self, tracker_diff):
+        ''' Applies a TrackerDiff through validation, constraints and the change log, see TrackerDiff.apply '''
+        return tracker_diff.apply(tracker=self)
+
+    def add_constraint(self, constraint: Constraint):
+        '''
+        Adds a row-level, uniqueness, foreign key or aggregate constraint (see Constraints.py). The constraint is
+        built from the existing rows and then checked incrementally on add_row and amend_val
+        :return: True on success, False if the existing rows violate the constraint
+        '''
+        for col in constraint.cols:
+            if col not in self.cols.keys() and col != self.index:
+                warnings.warn(f'Constraint column not present in the table: {col}')
+                return False
 
+        violations = self.constraints.add(constraint, rows=list(self.data_table.iter_rows()))
+        if violations:
+            warnings.warn(f'Constraint [{constraint.name}] cannot be added, existing rows violate it:\n' +
+                          '\n'.join(violations))
+            return False
         return True
 
+    def remove_constraint(self, name: str):
+        return self.constraints.remove(name)
+
+    def add_view(self, view: MaterializedView):
+        '''
+        Declares a materialized view; it is computed once from the existing rows, then maintained from the
+        changes made through add_row and amend_val. Views are saved with the tracker and read back on open
+        :return: True on success, False otherwise
+        '''
+        if view.name in self.views:
+            warnings.warn(f'View already exists: {view.name}')
+            return False
+        for col in view.cols():
+            if col not in self.cols.keys() and col != self.index:
+                warnings.warn(f'View column not present in the table: {col}')
+                return False
+
+        view.build(self.data_table.iter_rows())
+        self.views[view.name] = view
+        return True
+
+    def get_view(self, name: str):
+        ''' Current result of a view as a pd.DataFrame, None if the view does not exist '''
+        if name not in self.views:
+            warnings.warn(f'View not found: {name}')
+            return None
+        return self.views[name].result()
+
+    def unique_index(self, col_tag: str):
+        ''' UniqueConstraint holding the hash index of the column, None if the column has none '''
+        for constraint in self.constraints.constraints.values():
+            if isinstance(constraint, UniqueConstraint) and constraint.col == col_tag:
+                return constraint
+        return None
+
+    def field(self, col_tag: str):
+        '''
+        Typed handle on a column to build query predicates, e.g. tracker.field('cost') > value
+        :return: Field; None if the tag is unknown
+        '''
+        if col_tag == self.index:
+            return Field(tag=col_tag)
+        if col_tag not in self.cols.keys():
+            warnings.warn(f'Provided tag not present in the table: {col_tag}')
+            return None
+        return Field(tag=col_tag, data_col=self.cols[col_tag])
+
+    def query(self):
+        ''' New Query over the tracker data, see TrackerQuery.Query '''
+        return Query(tracker=self)
+
+    def get_query_plan(self, shape: tuple):
+        ''' Cached QueryPlan for a query shape; plans are rebuilt when the set of unique indexes changes '''
+        unique_cols = tuple(sorted(x.col for x in self.constraints.constraints.values()
+                                   if isinstance(x, UniqueConstraint)))
+        key = (shape, unique_cols)
+        if key not in self._query_plans:
+            self._query_plans[key] = QueryPlan(conjunct_shapes=list(shape), index_col=self.index,
+                                               unique_cols=list(unique_cols))
+        return self._query_plans[key]
+
     def add_column(self, data_col: DataColumn):
         col_name = data_col.get_name()
         col_tag = data_col.get_tag()
@@ -146,24 +650,255 @@ class InforecastTracker:
                                                       f'Tag: {col_tag}\nName: {col_name}'
         self.cols[col_tag] = data_col
 
-    def save_data(self):
-        self.data_table.save_table(table_path=self.dir, table_name=self.tag+'_data')
+    def get_codecs(self):
+        '''
+        Codec of each column for compressed saves: delta for the index and DATE columns, dictionary for columns
+        with options, zlib otherwise
+        :return: dict {col_tag: codec}
+        '''
+        codecs = {self.index: 'delta'}
+        for col_tag in self.cols:
+            data_col = self.cols[col_tag]
+            codecs[col_tag] = choose_codec(column_dtype(data_col.get_type()),
+                                           is_date=data_col.get_type() == InforecastDataTypes.DATE,
+                                           has_options=bool(data_col.get_options()))
+        return codecs
+
+    def save_data(self, compress: bool = False):
+        '''
+        :param compress: True to save the data compressed column by column (see ColumnCodecs), False for csv
+        :return: dict {col_tag: compression stats}, empty for csv
+        '''
+        name = self.tag + '_data'
+        # remove the file of the other format so a stale copy is never read
+        stale = os.path.join(self.dir, name + ('.csv' if compress else FILE_EXT))
+        if os.path.isfile(stale):
+            os.remove(stale)
+
+        self._compress = compress
+        if isinstance(self.data_table, ShardedTable):
+            self._data_format = 'sharded'
+        else:
+            self._data_format = 'npz' if compress else 'csv'
+
+        if compress:
+            self.io_stats = self.data_table.save_compressed(table_path=self.dir, table_name=name,
+                                                            codecs=self.get_codecs())
+            return self.io_stats
+        self.data_table.save_table(table_path=self.dir, table_name=name)
+        return {}
 
     def save_validation(self):
+        # the validation table is read with the columns of an opened tracker
+        if 'cols' in self._pending:
+            self._load_cols()
         self.col_validation_table.save_table(table_path=self.dir, table_name=self.tag+'_validation')
 
     def save_changes(self):
-        # TODO
-        pass
+        self.change_table.save_table(table_path=self.dir, table_name=self.tag+'_changes')
+
+    def save_strings(self):
+        if self.string_pool is not None:
+            self.string_pool.save(table_path=self.dir, table_name=self.tag+'_strings')
+
+    @property
+    def snapshots(self):
+        ''' TrackerSnapshots of the tracker, None if no snapshot was taken '''
+        if self._snapshots is None and self.dir is not None and \
+                os.path.isfile(os.path.join(self.dir, self.tag + '_snapshots.json')):
+            # the string pool decoding the snapshots is loaded with the data
+            self.data_table
+            self._snapshots = TrackerSnapshots()
+            self._snapshots.load(table_path=self.dir, table_name=self.tag + '_snapshots', pool=self.string_pool)
+        return self._snapshots
+
+    def take_snapshot(self, timestamp=None, chunk_rows: int = DEFAULT_CHUNK_ROWS, freq: str = DEFAULT_FREQ):
+        '''
+        Records the current data as the state at the end of the period of timestamp, see TrackerSnapshots.
+        Only the chunks of columns changed since the previous snapshot are stored
+        :param timestamp: time the state is reported at, now by default
+        :param chunk_rows: rows per chunk, used when the first snapshot is taken
+        :param freq: pandas period alias of the snapshot periods, used when the first snapshot is taken
+        :return: pd.Period of the snapshot
+        '''
+        if self.snapshots is None:
+            self._snapshots = TrackerSnapshots(chunk_rows=chunk_rows, freq=freq)
+        self._modified = True
+        return self._snapshots.take(self, timestamp)
 
-    def save(self):
-        self.save_data()
+    def as_of(self, timestamp, cols: list = None):
+        '''
+        Data as at timestamp, from the snapshot of its period or the latest earlier one
+        :param cols: column tags to include, all by default
+        :return: pd.DataFrame; None if there is no snapshot that early
+        '''
+        if self.snapshots is None:
+            warnings.warn('No snapshot taken for the tracker')
+            return None
+        return self.snapshots.as_of(timestamp, cols=cols)
+
+    def save_snapshots(self):
+        if self._snapshots is not None:
+            self._snapshots.save(table_path=self.dir, table_name=self.tag + '_snapshots')
+
+    def _view_file(self, name: str):
+        return self.tag + '_view_' + generate_tag(name) + '.json'
+
+    def save_views(self):
+        for name in self.views:
+            self.views[name].save(table_path=self.dir, table_name=self._view_file(name))
+        # views removed since the last save
+        previous = self.manifest.get('views', {}) if self.manifest else {}
+        for name in previous:
+            path = os.path.join(self.dir, previous[name])
+            if name not in self.views and os.path.isfile(path):
+                os.remove(path)
+
+    def save(self, compress: bool = False):
+        '''
+        Saves data, string pool, validation table, change log, views, snapshots and the manifest
+        :param compress: True to save the data compressed column by column, see save_data
+        '''
+        self.save_data(compress=compress)
+        self.save_strings()
         self.save_validation()
         self.save_changes()
+        self.save_views()
+        self.save_snapshots()
+        self.save_manifest()
+        self._modified = False
+        for callback in self.on_save:
+            callback(self)
+
+    def save_manifest(self):
+        '''
+        Writes the manifest read by open, after the other files so their checksums are current
+        '''
+        files = {}
+        for name in sorted(os.listdir(self.dir)):
+            path = os.path.join(self.dir, name)
+            if name.startswith(self.tag + '_') and not name.endswith(('_manifest.json', '.tmp')) and \
+                    os.path.isfile(path):
+                files[name] = {'size': os.path.getsize(path), 'mtime': os.path.getmtime(path),
+                               'crc32': file_checksum(path)}
+
+        self.manifest = {
+            'version': MANIFEST_VERSION,
+            'name': self.name,
+            'tag': self.tag,
+            'index': self.index,
+            'next_ind_val': self.next_ind_val,
+            'num_rows': self.get_num_rows(),
+            'metadata': self.metadata,
+            'format': self._data_format,
+            'compressed': self._compress,
+            'string_pool': self.string_pool is not None,
+            'pooled': self.data_table.get_pooled(),
+            'schema': {tag: self.cols[tag].get_type().name for tag in self.cols},
+            'stats': self.get_column_stats(),
+            'wal_last_id': self.wal_last_id,
+            # view name: file
+            'views': {name: self._view_file(name) for name in self.views},
+            'files': files
+        }
+        with atomic_write(manifest_path(self.dir)) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
 
     def get_cols_list(self):
+        if 'cols' in self._pending:
+            return list(self.manifest['schema'].keys())
         return list(self.cols.keys())
 
+    def validate_column(self, col_tag: str):
+        '''
+        Validates all stored values of a column at once with the column's compiled validator
+        :param col_tag: tag of the column
+        :return: list of index values holding invalid values; None if the tag is unknown
+        '''
+        if col_tag not in self.cols.keys():
+            warnings.warn(f'Provided tag not present in the table: {col_tag}')
+            return None
+
+        return self.data_table.validate_columns({col_tag: self.cols[col_tag].get_validator()})[col_tag]
+
+    def validate_all(self):
+        '''
+        Validates all columns at once; a sharded tracker validates its shards in parallel
+        :return: dict {col_tag: list of index values holding invalid values}, only for columns with invalid values
+        '''
+        validators = {col_tag: self.cols[col_tag].get_validator() for col_tag in self.cols}
+        invalid = self.data_table.validate_columns(validators)
+        return {col_tag: invalid[col_tag] for col_tag in invalid if invalid[col_tag]}
+
+    def get_column_stats(self):
+        '''
+        Statistics of each column; answered from the manifest while the data is not loaded
+        :return: dict {col_tag: {'min', 'max', 'null_count', 'count'}}, min and max json serialisable (see
+                 stat_value), None for columns without values or whose values cannot be ordered
+        '''
+        if 'data' in self._pending:
+            return self.manifest['stats']
+
+        stats = {}
+        for col_tag in self.get_cols_list():
+            values, valid = self.data_table.get_column(col_tag)
+            count = int(valid.sum())
+            stats[col_tag] = {'min': None, 'max': None, 'null_count': int(len(valid)) - count, 'count': count}
+            if self.cols[col_tag].get_type() == InforecastDataTypes.BOOL:
+                continue
+            try:
+                stats[col_tag]['min'] = stat_value(aggregate_values(values, valid, 'min'))
+                stats[col_tag]['max'] = stat_value(aggregate_values(values, valid, 'max'))
+            except TypeError:
+                pass
+        return stats
+
+    def may_match(self, predicate: Predicate):
+        '''
+        Whether any row can match the predicate according to the column statistics, see TrackerQuery.may_match.
+        Uses the manifest statistics while the data is not loaded, so the data files are not read
+        :return: bool; False means no row matches
+        '''
+        schema = self.manifest['schema'] if 'cols' in self._pending else \
+            {tag: self.cols[tag].get_type().name for tag in self.cols}
+
+        def parse(col_tag, value):
+            return parse_value(InforecastDataTypes[schema[col_tag]], value)
+
+        return may_match(predicate, self.get_column_stats(), parse)
+
+    def get_num_rows(self):
+        if 'data' in self._pending:
+            return self.manifest['num_rows']
+        return self.data_table.num_rows()
+
+    def get_memory_usage(self):
+        '''
+        Memory footprint of the data table
+        :return: dict {col_tag: bytes}, including the index column and the string pool under '_string_pool'
+        '''
+        out = self.data_table.memory_usage()
+        if self.string_pool is not None:
+            out['_string_pool'] = self.string_pool.nbytes()
+        return out
+
+    def aggregate(self, col_tag: str, func: str = 'sum'):
+        '''
+        Aggregates the values present in a column, see ColumnarTable.aggregate
+        :param col_tag: tag of the column
+        :param func: one of 'sum', 'mean', 'min', 'max', 'count'
+        :return: aggregated value, None if the tag is unknown or the column is empty
+        '''
+        if col_tag not in self.cols.keys():
+            warnings.warn(f'Provided tag not present in the table: {col_tag}')
+            return None
+
+        return self.data_table.aggregate(col=col_tag, func=func)
+
+
+Instrumentation.register(InforecastTracker, ['add_row', 'add_rows', 'amend_val'])
+
 
 # Representative example
 if __name__ == '__main__':
@@ -249,3 +984,11 @@ if __name__ == '__main__':
     # Save changes
 
     tracker.save()
+
+    print(f'Memory usage: {tracker.get_memory_usage()}')
+
+    # Reopen: only the manifest is read until the data is used
+    reopened = InforecastTracker()
+    if reopened.open(tracker_dir):
+        print(f'Reopened: {reopened.get_num_rows()} rows, columns: {reopened.get_cols_list()}')
+        print(reopened.data_table.to_dataframe())
@@ -0,0 +1,177 @@
+import json
+import os
+from collections import Counter
+from typing import Dict
+
+import pandas as pd
+
+from TrackerQuery import Predicate, AGGREGATIONS, encode_value, decode_value, predicate_from_dict
+from helper_fundtions import atomic_write
+
+
+class MaterializedView:
+    def __init__(self, name: str, group_by: list, aggs: Dict[str, tuple], where: Predicate = None):
+        '''
+        Grouped summary of a tracker kept up to date from row changes instead of being recomputed.
+        Each change (old_row, new_row) removes the contribution of the old row and adds the new one,
+        old_row is None for an insert and new_row is None for a delete
+        :param name: name of the view, used in the saved file name
+        :param group_by: column tags to group by; an empty list gives a single total row
+        :param aggs: output name: (column tag, aggregation), aggregation one of count, sum, mean, min, max
+        :param where: optional predicate, only matching rows are summarised. Literals are fixed when the view is
+                      declared, e.g. an overdue view compares against the date given at declaration
+        '''
+        for out in aggs:
+            assert aggs[out][1] in AGGREGATIONS and aggs[out][1] not in ['first', 'last'], \
+                f'Aggregation cannot be maintained incrementally: {aggs[out][1]}'
+        self.name: str = name
+        self.group_by: list = list(group_by)
+        self.aggs: Dict[str, tuple] = aggs
+        self.where: Predicate = where
+
+        # group key: {'_rows': number of rows, out: state}; state is a Counter of values for min/max,
+        # [sum, count] for mean, a number otherwise
+        self._groups: dict = {}
+
+    def cols(self):
+        ''' Column tags the view depends on '''
+        cols = list(self.group_by) + [self.aggs[x][0] for x in self.aggs]
+        if self.where is not None:
+            cols += self.where.cols()
+        return cols
+
+    def reset(self):
+        self._groups = {}
+
+    def build(self, rows):
+        '''
+        :param rows: iterable of (index value, row dict)
+        '''
+        self.reset()
+        for _, row in rows:
+            self.apply(None, row)
+
+    def _new_group(self):
+        group = {'_rows': 0}
+        for out in self.aggs:
+            func = self.aggs[out][1]
+            if func in ['min', 'max']:
+                group[out] = Counter()
+            elif func == 'mean':
+                group[out] = [0, 0]
+            else:
+                group[out] = 0
+        return group
+
+    def _contribute(self, row: dict, sign: int):
+        if row is None:
+            return
+        if self.where is not None and not self.where.matches(row):
+            return
+
+        key = tuple(row.get(col) for col in self.group_by)
+        if key not in self._groups:
+            self._groups[key] = self._new_group()
+        group = self._groups[key]
+        group['_rows'] += sign
+
+        for out in self.aggs:
+            col, func = self.aggs[out]
+            value = row.get(col)
+            if value is None:
+                continue
+            if func == 'count':
+                group[out] += sign
+            elif func == 'sum':
+                group[out] += sign * value
+            elif func == 'mean':
+                group[out][0] += sign * value
+                group[out][1] += sign
+            else:
+                group[out][value] += sign
+                if group[out][value] <= 0:
+                    del group[out][value]
+
+        if group['_rows'] <= 0:
+            del self._groups[key]
+
+    def apply(self, old_row: dict, new_row: dict):
+        self._contribute(old_row, -1)
+        self._contribute(new_row, 1)
+
+    def result(self):
+        ''' pd.DataFrame with one row per group '''
+        records = []
+        for key in self._groups:
+            group = self._groups[key]
+            record = dict(zip(self.group_by, key))
+            for out in self.aggs:
+                func = self.aggs[out][1]
+                state = group[out]
+                if func == 'mean':
+                    record[out] = state[0] / state[1] if state[1] else None
+                elif func == 'min':
+                    record[out] = min(state) if state else None
+                elif func == 'max':
+                    record[out] = max(state) if state else None
+                else:
+                    record[out] = state
+            records.append(record)
+
+        return pd.DataFrame(records, columns=self.group_by + list(self.aggs.keys()))
+
+    def to_dict(self):
+        '''
+        Definition and group states of the view, json serialisable; read back by from_dict
+        :return: dict {'name', 'group_by', 'aggs', 'where', 'groups'}, groups as [key, {out: state}] pairs
+        '''
+        groups = []
+        for key, group in self._groups.items():
+            states = {'_rows': group['_rows']}
+            for out in self.aggs:
+                state = group[out]
+                if isinstance(state, Counter):
+                    state = [[encode_value(value), n] for value, n in state.items()]
+                states[out] = encode_value(state)
+            groups.append([encode_value(list(key)), states])
+
+        return {
+            'name': self.name,
+            'group_by': self.group_by,
+            'aggs': {out: list(self.aggs[out]) for out in self.aggs},
+            'where': self.where.to_dict() if self.where is not None else None,
+            'groups': groups
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        ''' View with its group states, from the output of to_dict '''
+        where = predicate_from_dict(data['where']) if data['where'] is not None else None
+        view = cls(name=data['name'], group_by=data['group_by'], aggs={x: tuple(y) for x, y in data['aggs'].items()},
+                   where=where)
+        for key, states in data['groups']:
+            group = view._new_group()
+            group['_rows'] = states['_rows']
+            for out in view.aggs:
+                if isinstance(group[out], Counter):
+                    group[out] = Counter({decode_value(value): n for value, n in states[out]})
+                else:
+                    group[out] = states[out]
+            view._groups[tuple(decode_value(key))] = group
+        return view
+
+    def save(self, table_path: str, table_name: str):
+        ''' Writes the view to a json file, see to_dict '''
+        if not table_name.endswith('.json'):
+            table_name += '.json'
+        with atomic_write(os.path.join(table_path, table_name)) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, table_path: str, table_name: str):
+        ''' View written by save '''
+        if not table_name.endswith('.json'):
+            table_name += '.json'
+        with open(os.path.join(table_path, table_name)) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,520 @@
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import ColumnCodecs
+from ColumnarTable import ColumnarTable, aggregate_values, filter_positions
+from StringPool import StringPool
+from TrackerQuery import Predicate, And, Or, Not
+from helper_fundtions import atomic_write, Instrumentation
+
+
+def default_context():
+    '''
+    Start method of the worker processes. Forking would copy the locks held by running threads, e.g. the log
+    compactor of TrackerLog, into the workers; a fork server is started before any of them, spawn otherwise
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _file_stamp(path: str):
+    ''' Identifies the content of a shard file: a rewritten file has another modification time or size '''
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Columns:
+    def __init__(self, read, num_rows: int):
+        '''
+        Columns with the get_column interface of a ColumnarTable used by the predicates, e.g. of a compressed
+        shard file read by a worker process. Each column is read once, when first asked for
+        :param read: f(column name) -> (values, valid); pooled columns are read as codes
+        '''
+        self._read = read
+        self._num_rows: int = num_rows
+        # column name: (values, valid)
+        self._columns: dict = {}
+
+    def num_rows(self):
+        return self._num_rows
+
+    def get_column(self, col: str, codes: bool = False, positions: np.ndarray = None):
+        if col not in self._columns:
+            self._columns[col] = self._read(col)
+        values, valid = self._columns[col]
+        return (values, valid) if positions is None else (values[positions], valid[positions])
+
+
+class _InCodes(Predicate):
+    def __init__(self, col: str, matching: np.ndarray):
+        '''
+        Predicate on a pooled column evaluated on its codes: matching[code] tells whether the string of the code
+        matches, see ShardedTable._on_codes
+        '''
+        super(_InCodes, self).__init__(col, 'in', ())
+        self.matching: np.ndarray = matching
+
+    def mask(self, table, positions: np.ndarray = None):
+        codes, valid = table.get_column(self.col, codes=True, positions=positions)
+        out = np.zeros(len(codes), dtype=bool)
+        out[valid] = self.matching[codes[valid]]
+        return out
+
+
+def _filter_file(args):
+    ''' Positions of the rows of a shard file matching all predicates, None if the file changed meanwhile '''
+    path, stamp, predicates = args
+    if not os.path.isfile(path) or _file_stamp(path) != stamp:
+        return None
+    with ColumnCodecs.ColumnFile(path) as column_file:
+        return filter_positions(_Columns(column_file.read, column_file.num_rows()), predicates)
+
+
+def _validate_file(args):
+    ''' Index values holding invalid values per column of a shard file, None if the file changed meanwhile '''
+    path, stamp, validators = args
+    if not os.path.isfile(path) or _file_stamp(path) != stamp:
+        return None
+    with ColumnCodecs.ColumnFile(path) as column_file:
+        index_values, _ = column_file.read(column_file.meta['index'])
+        out = {}
+        for col in validators:
+            values, valid = column_file.read(col)
+            out[col] = index_values[~validators[col].validate_array(values, valid)].tolist()
+        return out
+
+
+def _save_shard(args):
+    shard, table_path, table_name, codecs = args
+    if codecs is not None:
+        return shard.save_compressed(table_path=table_path, table_name=table_name, codecs=codecs)
+    shard.save_table(table_path=table_path, table_name=table_name)
+    return {}
+
+
+def _load_shard(args):
+    table_path, table_name, index, dtypes, pooled, parse_dates = args
+    shard = ColumnarTable()
+    if table_name.endswith(ColumnCodecs.FILE_EXT):
+        shard.load_compressed(table_path=table_path, table_name=table_name, dtypes=dtypes)
+    else:
+        shard.load_table(table_path=table_path, table_name=table_name, index=index, dtypes=dtypes, pooled=pooled,
+                         parse_dates=parse_dates)
+    return shard
+
+
+class ShardedTable:
+    def __init__(self, shard_size: int = None, key_col: str = None, num_shards: int = None, processes: int = None,
+                 mp_context=None):
+        '''
+        Table split into ColumnarTable shards, either by index range (shard = index // shard_size) or by the hash
+        of a key column (shard = crc32(key) % num_shards). Exposes the ColumnarTable interface: row positions
+        are positions in the concatenation of the shards in shard order.
+        Shards are saved and loaded by a pool of threads, compression and parsing release the GIL and the shards
+        are not copied. Query filters and validation run shard-parallel in worker processes: each worker reads
+        the columns it needs from the compressed file of a shard unchanged since it was saved or loaded, and
+        returns only positions or index values. Shards saved as csv or changed since are processed in process
+        meanwhile. The worker processes are started on first use and kept until close
+        :param shard_size: number of consecutive index values per shard, for index range sharding
+        :param key_col: column deciding the shard of a row when it is inserted, for key sharding
+        :param num_shards: number of shards, for key sharding
+        :param processes: number of threads and worker processes, None for the number of CPUs; 1 to run in process
+        :param mp_context: multiprocessing context or start method name of the worker processes, see
+                           default_context
+        '''
+        assert (shard_size is None) != (key_col is None), 'Shard either by index range (shard_size) or by key_col'
+        assert key_col is None or num_shards, 'num_shards is required to shard by key_col'
+        self.shard_size: int = shard_size
+        self.key_col: str = key_col
+        self.num_shards: int = num_shards
+        self.processes: int = processes
+        self.mp_context = multiprocessing.get_context(mp_context) if isinstance(mp_context, str) else mp_context
+        self._executor: ProcessPoolExecutor = None
+
+        # shard id: ColumnarTable
+        self._shards: Dict[int, ColumnarTable] = {}
+        # index value: shard id
+        self._shard_of: dict = {}
+        self._offsets: Dict[int, int] = None
+        # shard id: (path, stamp) of the compressed file holding the same rows as the shard in memory
+        self._files: Dict[int, tuple] = {}
+        self._cols_list: list = None
+        self._index: str = None
+        self._dtypes: dict = None
+        self._pooled: list = None
+        # one pool shared by all shards
+        self.pool: StringPool = None
+
+    def _new_shard(self):
+        shard = ColumnarTable()
+        shard.create_table(columns=self._cols_list, index=self._index, dtypes=self._dtypes, pooled=self._pooled,
+                           pool=self.pool)
+        return shard
+
+    def _shard_id(self, index, row: dict):
+        if self.key_col is None:
+            return int(index) // self.shard_size
+        # crc32 is stable across processes, unlike hash() of strings
+        return zlib.crc32(str(row.get(self.key_col)).encode()) % self.num_shards
+
+    def _shard_ids(self):
+        return sorted(self._shards.keys())
+
+    def _get_offsets(self):
+        if self._offsets is None:
+            self._offsets = {}
+            offset = 0
+            for shard_id in self._shard_ids():
+                self._offsets[shard_id] = offset
+                offset += self._shards[shard_id].num_rows()
+        return self._offsets
+
+    def _split(self, positions: np.ndarray):
+        '''
+        Maps row positions of the table to the shards holding them
+        :return: list of (shard id, positions in the shard, indices of those rows in positions)
+        '''
+        shard_ids = self._shard_ids()
+        offsets = self._get_offsets()
+        starts = np.array([offsets[x] for x in shard_ids], dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        # empty shards start where the next one does, side='right' skips them
+        owners = np.searchsorted(starts, positions, side='right') - 1
+        out = []
+        for i in np.unique(owners):
+            where = np.flatnonzero(owners == i)
+            out.append((shard_ids[i], positions[where] - starts[i], where))
+        return out
+
+    def _num_processes(self):
+        return self.processes if self.processes is not None else os.cpu_count() or 1
+
+    def _map_threads(self, function, args: list):
+        if self._num_processes() == 1 or len(args) < 2:
+            return [function(x) for x in args]
+        with ThreadPoolExecutor(max_workers=self._num_processes()) as executor:
+            return list(executor.map(function, args))
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._num_processes(),
+                                                 mp_context=self.mp_context or default_context())
+        return self._executor
+
+    def close(self):
+        ''' Stops the worker processes, started again when needed '''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _use_workers(self):
+        return self._num_processes() > 1 and len(self._files) > 1
+
+    def _scatter(self, in_file, args: tuple, in_memory):
+        '''
+        Runs a function over every shard. Shards unchanged since their compressed file was saved or loaded are
+        given to the worker processes, the others are processed in process while the workers run
+        :param in_file: f((path, stamp) + args) run by a worker, returns None if the file changed meanwhile
+        :param in_memory: f(shard id) run in process
+        :return: dict {shard id: result}
+        '''
+        shard_ids = self._shard_ids()
+        futures = {}
+        if self._use_workers():
+            executor = self._get_executor()
+            futures = {x: executor.submit(in_file, self._files[x] + args) for x in shard_ids if x in self._files}
+
+        out = {x: in_memory(x) for x in shard_ids if x not in futures}
+        for shard_id in futures:
+            result = futures[shard_id].result()
+            out[shard_id] = result if result is not None else in_memory(shard_id)
+        return out
+
+    def _on_codes(self, predicate: Predicate):
+        '''
+        Predicate evaluated on the codes of the pooled columns: the strings of the pool are matched once and the
+        rows by code, so the worker processes do not need the pool
+        '''
+        if isinstance(predicate, (And, Or)):
+            return type(predicate)([self._on_codes(x) for x in predicate.predicates])
+        if isinstance(predicate, Not):
+            return Not(self._on_codes(predicate.predicate))
+        if predicate.col not in self._pooled or predicate.op in ['is_null', 'not_null']:
+            return predicate
+
+        every = np.ones(len(self.pool), dtype=bool)
+        strings = self.pool.decode(np.arange(len(self.pool)), every)
+        return _InCodes(predicate.col, predicate.mask(_Columns(lambda col: (strings, every), len(strings))))
+
+    def create_table(self, columns: list, index: str = None, dtypes: Dict[str, np.dtype] = None,
+                     pooled: list = None, pool: StringPool = None):
+        assert index, 'A sharded table requires an index column'
+        self._cols_list = columns
+        self._index = index
+        self._dtypes = dtypes
+        self._pooled = pooled if pooled else []
+        self.pool = pool if pool is not None or not pooled else StringPool()
+        self._shards = {}
+        self._shard_of = {}
+        self._offsets = None
+        self._files = {}
+
+    def get_column_list(self):
+        return self._cols_list
+
+    def get_pooled(self):
+        return list(self._pooled)
+
+    def num_shards_used(self):
+        return len(self._shards)
+
+    def num_rows(self):
+        return len(self._shard_of)
+
+    def insert_row(self, new_row: dict):
+        assert self._index in new_row.keys(), 'Table index not found in the row being inserted'
+        index = new_row[self._index]
+        assert index not in self._shard_of, f'Index value already in the table: {index}'
+
+        shard_id = self._shard_id(index, new_row)
+        if shard_id not in self._shards:
+            self._shards[shard_id] = self._new_shard()
+        self._shards[shard_id].insert_row(new_row)
+        self._shard_of[index] = shard_id
+        self._offsets = None
+        self._files.pop(shard_id, None)
+
+    def delete_rows(self, index_values: list):
+        by_shard = {}
+        for indx in index_values:
+            assert indx in self._shard_of, f'Index value not in the table: {indx}'
+            by_shard.setdefault(self._shard_of.pop(indx), []).append(indx)
+        for shard_id in by_shard:
+            self._shards[shard_id].delete_rows(by_shard[shard_id])
+            self._files.pop(shard_id, None)
+        self._offsets = None
+
+    def has_index(self, indx):
+        return indx in self._shard_of
+
+    def get_position(self, indx):
+        assert indx in self._shard_of, f'Index value not in the table: {indx}'
+        shard_id = self._shard_of[indx]
+        return self._get_offsets()[shard_id] + self._shards[shard_id].get_position(indx)
+
+    def get_index_name(self):
+        if not self._shards:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self._shards[x].get_index_name() for x in self._shard_ids()])
+
+    def get_value(self, indx, col: str):
+        return self._shards[self._shard_of[indx]].get_value(indx, col)
+
+    def set_value(self, indx, col: str, val):
+        # the shard of a row is decided on insert, amending the key column does not move the row
+        self._shards[self._shard_of[indx]].set_value(indx, col, val)
+        self._files.pop(self._shard_of[indx], None)
+
+    def get_row(self, indx):
+        return self._shards[self._shard_of[indx]].get_row(indx)
+
+    def iter_rows(self):
+        for shard_id in self._shard_ids():
+            for item in self._shards[shard_id].iter_rows():
+                yield item
+
+    def get_column(self, col: str, codes: bool = False, positions: np.ndarray = None):
+        if not self._shards or (positions is not None and not len(positions)):
+            dtype = self._dtypes.get(col, object) if self._dtypes else object
+            if codes and col in self._pooled:
+                dtype = np.int64
+            return np.zeros(0, dtype=dtype), np.zeros(0, dtype=bool)
+        if positions is None:
+            parts = [self._shards[x].get_column(col, codes=codes) for x in self._shard_ids()]
+            return np.concatenate([x[0] for x in parts]), np.concatenate([x[1] for x in parts])
+
+        values, valid = None, np.zeros(len(positions), dtype=bool)
+        for shard_id, local, where in self._split(positions):
+            part_values, part_valid = self._shards[shard_id].get_column(col, codes=codes, positions=local)
+            if values is None:
+                values = np.empty(len(positions), dtype=part_values.dtype)
+            values[where] = part_values
+            valid[where] = part_valid
+        return values, valid
+
+    def take(self, col: str, positions: np.ndarray = None):
+        order = None
+        if positions is None:
+            parts = [self._shards[x].take(col) for x in self._shard_ids()]
+        else:
+            split = self._split(positions)
+            parts = [self._shards[shard_id].take(col, local) for shard_id, local, _ in split]
+            # gathered shard by shard, put back in the order of positions
+            order = np.argsort(np.concatenate([x[2] for x in split])) if split else None
+        if not parts:
+            return self._new_shard().take(col)
+        gathered = pd.concat([pd.Series(x) for x in parts], ignore_index=True).array
+        return gathered if order is None else gathered[order]
+
+    def aggregate(self, col: str, func: str = 'sum'):
+        values, valid = self.get_column(col)
+        return aggregate_values(values, valid, func)
+
+    def memory_usage(self):
+        out = {}
+        for shard in self._shards.values():
+            for col, nbytes in shard.memory_usage().items():
+                out[col] = out.get(col, 0) + nbytes
+        return out
+
+    def to_dataframe(self, codes: bool = False):
+        if not self._shards:
+            return self._new_shard().to_dataframe(codes=codes)
+        return pd.concat([self._shards[x].to_dataframe(codes=codes) for x in self._shard_ids()])
+
+    def filter(self, predicates: list, positions: np.ndarray = None):
+        '''
+        Positions of the rows matching all predicates, see ColumnarTable.filter. Without positions the shards are
+        filtered in parallel, the worker processes return the positions matching in their shard
+        '''
+        if positions is not None or not self._shards:
+            return filter_positions(self, predicates, positions)
+
+        on_codes = [self._on_codes(x) for x in predicates] if self._use_workers() else None
+        found = self._scatter(_filter_file, (on_codes,), lambda x: filter_positions(self._shards[x], predicates))
+        offsets = self._get_offsets()
+        return np.concatenate([found[x] + offsets[x] for x in self._shard_ids()])
+
+    def validate_columns(self, validators: dict):
+        '''
+        Validates every shard in parallel, see ColumnarTable.validate_columns. Pooled columns are validated here
+        instead, each distinct string once
+        :return: dict {col: list of index values holding invalid values}
+        '''
+        typed = {col: validators[col] for col in validators if col not in self._pooled}
+        results = self._scatter(_validate_file, (typed,), lambda x: self._shards[x].validate_columns(typed))
+        out = {col: [] for col in validators}
+        for shard_id in self._shard_ids():
+            for col in typed:
+                out[col] += results[shard_id][col]
+
+        for col in validators:
+            if col not in self._pooled:
+                continue
+            codes, valid = self.get_column(col, codes=True)
+            used = np.unique(codes[valid])
+            invalid = np.zeros(len(self.pool), dtype=bool)
+            invalid[used] = ~validators[col].validate_array(self.pool.decode(used, np.ones(len(used), dtype=bool)))
+            out[col] = self.get_index_name()[valid & invalid[np.where(valid, codes, 0)]].tolist()
+        return out
+
+    def save_table(self, table_path: str, table_name: str, codecs: Dict[str, str] = None):
+        '''
+        Saves one file per shard, written in parallel, and a json descriptor listing the shards
+        :param codecs: None to save the shards as csv; {column name: codec} to save them compressed,
+                       see ColumnarTable.save_compressed
+        :return: dict {column name: compression stats} summed over the shards, empty for csv
+        '''
+        if not os.path.exists(table_path):
+            os.makedirs(table_path)
+        if table_name.endswith('.csv'):
+            table_name = table_name[:-4]
+
+        ext = ColumnCodecs.FILE_EXT if codecs is not None else '.csv'
+        shard_names = {x: f'{table_name}_shard{x}{ext}' for x in self._shard_ids()}
+
+        # shards of the previous save which are not overwritten, e.g. saved in the other format
+        descriptor_path = os.path.join(table_path, table_name + '_shards.json')
+        if os.path.isfile(descriptor_path):
+            with open(descriptor_path) as f:
+                previous = json.load(f)['shards'].values()
+            for name in set(previous) - set(shard_names.values()):
+                if os.path.isfile(os.path.join(table_path, name)):
+                    os.remove(os.path.join(table_path, name))
+        results = self._map_threads(_save_shard, [(self._shards[x], table_path, shard_names[x], codecs)
+                                                  for x in self._shard_ids()])
+        self._files = {}
+        if codecs is not None:
+            for shard_id in self._shard_ids():
+                path = os.path.join(table_path, shard_names[shard_id])
+                self._files[shard_id] = (path, _file_stamp(path))
+
+        descriptor = {
+            'index': self._index,
+            'columns': self._cols_list,
+            'shard_size': self.shard_size,
+            'key_col': self.key_col,
+            'num_shards': self.num_shards,
+            'pooled': self._pooled,
+            'shards': {str(x): shard_names[x] for x in shard_names}
+        }
+        with atomic_write(descriptor_path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(descriptor, f)
+
+        stats = {}
+        for result in results:
+            for col in result:
+                total = stats.setdefault(col, {'codec': result[col]['codec'], 'raw_bytes': 0, 'encoded_bytes': 0,
+                                               'seconds': 0.})
+                total['raw_bytes'] += result[col]['raw_bytes']
+                total['encoded_bytes'] += result[col]['encoded_bytes']
+                if result[col]['encode_mb_s']:
+                    total['seconds'] += result[col]['raw_bytes'] / result[col]['encode_mb_s'] / 1e6
+        for col in stats:
+            total = stats[col]
+            seconds = total.pop('seconds')
+            total['ratio'] = total['raw_bytes'] / total['encoded_bytes'] if total['encoded_bytes'] else None
+            total['encode_mb_s'] = total['raw_bytes'] / seconds / 1e6 if seconds else None
+        return stats
+
+    def save_compressed(self, table_path: str, table_name: str, codecs: Dict[str, str] = None):
+        ''' Saves the shards compressed, see save_table '''
+        return self.save_table(table_path=table_path, table_name=table_name, codecs=codecs if codecs else {})
+
+    def load_table(self, table_path: str, table_name: str, index: str = None, dtypes: Dict[str, np.dtype] = None,
+                   pooled: list = None, pool: StringPool = None, parse_dates: list = None):
+        '''
+        Loads the shards listed in the json descriptor written by save_table, read in parallel. Pooled columns are
+        read as codes of the given pool
+        '''
+        if table_name.endswith('.csv'):
+            table_name = table_name[:-4]
+        with open(os.path.join(table_path, table_name + '_shards.json')) as f:
+            descriptor = json.load(f)
+
+        self.shard_size = descriptor['shard_size']
+        self.key_col = descriptor['key_col']
+        self.num_shards = descriptor['num_shards']
+        pooled = pooled if pooled is not None else descriptor.get('pooled')
+        self.create_table(columns=descriptor['columns'], index=descriptor['index'], dtypes=dtypes, pooled=pooled,
+                          pool=pool)
+
+        shard_ids = sorted(int(x) for x in descriptor['shards'])
+        shards = self._map_threads(_load_shard, [(table_path, descriptor['shards'][str(x)], self._index, dtypes,
+                                                  self._pooled, parse_dates) for x in shard_ids])
+        for shard_id, shard in zip(shard_ids, shards):
+            shard.set_pool(self.pool)
+            self._shards[shard_id] = shard
+            for indx in shard.get_index_name().tolist():
+                self._shard_of[indx] = shard_id
+            path = os.path.join(table_path, descriptor['shards'][str(shard_id)])
+            if path.endswith(ColumnCodecs.FILE_EXT):
+                self._files[shard_id] = (path, _file_stamp(path))
+
+    def load_compressed(self, table_path: str, table_name: str, dtypes: Dict[str, np.dtype] = None,
+                        pool: StringPool = None):
+        ''' Loads shards saved compressed; the shard format is read from the descriptor, see load_table '''
+        self.load_table(table_path=table_path, table_name=table_name, dtypes=dtypes, pool=pool)
+        return {}
+
+
+Instrumentation.register(ShardedTable, ['insert_row', 'save_table', 'load_table', 'load_compressed', 'filter',
+                                       'validate_columns'])
@@ -0,0 +1,105 @@
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from helper_fundtions import atomic_write
+
+
+class StringPool:
+    def __init__(self):
+        '''
+        Interned strings of a tracker: each distinct value is stored once and referenced by an integer code.
+        Codes are assigned in order of first appearance and never change, so saved codes stay valid
+        '''
+        # value: code
+        self._codes: Dict[str, int] = {}
+        # code: value
+        self._values: List[str] = []
+        # object array of _values used to decode many codes at once, rebuilt when the pool grows
+        self._array: np.ndarray = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, value):
+        return value in self._codes
+
+    def intern(self, value: str):
+        '''
+        :return: code of the value, added to the pool if new
+        '''
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._values)
+            self._codes[value] = code
+            self._values.append(value)
+        return code
+
+    def intern_array(self, values: np.ndarray, valid: np.ndarray):
+        '''
+        Interns many values at once
+        :param values: array of strings, entries where valid is False are ignored
+        :param valid: bool array, same length as values
+        :return: np.int64 array of codes, 0 where valid is False
+        '''
+        codes = np.zeros(len(values), dtype=np.int64)
+        present = np.nonzero(valid)[0]
+        if len(present):
+            # intern each distinct value once
+            uniques, inverse = np.unique(np.asarray(values, dtype=object)[present].astype(str), return_inverse=True)
+            unique_codes = np.fromiter((self.intern(x) for x in uniques.tolist()), dtype=np.int64,
+                                       count=len(uniques))
+            codes[present] = unique_codes[inverse.ravel()]
+        return codes
+
+    def get(self, code: int):
+        return self._values[code]
+
+    def code(self, value: str):
+        ''' Code of a value, None if the value is not in the pool '''
+        return self._codes.get(value)
+
+    def decode(self, codes: np.ndarray, valid: np.ndarray):
+        '''
+        :return: object array of strings, None where valid is False
+        '''
+        if len(self._array) != len(self._values):
+            self._array = np.array(self._values, dtype=object)
+
+        out = np.empty(len(codes), dtype=object)
+        out[valid] = self._array[codes[valid]]
+        return out
+
+    def nbytes(self):
+        ''' Memory used by the pooled strings, each counted once '''
+        return int(sum(sys.getsizeof(x) for x in self._values) + self._array.nbytes)
+
+    def to_dataframe(self):
+        return pd.DataFrame({'value': self._values}, index=pd.Index(np.arange(len(self._values)), name='code'))
+
+    def save(self, table_path: str, table_name: str):
+        '''
+        Writes the dictionary segment: one line per code
+        '''
+        if not os.path.exists(table_path):
+            os.makedirs(table_path)
+        if not table_name.endswith('.csv'):
+            table_name += '.csv'
+        with atomic_write(os.path.join(table_path, table_name)) as tmp_path:
+            self.to_dataframe().to_csv(tmp_path)
+
+    def load(self, table_path: str, table_name: str):
+        if not table_name.endswith('.csv'):
+            table_name += '.csv'
+        full_path = os.path.join(table_path, table_name)
+        assert os.path.exists(full_path), f'String pool file not found: {full_path}'
+
+        # empty strings are values, not missing
+        df = pd.read_csv(full_path, index_col=0, dtype={'value': str}, keep_default_na=False)
+        assert (df.index.to_numpy() == np.arange(len(df))).all(), f'String pool codes are not contiguous: {full_path}'
+        self._values = df['value'].tolist()
+        self._codes = {x: i for i, x in enumerate(self._values)}
+        self._array = np.empty(0, dtype=object)
@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+from helper_fundtions import atomic_write, Instrumentation
 
 
 class Table:
@@ -26,7 +27,8 @@ class Table:
 
         full_path = os.path.join(table_path, table_name)
         # TODO: check if name exists, rename if it does
-        self._table.to_csv(full_path)
+        with atomic_write(full_path) as tmp_path:
+            self._table.to_csv(tmp_path)
 
     def load_table(self, table_path: str, table_name: str):
         table_full_path = os.path.join(table_path, table_name)
@@ -64,6 +66,9 @@ class Table:
         self._table.at[indx, col] = val
 
 
+Instrumentation.register(Table, ['insert_row', 'save_table', 'load_table'])
+
+
 if __name__ == '__main__':
     from random import randint
 
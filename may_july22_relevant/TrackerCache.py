@@ -0,0 +1,180 @@
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Tuple
+
+from InforecastTracker import InforecastTracker, manifest_path
+
+
+DEFAULT_MAX_BYTES = 512 << 20
+
+
+def _signature(tracker_dir: str):
+    ''' Identifies the saved version of a tracker: modification time and size of its manifest, None if missing '''
+    path = manifest_path(tracker_dir)
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Entry:
+    def __init__(self, tracker: InforecastTracker, nbytes: int, signature: tuple):
+        self.tracker: InforecastTracker = tracker
+        self.nbytes: int = nbytes
+        # manifest signature the tracker was loaded or last saved at
+        self.signature: tuple = signature
+
+
+class TrackerCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        '''
+        Loaded trackers shared by the projects of a process, kept in least recently used order. The size of a
+        tracker is the memory footprint of its data (see InforecastTracker.get_memory_usage); least recently
+        used trackers are dropped once the total exceeds max_bytes. Trackers with unsaved changes are never
+        dropped. A cached tracker is read again when its manifest on disk changed, i.e. another process saved it
+        :param max_bytes: size limit of the cached trackers
+        '''
+        self.max_bytes: int = max_bytes
+        # (project directory, tracker tag): _Entry, least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._nbytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        # entries dropped because the tracker was saved by another process
+        self.invalidations: int = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple[str, str]):
+        return key in self._entries
+
+    @staticmethod
+    def _size(tracker: InforecastTracker):
+        return int(sum(tracker.get_memory_usage().values()))
+
+    def get(self, project_dir: str, tag: str):
+        '''
+        Tracker of a project, read from disk if not cached or saved elsewhere since it was cached.
+        Data, columns and change log are loaded on a miss, so later uses do not read files
+        :param project_dir: directory of the project, see InforecastProject.dir
+        :param tag: tag of the tracker
+        :return: InforecastTracker; None if it cannot be opened
+        '''
+        key = (os.path.normpath(project_dir), tag)
+        tracker_dir = os.path.join(*key)
+        signature = _signature(tracker_dir)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature != signature and not entry.tracker.is_modified():
+                self._remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if entry.tracker.is_modified():
+                    self._resize(key)
+                return entry.tracker
+            self.misses += 1
+
+        # read outside the lock, other trackers can be served meanwhile
+        tracker = InforecastTracker()
+        if not tracker.open(tracker_dir):
+            return None
+        tracker.cols
+        tracker.data_table
+        tracker.change_table
+        tracker.on_save.append(self._saved)
+
+        with self._lock:
+            if key in self._entries:
+                # loaded concurrently by another thread, keep the first one
+                self._entries.move_to_end(key)
+                return self._entries[key].tracker
+            self._entries[key] = _Entry(tracker, self._size(tracker), signature)
+            self._nbytes += self._entries[key].nbytes
+            self._evict()
+        return tracker
+
+    def peek(self, project_dir: str, tag: str):
+        ''' Cached tracker without reading from disk nor counting a lookup, None if not cached '''
+        entry = self._entries.get((os.path.normpath(project_dir), tag))
+        return entry.tracker if entry is not None else None
+
+    def _saved(self, tracker: InforecastTracker):
+        ''' Save callback of the cached trackers: the new manifest is their own, they stay valid '''
+        key = (os.path.normpath(os.path.dirname(os.path.normpath(tracker.dir))), tracker.tag)
+        with self._lock:
+            if key in self._entries and self._entries[key].tracker is tracker:
+                self._entries[key].signature = _signature(tracker.dir)
+                self._resize(key)
+                self._evict()
+
+    def _resize(self, key: Tuple[str, str]):
+        entry = self._entries[key]
+        nbytes = self._size(entry.tracker)
+        self._nbytes += nbytes - entry.nbytes
+        entry.nbytes = nbytes
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        if self._saved in entry.tracker.on_save:
+            entry.tracker.on_save.remove(self._saved)
+
+    def _evict(self):
+        '''
+        Drops least recently used trackers without unsaved changes until the cache fits max_bytes; the most
+        recently used tracker is kept even if larger
+        '''
+        for key in list(self._entries.keys())[:-1]:
+            if self._nbytes <= self.max_bytes:
+                break
+            if self._entries[key].tracker.is_modified():
+                continue
+            self._remove(key)
+            self.evictions += 1
+        if self._nbytes > self.max_bytes:
+            warnings.warn(f'Tracker cache above its limit: {self._nbytes} bytes')
+
+    def invalidate(self, project_dir: str, tag: str = None):
+        '''
+        Drops a tracker, or all trackers of a project if tag is None. Unsaved changes are lost
+        :return: number of trackers dropped
+        '''
+        project_dir = os.path.normpath(project_dir)
+        with self._lock:
+            keys = [x for x in self._entries if x[0] == project_dir and (tag is None or x[1] == tag)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._remove(key)
+
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        '''
+        :return: dict with hits, misses, evictions, invalidations, hit_rate, entries, bytes and max_bytes
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'entries': len(self._entries),
+            'bytes': self._nbytes,
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,210 @@
+import warnings
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from ColumnarTable import ColumnarTable, column_dtype
+from ValidationTable import parse_value
+
+
+class TrackerDiff:
+    def __init__(self, inserts: pd.DataFrame, updates: list, deletes: list):
+        '''
+        Row-level differences between a tracker and an incoming table, produced by diff()
+        :param inserts: incoming rows with no counterpart in the tracker, one column per tracker column
+        :param updates: list of (tracker index value, col tag, old value, new value); values are None when missing
+        :param deletes: tracker index values with no counterpart in the incoming table
+        '''
+        self.inserts: pd.DataFrame = inserts
+        self.updates: List[tuple] = updates
+        self.deletes: list = deletes
+
+    def __len__(self):
+        return len(self.inserts) + len(self.updates) + len(self.deletes)
+
+    def summary(self):
+        return {
+            'inserts': len(self.inserts),
+            'updates': len(self.updates),
+            'updated_rows': len(set(x[0] for x in self.updates)),
+            'deletes': len(self.deletes)
+        }
+
+    def apply(self, tracker, delete: bool = True):
+        '''
+        Applies the differences as one batch through the tracker's validation path: values are validated against
+        their column, constraints are checked, and every accepted change is propagated to views and the change log.
+        All values are cast to the column types and validated before the first change is made. If a value is
+        invalid or a constraint rejects a change, nothing is applied: changes already made are undone and their
+        change log entries dropped. An empty incoming cell clears the tracker value
+        :param tracker: InforecastTracker the diff was computed against
+        :param delete: False to keep the tracker rows missing from the incoming table
+        :return: dict with the number of inserted, updated, cleared and deleted values or rows, and the number of
+                 rejected changes; when rejected is not 0 the others are 0
+        '''
+        out = {'inserted': 0, 'updated': 0, 'cleared': 0, 'deleted': 0, 'rejected': 0}
+        problems = []
+
+        def cast(col_tag, value):
+            if value is None or pd.isna(value):
+                return None
+            try:
+                value = parse_value(tracker.cols[col_tag].get_type(), value)
+            except (TypeError, ValueError):
+                value = None
+            if value is None or not tracker.cols[col_tag].validate(value):
+                problems.append(f'Invalid value for col {col_tag}: {value}')
+            return value
+
+        updates = []
+        for index_val, col_tag, _, new in self.updates:
+            if not tracker.data_table.has_index(index_val):
+                problems.append(f'Index value not in the table: {index_val}')
+                continue
+            updates.append((index_val, col_tag, cast(col_tag, new)))
+
+        cols = [x for x in self.inserts.columns if x in tracker.cols]
+        rows = []
+        for row in self.inserts[cols].itertuples(index=False, name=None):
+            data = {col_tag: cast(col_tag, val) for col_tag, val in zip(cols, row)}
+            data = {x: data[x] for x in data if data[x] is not None}
+            if not data:
+                problems.append('Incoming row without values cannot be inserted')
+            rows.append(data)
+
+        deletes = self.deletes if delete else []
+        problems += [f'Index value not in the table: {x}' for x in deletes if not tracker.data_table.has_index(x)]
+        if problems:
+            warnings.warn(f'Diff not applied, {len(problems)} changes are invalid:\n' + '\n'.join(problems[:10]))
+            out['rejected'] = len(problems)
+            return out
+
+        # (index value, col tag, previous value) of each update, index value of each insert, to undo the batch
+        undo = []
+        num_changes = tracker.change_table.num_rows() if tracker.log_changes else None
+        next_ind_val = tracker.next_ind_val
+        for index_val, col_tag, new in updates:
+            old = tracker.data_table.get_value(index_val, col_tag)
+            if not tracker.amend_val(index_val=index_val, col_tag=col_tag, value=new):
+                return self._rollback(tracker, undo, num_changes, next_ind_val)
+            undo.append((index_val, col_tag, old))
+            out['cleared' if new is None else 'updated'] += 1
+
+        for data in rows:
+            index_val = tracker.next_ind_val
+            if not tracker.add_row(data):
+                return self._rollback(tracker, undo, num_changes, next_ind_val)
+            undo.append(index_val)
+            out['inserted'] += 1
+
+        if deletes:
+            # all index values were checked, the delete cannot fail
+            tracker.delete_rows(deletes)
+            out['deleted'] = len(deletes)
+
+        return out
+
+    @staticmethod
+    def _rollback(tracker, undo: list, num_changes: int, next_ind_val: int):
+        '''
+        Undoes the changes applied by apply, newest first, without logging them, and drops their change log entries
+        :param num_changes: number of change log entries before the batch, None if changes are not logged
+        :return: result of apply for a rejected batch
+        '''
+        log_changes = tracker.log_changes
+        tracker.log_changes = False
+        try:
+            for change in reversed(undo):
+                if isinstance(change, tuple):
+                    tracker.amend_val(index_val=change[0], col_tag=change[1], value=change[2])
+                else:
+                    tracker.delete_rows([change])
+        finally:
+            tracker.log_changes = log_changes
+        tracker.next_ind_val = next_ind_val
+        if num_changes is not None:
+            tracker.change_table.delete_rows(tracker.change_table.get_index_name()[num_changes:].tolist())
+
+        warnings.warn('Diff not applied, a change was rejected by the constraints; the batch was undone')
+        return {'inserted': 0, 'updated': 0, 'cleared': 0, 'deleted': 0, 'rejected': 1}
+
+
+def _coerce(tracker, df: pd.DataFrame):
+    '''
+    Stores the incoming columns with the tracker column types so both sides hash and compare alike
+    '''
+    cols = tracker.get_cols_list()
+    missing = [x for x in cols if x not in df.columns]
+    if missing:
+        warnings.warn(f'Incoming table is missing tracker columns, they are compared as empty: {missing}')
+        df = df.assign(**{x: None for x in missing})
+
+    dtypes = {x: column_dtype(tracker.cols[x].get_type()) for x in cols}
+    table = ColumnarTable()
+    table.from_dataframe(df[cols].reset_index(drop=True), dtypes=dtypes)
+    return table.to_dataframe()
+
+
+def _row_hashes(df: pd.DataFrame):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def diff(tracker, incoming: pd.DataFrame, key: str = None):
+    '''
+    Compares a tracker with an incoming table. Rows are matched on the tracker index (the index of the incoming
+    DataFrame holds tracker index values) or on a natural key column unique on both sides. Each side is hashed
+    row-wise and only matched rows whose hashes differ are compared column by column
+    :param tracker: InforecastTracker
+    :param incoming: pd.DataFrame with the tracker column tags as columns
+    :param key: column tag of the natural key, None to match on the tracker index
+    :return: TrackerDiff; None if the key is not usable
+    '''
+    cols = tracker.get_cols_list()
+    if key is not None:
+        if key not in cols or key not in incoming.columns:
+            warnings.warn(f'Key column must be a column of both the tracker and the incoming table: {key}')
+            return None
+        if not incoming[key].is_unique:
+            warnings.warn(f'Key column is not unique in the incoming table: {key}')
+            return None
+
+    current = tracker.data_table.to_dataframe()[cols]
+    new = _coerce(tracker, incoming)
+
+    # Align both sides on the matching key, keeping the tracker index of each current row
+    current_index = current.index.to_numpy()
+    if key is None:
+        new.index = incoming.index
+        current_keys = pd.Index(current_index)
+    else:
+        new.index = new[key].to_numpy()
+        current_keys = pd.Index(current[key].to_numpy())
+        if not current_keys.is_unique:
+            warnings.warn(f'Key column is not unique in the tracker: {key}')
+            return None
+
+    new_pos = current_keys.get_indexer(new.index)
+    matched = new_pos >= 0
+    deleted = np.ones(len(current), dtype=bool)
+    deleted[new_pos[matched]] = False
+
+    # Unchanged rows are skipped on their hashes
+    current_hashes = _row_hashes(current)
+    new_hashes = _row_hashes(new)
+    changed = np.zeros(len(new), dtype=bool)
+    changed[matched] = current_hashes[new_pos[matched]] != new_hashes[matched]
+
+    old_rows = current.iloc[new_pos[changed]]
+    new_rows = new.iloc[np.nonzero(changed)[0]]
+    index_vals = current_index[new_pos[changed]]
+    updates = []
+    for col in cols:
+        old_col = old_rows[col].to_numpy(dtype=object, na_value=None)
+        new_col = new_rows[col].to_numpy(dtype=object, na_value=None)
+        for i in np.nonzero(old_col != new_col)[0]:
+            updates.append((index_vals[i].item(), col, old_col[i], new_col[i]))
+
+    return TrackerDiff(inserts=new.iloc[np.nonzero(~matched)[0]].reset_index(drop=True),
+                       updates=updates,
+                       deletes=current_index[deleted].tolist())
@@ -0,0 +1,354 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+import warnings
+from typing import Dict
+
+from InforecastTracker import InforecastTracker, stat_value, read_manifest
+from ValidationTable import parse_value
+
+
+WAL_SUFFIX = '_wal.jsonl'
+# WAL renamed while the compactor folds it into the table
+FOLDING_SUFFIX = '_wal.folding.jsonl'
+LOCK_SUFFIX = '_wal.lock'
+COMPACT_LOCK_SUFFIX = '_compact.lock'
+
+
+def _read_entries(f, offsets: dict):
+    '''
+    Entries of a log file appended after the bytes already read; a last line still being written is ignored
+    :param f: log file opened in binary mode
+    :param offsets: {file key: number of bytes read}, from previous reads
+    :return: (file key, offset read from or None for a file not read before, entries, offset after the entries)
+    '''
+    # the inode follows the log when it is renamed for folding, the first entry tells apart a new log reusing the
+    # inode of a removed one
+    key = (os.fstat(f.fileno()).st_ino, f.readline())
+    start = offsets.get(key)
+    f.seek(start if start is not None else 0)
+    data = f.read()
+    # bytes after the last newline are incomplete
+    end = data.rfind(b'\n') + 1
+    entries = [json.loads(x) for x in data[:end].decode().split('\n') if x]
+    return key, start, entries, (start or 0) + end
+
+
+class TrackerLog:
+    def __init__(self, tracker: InforecastTracker):
+        '''
+        Write-ahead log shared by the processes editing the same saved tracker. Writers append entries to the
+        log instead of saving the tracker; every process replays the log in file order on top of the saved
+        table, so all processes reach the same state. Only the compactor (see compact) writes the table files.
+
+        Optimistic locking: each entry carries the tracker version its writer had seen (base). The version is
+        the number of changes in the tracker change log. An amend conflicts when the same (index, col) changed
+        after its base, a delete when any value of the row did; the first entry in the log wins and the later
+        one is rejected. Writers share the log without waiting for each other; readers never lock.
+
+        All changes of a tracker using a log must go through it.
+        :param tracker: tracker opened from its directory (see InforecastTracker.open) or saved once
+        '''
+        assert tracker.dir is not None and tracker.manifest is not None, 'The tracker must be saved or opened'
+        self.tracker: InforecastTracker = tracker
+        prefix = os.path.join(tracker.dir, tracker.tag)
+        self.path: str = prefix + WAL_SUFFIX
+        self.folding_path: str = prefix + FOLDING_SUFFIX
+        self.lock_path: str = prefix + LOCK_SUFFIX
+
+        # id of the last entry applied to the tracker
+        self._last_id: str = tracker.wal_last_id
+        # (index, col): id in the change table of the last change; (index, None) for any change of the row
+        self._versions: Dict[tuple, int] = {}
+        self._indexed: int = 0
+        # (inode, first line) of a log file: number of bytes read, the entries up to there are applied
+        self._offsets: Dict[tuple, int] = {}
+        # entry id: True if applied, False if rejected, for the entries written by this process
+        self._results: Dict[str, bool] = {}
+        # rejected entries with the reason
+        self.conflicts: list = []
+
+        self._load_snapshot()
+
+    def _load_snapshot(self, attempts: int = 10):
+        '''
+        Reads the tracker files, reopening while a concurrent compaction replaces them
+        :return: True once the files read match the manifest
+        '''
+        for _ in range(attempts):
+            self.tracker.cols
+            self.tracker.data_table
+            self.tracker.change_table
+            if self.tracker.is_consistent() and read_manifest(self.tracker.dir) == self.tracker.manifest:
+                break
+            time.sleep(0.05)
+            self.tracker.reload()
+        else:
+            warnings.warn(f'Tracker files keep changing, reading them as they are: {self.tracker.dir}')
+            return False
+
+        self._last_id = self.tracker.wal_last_id
+        self._versions = {}
+        self._indexed = 0
+        self._offsets = {}
+        return True
+
+    def version(self):
+        ''' Tracker version to pass as base of the next change: number of changes seen so far '''
+        return self.tracker.change_table.num_rows()
+
+    def _index_changes(self):
+        changes = self.tracker.change_table
+        if self._indexed == changes.num_rows():
+            return
+        positions = range(self._indexed, changes.num_rows())
+        row_index = changes.take('row_index', positions)
+        cols = changes.take('col', positions)
+        for change_id, index_val, col in zip(positions, row_index, cols):
+            index_val = int(index_val)
+            col = col if isinstance(col, str) else None
+            self._versions[(index_val, None)] = change_id
+            if col is not None:
+                self._versions[(index_val, col)] = change_id
+        self._indexed = changes.num_rows()
+
+    def _conflict(self, entry: dict):
+        ''' Reason why the entry conflicts with the changes made after its base, None if it does not '''
+        self._index_changes()
+        base = entry['base']
+        for index_val in entry.get('index', []):
+            if not self.tracker.data_table.has_index(index_val):
+                return f'row {index_val} does not exist'
+            key = (index_val, entry['col'] if entry['op'] == 'update' else None)
+            if self._versions.get(key, -1) >= base:
+                return f'row {index_val}{", col " + entry["col"] if entry["col"] else ""} changed after ' \
+                       f'version {base}'
+        return None
+
+    def _encode(self, col_tag: str, value):
+        return stat_value(value)
+
+    def _decode(self, col_tag: str, value):
+        if value is None:
+            return None
+        return parse_value(self.tracker.cols[col_tag].get_type(), value)
+
+    def _apply(self, entry: dict):
+        ''' Applies one entry through the tracker validation path, returns True if accepted '''
+        reason = self._conflict(entry) if entry['op'] != 'insert' else None
+        if reason is None:
+            if entry['op'] == 'insert':
+                accepted = self.tracker.add_row({x: self._decode(x, entry['data'][x]) for x in entry['data']})
+            elif entry['op'] == 'update':
+                accepted = self.tracker.amend_val(index_val=entry['index'][0], col_tag=entry['col'],
+                                                  value=self._decode(entry['col'], entry['value']))
+            else:
+                accepted = self.tracker.delete_rows(entry['index'])
+            reason = None if accepted else 'rejected by validation or constraints'
+
+        if reason is not None:
+            self.conflicts.append((entry, reason))
+        if entry['id'] in self._results:
+            self._results[entry['id']] = reason is None
+        return reason is None
+
+    def sync(self, files: list = None):
+        '''
+        Applies the entries appended since the last sync, from this or other processes. Log files read before
+        are read from where the previous sync stopped
+        :param files: log files to read, the folding and current logs by default
+        :return: dict {'applied', 'rejected'}; None if a compaction folded entries not applied here yet into the
+                 table files, the tracker should then be reloaded (see InforecastTracker.reload)
+        '''
+        # opened newest first: a log renamed for folding meanwhile is then opened twice rather than missed
+        handles = []
+        for path in reversed(files if files is not None else [self.folding_path, self.path]):
+            try:
+                handles.insert(0, open(path, 'rb'))
+            except FileNotFoundError:
+                pass
+        reads = []
+        try:
+            for f in handles:
+                read = _read_entries(f, self._offsets)
+                if read[0] not in [x[0] for x in reads]:
+                    reads.append(read)
+        finally:
+            for f in handles:
+                f.close()
+
+        # the entries up to the bytes read by the previous sync are applied; files before the first one read
+        # before were read entirely
+        known = [i for i, x in enumerate(reads) if x[1] is not None]
+        entries = [x for read in reads[known[0] if known else 0:] for x in read[2]]
+
+        # skip the entries up to the last one applied
+        ids = [x['id'] for x in entries]
+        if self._last_id is not None and self._last_id in ids:
+            entries = entries[ids.index(self._last_id) + 1:]
+        elif not known and read_manifest(self.tracker.dir)['wal_last_id'] != self._last_id:
+            # the saved table does not end with the last entry applied here: entries were folded into it
+            return None
+        # otherwise the saved table ends with the last entry applied here, all entries in the log follow it
+
+        out = {'applied': 0, 'rejected': 0}
+        for entry in entries:
+            out['applied' if self._apply(entry) else 'rejected'] += 1
+            self._last_id = entry['id']
+        self.tracker.wal_last_id = self._last_id
+        # files no longer in place are dropped, a removed folding log is not read again
+        self._offsets = {key: end for key, _, _, end in reads}
+        return out
+
+    def _append(self, entry: dict):
+        entry['id'] = uuid.uuid4().hex
+        entry['time'] = time.time()
+        line = json.dumps(entry) + '\n'
+        # shared lock: writers append concurrently, only a compactor rotating the log waits for them
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                # a single write in append mode, entries of concurrent writers do not interleave
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return entry['id']
+
+    def _catch_up(self, attempts: int = 10):
+        '''
+        Syncs, reloading the tracker when a compaction folded entries not applied here yet
+        :return: output of sync; None if the tracker kept being compacted
+        '''
+        out = self.sync()
+        for _ in range(attempts):
+            if out is not None:
+                break
+            self.tracker.reload()
+            self._load_snapshot()
+            out = self.sync()
+        return out
+
+    def _write(self, entry: dict):
+        '''
+        Appends an entry and applies the log up to it
+        :return: True if the entry was applied, False if it was rejected
+        '''
+        entry_id = self._append(entry)
+        # set by _apply once the entry is applied or rejected here
+        self._results[entry_id] = None
+        self._catch_up()
+        result = self._results.pop(entry_id)
+        if result is None:
+            # the entry is in the table files, its outcome was not recorded: writing it again would repeat it
+            raise RuntimeError(f'Log entry {entry_id} was folded by a compaction before it was applied here, its '
+                               f'outcome is unknown; see the reloaded tracker')
+        return result
+
+    def amend(self, index_val: int, col_tag: str, value, base: int = None):
+        '''
+        Logs an amended value; checked for conflicts against the changes logged after base
+        :param base: tracker version the value was read at, see version(); the current version if None
+        :return: True if the change was applied, False if it was invalid or conflicted. Raises RuntimeError if the
+        outcome of the logged change is unknown, see _write
+        '''
+        if col_tag not in self.tracker.cols.keys():
+            warnings.warn(f'Provided tag not present in the table: {col_tag}')
+            return False
+        if not self.tracker.cols[col_tag].validate(value):
+            warnings.warn(f'Validation failed. Provided value is not compatible with the column: {value}')
+            return False
+
+        self._catch_up()
+        return self._write({'op': 'update', 'base': self.version() if base is None else base,
+                            'index': [int(index_val)], 'col': col_tag, 'value': self._encode(col_tag, value)})
+
+    def add(self, data: dict, base: int = None):
+        '''
+        Logs a new row; rows get their index when the entry is applied, in log order
+        :return: True if the row was added
+        '''
+        data = {x: self._encode(x, data[x]) for x in data if x in self.tracker.cols.keys()}
+        return self._write({'op': 'insert', 'base': self.version() if base is None else base, 'index': [],
+                            'col': None, 'data': data})
+
+    def delete(self, index_vals: list, base: int = None):
+        '''
+        Logs the removal of rows; conflicts if a row changed after base
+        :return: True if the rows were removed
+        '''
+        self._catch_up()
+        return self._write({'op': 'delete', 'base': self.version() if base is None else base,
+                            'index': [int(x) for x in index_vals], 'col': None})
+
+
+def compact(tracker_dir: str):
+    '''
+    Folds the write-ahead log of a saved tracker into its table files. Writers keep appending to a new log
+    meanwhile; the table files are replaced one by one and readers keep reading the previous files until the
+    new manifest is written
+    :return: dict {'applied', 'rejected'}; None if another compactor is running or the tracker cannot be opened
+    '''
+    tracker = InforecastTracker()
+    if not tracker.open(tracker_dir):
+        return None
+    prefix = os.path.join(tracker.dir, tracker.tag)
+
+    with open(prefix + COMPACT_LOCK_SUFFIX, 'a') as compact_lock:
+        try:
+            fcntl.flock(compact_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        try:
+            # reopen under the lock, another compactor may have just finished
+            tracker.open(tracker_dir)
+            log = TrackerLog(tracker)
+
+            # a folding log left by an interrupted compaction is folded first
+            if not os.path.isfile(log.folding_path):
+                if not os.path.isfile(log.path):
+                    return {'applied': 0, 'rejected': 0}
+                with open(log.lock_path, 'a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        os.rename(log.path, log.folding_path)
+                    finally:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+            out = log.sync(files=[log.folding_path])
+            if out is None:
+                warnings.warn(f'Log does not follow the saved tracker, not compacted: {log.folding_path}')
+                return None
+            tracker.save(compress=tracker.manifest['compressed'])
+            os.remove(log.folding_path)
+            return out
+        finally:
+            fcntl.flock(compact_lock, fcntl.LOCK_UN)
+
+
+class LogCompactor(threading.Thread):
+    def __init__(self, tracker_dir: str, interval: float = 60., min_size: int = 1 << 20):
+        '''
+        Background thread compacting a tracker log when it grows beyond min_size bytes
+        :param interval: seconds between checks
+        '''
+        super(LogCompactor, self).__init__(daemon=True)
+        self.tracker_dir: str = tracker_dir
+        self.interval: float = interval
+        self.min_size: int = min_size
+        self.results: list = []
+        self._stop_event: threading.Event = threading.Event()
+
+    def run(self):
+        manifest_tag = os.path.basename(os.path.normpath(self.tracker_dir))
+        wal_path = os.path.join(self.tracker_dir, manifest_tag + WAL_SUFFIX)
+        while not self._stop_event.wait(self.interval):
+            if os.path.isfile(wal_path) and os.path.getsize(wal_path) >= self.min_size:
+                self.results.append(compact(self.tracker_dir))
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,421 @@
+import datetime
+import operator
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from DataColumn import DataColumn
+
+
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+AGGREGATIONS = ['sum', 'mean', 'min', 'max', 'count', 'first', 'last']
+
+
+def encode_value(value):
+    ''' json serialisable form of a column value: numpy scalars as python values, dates tagged as iso text '''
+    if isinstance(value, (list, tuple)):
+        return [encode_value(x) for x in value]
+    if isinstance(value, datetime.datetime):
+        return {'date': value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode_value(value):
+    ''' Value from its encode_value form '''
+    if isinstance(value, list):
+        return [decode_value(x) for x in value]
+    if isinstance(value, dict):
+        return pd.Timestamp(value['date']).to_pydatetime()
+    return value
+
+
+def predicate_from_dict(data: dict):
+    ''' Predicate from the output of Predicate.to_dict '''
+    if 'and' in data:
+        return And([predicate_from_dict(x) for x in data['and']])
+    if 'or' in data:
+        return Or([predicate_from_dict(x) for x in data['or']])
+    if 'not' in data:
+        return Not(predicate_from_dict(data['not']))
+    return Predicate(col=data['col'], op=data['op'], value=decode_value(data['value']))
+
+
+class Predicate:
+    def __init__(self, col: str, op: str, value=None):
+        '''
+        Condition on a single column. Missing values never match, except for 'is_null'
+        :param col: column tag
+        :param op: one of '==', '!=', '<', '<=', '>', '>=', 'in', 'is_null', 'not_null'
+        :param value: literal compared against; a list for 'in'
+        '''
+        assert op in COMPARISONS or op in ['in', 'is_null', 'not_null'], f'Unknown predicate operator: {op}'
+        self.col: str = col
+        self.op: str = op
+        self.value = value
+
+    def __and__(self, other):
+        return And(self.conjuncts() + other.conjuncts())
+
+    def __or__(self, other):
+        return Or([self, other])
+
+    def __invert__(self):
+        return Not(self)
+
+    def conjuncts(self):
+        return [self]
+
+    def cols(self):
+        return [self.col]
+
+    def shape(self):
+        ''' Structure of the predicate without the literals, used as the query plan cache key '''
+        return self.col, self.op
+
+    def to_dict(self):
+        ''' json serialisable form, read back by predicate_from_dict '''
+        return {'col': self.col, 'op': self.op, 'value': encode_value(self.value)}
+
+    def matches(self, row: dict):
+        value = row.get(self.col)
+        if self.op == 'is_null':
+            return value is None
+        if value is None:
+            return False
+        if self.op == 'not_null':
+            return True
+        if self.op == 'in':
+            return value in self.value
+        return bool(COMPARISONS[self.op](value, self.value))
+
+    def mask(self, table, positions: np.ndarray = None):
+        '''
+        Evaluates the predicate on the column arrays of a ColumnarTable
+        :param positions: row positions to evaluate, all rows if None
+        :return: bool array, one entry per evaluated row
+        '''
+        values, valid = table.get_column(self.col, positions=positions)
+
+        if self.op == 'is_null':
+            return ~valid
+        if self.op == 'not_null':
+            return valid.copy()
+
+        out = np.zeros(len(values), dtype=bool)
+        present = values[valid]
+        if self.op == 'in':
+            if present.dtype == object:
+                options = set(self.value)
+                out[valid] = np.fromiter((x in options for x in present), dtype=bool, count=len(present))
+            else:
+                out[valid] = np.isin(present, list(self.value))
+        else:
+            out[valid] = COMPARISONS[self.op](present, self.value)
+        return out
+
+
+class And(Predicate):
+    def __init__(self, predicates: list):
+        self.predicates: List[Predicate] = predicates
+
+    def conjuncts(self):
+        return list(self.predicates)
+
+    def cols(self):
+        return [col for x in self.predicates for col in x.cols()]
+
+    def shape(self):
+        return ('and',) + tuple(x.shape() for x in self.predicates)
+
+    def to_dict(self):
+        return {'and': [x.to_dict() for x in self.predicates]}
+
+    def matches(self, row: dict):
+        return all(x.matches(row) for x in self.predicates)
+
+    def mask(self, table, positions: np.ndarray = None):
+        out = self.predicates[0].mask(table, positions)
+        for predicate in self.predicates[1:]:
+            out &= predicate.mask(table, positions)
+        return out
+
+
+class Or(Predicate):
+    def __init__(self, predicates: list):
+        self.predicates: List[Predicate] = predicates
+
+    def conjuncts(self):
+        return [self]
+
+    def cols(self):
+        return [col for x in self.predicates for col in x.cols()]
+
+    def shape(self):
+        return ('or',) + tuple(x.shape() for x in self.predicates)
+
+    def to_dict(self):
+        return {'or': [x.to_dict() for x in self.predicates]}
+
+    def matches(self, row: dict):
+        return any(x.matches(row) for x in self.predicates)
+
+    def mask(self, table, positions: np.ndarray = None):
+        out = self.predicates[0].mask(table, positions)
+        for predicate in self.predicates[1:]:
+            out |= predicate.mask(table, positions)
+        return out
+
+
+class Not(Predicate):
+    def __init__(self, predicate: Predicate):
+        self.predicate: Predicate = predicate
+
+    def conjuncts(self):
+        return [self]
+
+    def cols(self):
+        return self.predicate.cols()
+
+    def shape(self):
+        return 'not', self.predicate.shape()
+
+    def to_dict(self):
+        return {'not': self.predicate.to_dict()}
+
+    def matches(self, row: dict):
+        return not self.predicate.matches(row)
+
+    def mask(self, table, positions: np.ndarray = None):
+        return ~self.predicate.mask(table, positions)
+
+
+class Field:
+    def __init__(self, tag: str, data_col: DataColumn = None):
+        '''
+        Builds typed predicates on a column: literals are checked against the column type when they are created
+        :param tag: column tag
+        :param data_col: column definition, None for the index column
+        '''
+        self.tag: str = tag
+        self.data_col: DataColumn = data_col
+
+    def _check(self, value):
+        if self.data_col is not None:
+            assert type(value) == self.data_col.get_type().value, \
+                f'Literal {value} of type {type(value)} does not match the type of column ' \
+                f'{self.tag}: {self.data_col.get_type()}'
+        return value
+
+    def __eq__(self, other):
+        return Predicate(self.tag, '==', self._check(other))
+
+    def __ne__(self, other):
+        return Predicate(self.tag, '!=', self._check(other))
+
+    def __lt__(self, other):
+        return Predicate(self.tag, '<', self._check(other))
+
+    def __le__(self, other):
+        return Predicate(self.tag, '<=', self._check(other))
+
+    def __gt__(self, other):
+        return Predicate(self.tag, '>', self._check(other))
+
+    def __ge__(self, other):
+        return Predicate(self.tag, '>=', self._check(other))
+
+    def isin(self, values: list):
+        return Predicate(self.tag, 'in', [self._check(x) for x in values])
+
+    def is_null(self):
+        return Predicate(self.tag, 'is_null')
+
+    def not_null(self):
+        return Predicate(self.tag, 'not_null')
+
+
+def may_match(predicate: Predicate, stats: Dict[str, dict], parse=None):
+    '''
+    Whether rows summarised by column statistics can match a predicate, without reading the rows. Conservative:
+    True unless the statistics rule every row out
+    :param predicate: Predicate, And, Or or Not
+    :param stats: {col tag: {'min', 'max', 'null_count', 'count'}}, e.g. from a tracker manifest
+    :param parse: optional function (col tag, stored value) -> value comparable with the literals, e.g. for dates
+                  stored as text
+    :return: bool
+    '''
+    if isinstance(predicate, And):
+        return all(may_match(x, stats, parse) for x in predicate.predicates)
+    if isinstance(predicate, Or):
+        return any(may_match(x, stats, parse) for x in predicate.predicates)
+    if isinstance(predicate, Not) or predicate.col not in stats:
+        return True
+
+    col_stats = stats[predicate.col]
+    if predicate.op == 'is_null':
+        return col_stats['null_count'] > 0
+    if not col_stats['count']:
+        return False
+    if predicate.op == 'not_null' or predicate.op == '!=' or col_stats['min'] is None:
+        return True
+
+    lo, hi = col_stats['min'], col_stats['max']
+    if parse is not None:
+        lo, hi = parse(predicate.col, lo), parse(predicate.col, hi)
+    try:
+        if predicate.op == 'in':
+            return any(lo <= x <= hi for x in predicate.value)
+        if predicate.op == '==':
+            return lo <= predicate.value <= hi
+        if predicate.op in ['<', '<=']:
+            return bool(COMPARISONS[predicate.op](lo, predicate.value))
+        return bool(COMPARISONS[predicate.op](hi, predicate.value))
+    except TypeError:
+        # literal not comparable with the statistics
+        return True
+
+
+class QueryPlan:
+    def __init__(self, conjunct_shapes: list, index_col: str, unique_cols: list):
+        '''
+        Access path for a conjunction of predicates: equality conjuncts on the index or on a column with a
+        unique hash index become direct lookups, the other conjuncts filter the looked up rows (or scan all
+        rows when there is no lookup), cheapest operators first
+        :param conjunct_shapes: shapes of the top level conjuncts
+        :param index_col: tag of the table index column
+        :param unique_cols: tags of the columns with a unique hash index
+        '''
+        # positions in the conjunct list
+        self.lookups: List[int] = []
+        self.filters: List[int] = []
+
+        def is_single(shape):
+            return len(shape) == 2 and isinstance(shape[1], str) and shape[0] not in ['not', 'or', 'and']
+
+        for i, shape in enumerate(conjunct_shapes):
+            if is_single(shape) and shape[1] == '==' and (shape[0] == index_col or shape[0] in unique_cols):
+                self.lookups.append(i)
+            else:
+                self.filters.append(i)
+
+        # Cheap comparisons first, compound predicates last
+        cost = {'==': 0, 'is_null': 0, 'not_null': 0, 'in': 2}
+        self.filters.sort(key=lambda i: cost.get(conjunct_shapes[i][1], 1) if is_single(conjunct_shapes[i]) else 3)
+
+
+class Query:
+    def __init__(self, tracker):
+        '''
+        Read query over a tracker, built with chained calls and run with execute():
+        tracker.query().where(tracker.field('cost') > x).group_by(['owner']).agg(total=('cost', 'sum')).execute()
+        '''
+        self.tracker = tracker
+        self._select: list = None
+        self._where: Predicate = None
+        self._group_by: list = None
+        self._aggs: Dict[str, tuple] = {}
+        self._order_by: list = []
+        self._limit: int = None
+
+    def select(self, cols: list):
+        self._select = list(cols)
+        return self
+
+    def where(self, predicate: Predicate):
+        self._where = predicate if self._where is None else self._where & predicate
+        return self
+
+    def group_by(self, cols: list):
+        self._group_by = list(cols)
+        return self
+
+    def agg(self, **aggs):
+        '''
+        :param aggs: output name=(column tag, aggregation), aggregation one of AGGREGATIONS
+        '''
+        for name in aggs:
+            assert aggs[name][1] in AGGREGATIONS, f'Unknown aggregation: {aggs[name][1]}'
+        self._aggs.update(aggs)
+        return self
+
+    def order_by(self, col: str, ascending: bool = True):
+        self._order_by.append((col, ascending))
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def shape(self):
+        conjuncts = self._where.conjuncts() if self._where is not None else []
+        return tuple(x.shape() for x in conjuncts)
+
+    def positions(self):
+        ''' Row positions matching the where clause '''
+        table = self.tracker.data_table
+        if self._where is None:
+            return np.arange(table.num_rows())
+
+        conjuncts = self._where.conjuncts()
+        plan = self.tracker.get_query_plan(self.shape())
+
+        positions = None
+        for i in plan.lookups:
+            col, value = conjuncts[i].col, conjuncts[i].value
+            if col == self.tracker.index:
+                found = [table.get_position(value)] if table.has_index(value) else []
+            else:
+                index_val = self.tracker.unique_index(col).lookup(value)
+                found = [table.get_position(index_val)] if index_val is not None else []
+            found = np.asarray(found, dtype=np.int64)
+            positions = found if positions is None else np.intersect1d(positions, found)
+
+        # without lookups a sharded table filters its shards in parallel
+        return table.filter([conjuncts[i] for i in plan.filters], positions)
+
+    def execute(self):
+        '''
+        :return: pd.DataFrame with the selected columns, or one row per group when grouped
+        '''
+        table = self.tracker.data_table
+        positions = self.positions()
+
+        cols = self._select if self._select else self.tracker.get_cols_list()
+        needed = list(cols)
+        for col in (self._group_by or []) + [x[0] for x in self._aggs.values()] + [x[0] for x in self._order_by]:
+            if col not in needed:
+                needed.append(col)
+
+        # Only the needed columns of the matching rows are materialised
+        index_values = table.get_index_name()[positions]
+        data = {}
+        for col in needed:
+            if col == self.tracker.index:
+                data[col] = index_values
+                continue
+            data[col] = table.take(col, positions)
+        df = pd.DataFrame(data, index=pd.Index(index_values, name=self.tracker.index))
+
+        if self._group_by:
+            aggs = self._aggs if self._aggs else {'count': (self._group_by[0], 'count')}
+            df = df.groupby(self._group_by).agg(**{name: pd.NamedAgg(*aggs[name]) for name in aggs}).reset_index()
+
+        if self._order_by:
+            df = df.sort_values(by=[x[0] for x in self._order_by], ascending=[x[1] for x in self._order_by],
+                                na_position='last')
+        if self._limit is not None:
+            df = df.head(self._limit)
+
+        # projected last, order_by may use columns that are not selected
+        return df if self._group_by else df[cols]
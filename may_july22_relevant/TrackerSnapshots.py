@@ -0,0 +1,372 @@
+import datetime
+import json
+import os
+from bisect import bisect_right
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import ColumnCodecs
+from ColumnarTable import TypedColumn, aggregate_values, column_dtype
+from StringPool import StringPool
+from helper_fundtions import atomic_write
+
+
+SNAPSHOTS_VERSION = 1
+DEFAULT_CHUNK_ROWS = 4096
+# pandas period alias: weeks ending on Sunday
+DEFAULT_FREQ = 'W'
+# aggregations computed per chunk and combined over the chunks of a snapshot
+CHUNK_AGGREGATIONS = ['sum', 'count', 'min', 'max']
+
+
+def _chunks_equal(a: tuple, b: tuple):
+    ''' True if two (values, valid) chunks hold the same values; entries where valid is False are ignored '''
+    if len(a[1]) != len(b[1]) or not np.array_equal(a[1], b[1]) or a[0].dtype != b[0].dtype:
+        return False
+    return bool(np.array_equal(a[0][a[1]], b[0][b[1]]))
+
+
+class TrackerSnapshots:
+    def __init__(self, chunk_rows: int = DEFAULT_CHUNK_ROWS, freq: str = DEFAULT_FREQ):
+        '''
+        State of a tracker at the end of each period, e.g. each week. Columns are cut into chunks of chunk_rows
+        rows; a snapshot refers to its chunks by id and a chunk unchanged since the previous snapshot is shared
+        instead of copied, so each snapshot only stores the chunks changed in its period.
+        Taking several snapshots in the same period keeps the last one, i.e. the state at the end of the period
+        :param chunk_rows: rows per chunk; smaller chunks store less for scattered changes, at more overhead
+        :param freq: pandas period alias of the buckets, e.g. 'W', 'W-FRI', 'M'
+        '''
+        self.chunk_rows: int = chunk_rows
+        self.freq: str = freq
+        # period start (ISO): {'start', 'end', 'taken', 'num_rows', 'change_id', 'index', 'dtypes', 'pooled',
+        # 'chunks': {col: [chunk ids]}}, sorted by period
+        self._snapshots: Dict[str, dict] = {}
+        self._periods: List[str] = []
+        # chunk id: (values, valid); chunks of a loaded store are read when first used
+        self._chunks: Dict[int, tuple] = {}
+        self._next_chunk: int = 0
+        # chunk id: name of the file holding it, for saved chunks
+        self._chunk_files: Dict[int, str] = {}
+        # (chunk id, aggregation): value
+        self._aggregates: Dict[tuple, object] = {}
+        # snapshot changes are compared with, the last one taken
+        self._last: dict = None
+        # decodes the pooled columns, codes never change so the latest pool decodes older snapshots
+        self.pool: StringPool = None
+        self._dir: str = None
+
+    def __len__(self):
+        return len(self._periods)
+
+    def period_of(self, timestamp):
+        ''' pd.Period holding a timestamp '''
+        return pd.Timestamp(timestamp).to_period(self.freq)
+
+    def periods(self):
+        ''' pd.Period of each snapshot, oldest first '''
+        return [pd.Period(self._snapshots[x]['start'], freq=self.freq) for x in self._periods]
+
+    def _new_chunk(self, values: np.ndarray, valid: np.ndarray):
+        chunk_id = self._next_chunk
+        self._next_chunk += 1
+        self._chunks[chunk_id] = (values.copy(), valid.copy())
+        return chunk_id
+
+    def _get_chunk(self, chunk_id: int):
+        if chunk_id not in self._chunks:
+            file_name = self._chunk_files[chunk_id]
+            with ColumnCodecs.ColumnFile(os.path.join(self._dir, file_name)) as f:
+                self._chunks[chunk_id] = f.read(str(chunk_id))
+        return self._chunks[chunk_id]
+
+    def _dirty(self, tracker, last: dict):
+        '''
+        Chunks changed since the last snapshot according to the tracker change log
+        :return: set of (col, chunk number) of updated values, None if every chunk has to be compared
+        '''
+        changes = tracker.change_table
+        if not tracker.log_changes or changes.num_rows() < last['change_id']:
+            return None
+
+        positions = np.arange(last['change_id'], changes.num_rows())
+        dirty = set()
+        for op, index_val, col in zip(changes.take('op', positions), changes.take('row_index', positions),
+                                      changes.take('col', positions)):
+            # inserted and deleted rows show in the index chunks, which are always compared
+            if op == 'update' and tracker.data_table.has_index(int(index_val)):
+                dirty.add((col, tracker.data_table.get_position(int(index_val)) // self.chunk_rows))
+        return dirty
+
+    def take(self, tracker, timestamp=None):
+        '''
+        Snapshots the current state of a tracker in the period of timestamp, replacing an earlier snapshot of the
+        same period
+        :param tracker: InforecastTracker
+        :param timestamp: time the state is reported at, now by default
+        :return: pd.Period of the snapshot
+        '''
+        period = self.period_of(timestamp if timestamp is not None else datetime.datetime.now())
+        table = tracker.data_table
+        self.pool = tracker.string_pool
+        num_rows = table.num_rows()
+        num_chunks = (num_rows + self.chunk_rows - 1) // self.chunk_rows
+        last = self._last
+        dirty = self._dirty(tracker, last) if last is not None else None
+
+        def chunk_ids(col: str, load, stable: set):
+            '''
+            :param load: function returning (values, valid) of the column, only called if a chunk may have changed
+            '''
+            previous = last['chunks'].get(col, []) if last is not None else []
+            out = []
+            column = None
+            for k in range(num_chunks):
+                if k < len(previous) and k in stable and dirty is not None and (col, k) not in dirty:
+                    out.append(previous[k])
+                    continue
+                if column is None:
+                    column = load()
+                chunk = (column[0][k * self.chunk_rows:(k + 1) * self.chunk_rows],
+                         column[1][k * self.chunk_rows:(k + 1) * self.chunk_rows])
+                if k < len(previous) and _chunks_equal(chunk, self._get_chunk(previous[k])):
+                    out.append(previous[k])
+                else:
+                    out.append(self._new_chunk(*chunk))
+            return out
+
+        # the index is always compared: a chunk with the same index values holds the same rows as before
+        index_values = table.get_index_name()
+        index_ids = chunk_ids(tracker.index, lambda: (index_values, np.ones(len(index_values), dtype=bool)), set())
+        previous_index = last['chunks'].get(tracker.index, []) if last is not None else []
+        stable = {k for k in range(min(len(index_ids), len(previous_index))) if index_ids[k] == previous_index[k]}
+
+        chunks = {tracker.index: index_ids}
+        dtypes = {tracker.index: index_values.dtype.str}
+        pooled = table.get_pooled()
+        for col in tracker.cols:
+            chunks[col] = chunk_ids(col, lambda: table.get_column(col, codes=True), stable)
+            dtypes[col] = np.dtype(np.int64 if col in pooled else column_dtype(tracker.cols[col].get_type())).str
+
+        snapshot = {
+            'start': str(period.start_time.date()),
+            'end': str(period.end_time.date()),
+            'taken': datetime.datetime.now().timestamp(),
+            'num_rows': num_rows,
+            'change_id': tracker.change_table.num_rows(),
+            'index': tracker.index,
+            'dtypes': dtypes,
+            'pooled': pooled,
+            'chunks': chunks
+        }
+        replaced = self._snapshots.get(snapshot['start'])
+        self._snapshots[snapshot['start']] = snapshot
+        self._periods = sorted(self._snapshots.keys())
+        self._last = snapshot
+        if replaced is not None:
+            self._drop_unused()
+        return period
+
+    def _drop_unused(self):
+        ''' Forgets chunks no snapshot refers to any more, e.g. after a snapshot was replaced '''
+        used = set()
+        for snapshot in self._snapshots.values():
+            for ids in snapshot['chunks'].values():
+                used.update(ids)
+        for chunk_id in set(self._chunks) - used:
+            del self._chunks[chunk_id]
+        self._aggregates = {k: v for k, v in self._aggregates.items() if k[0] in used}
+
+    def get_snapshot(self, timestamp):
+        '''
+        Snapshot reporting the state at timestamp: the one of its period, else the latest earlier one
+        :return: snapshot dict, None if there is none before timestamp
+        '''
+        start = str(self.period_of(timestamp).start_time.date())
+        position = bisect_right(self._periods, start)
+        return self._snapshots[self._periods[position - 1]] if position else None
+
+    def _column(self, snapshot: dict, col: str, decode: bool = True):
+        ids = snapshot['chunks'][col]
+        if not ids:
+            return np.zeros(0, dtype=np.dtype(snapshot['dtypes'][col])), np.zeros(0, dtype=bool)
+        chunks = [self._get_chunk(x) for x in ids]
+        values = np.concatenate([x[0] for x in chunks])
+        valid = np.concatenate([x[1] for x in chunks])
+        if decode and col in snapshot['pooled']:
+            values = self.pool.decode(values, valid)
+        return values, valid
+
+    def column(self, timestamp, col: str):
+        '''
+        :return: (values, valid) of a column as at timestamp; None if there is no snapshot or no such column
+        '''
+        snapshot = self.get_snapshot(timestamp)
+        if snapshot is None or col not in snapshot['chunks']:
+            return None
+        return self._column(snapshot, col)
+
+    def as_of(self, timestamp, cols: list = None):
+        '''
+        Tracker data as at timestamp
+        :param cols: columns to include, all by default
+        :return: pd.DataFrame indexed by the tracker index, missing values as NA; None if there is no snapshot
+        '''
+        snapshot = self.get_snapshot(timestamp)
+        if snapshot is None:
+            return None
+        index = snapshot['index']
+        index_values = self._column(snapshot, index)[0]
+        data = {}
+        for col in cols if cols is not None else [x for x in snapshot['chunks'] if x != index]:
+            values, valid = self._column(snapshot, col)
+            column = TypedColumn(values.dtype, capacity=len(values))
+            column.extend(values, valid)
+            data[col] = column.take()
+        return pd.DataFrame(data, index=pd.Index(index_values, name=index))
+
+    def _chunk_aggregate(self, chunk_id: int, func: str):
+        key = (chunk_id, func)
+        if key not in self._aggregates:
+            values, valid = self._get_chunk(chunk_id)
+            self._aggregates[key] = aggregate_values(values, valid, func)
+        return self._aggregates[key]
+
+    def aggregate(self, col: str, func: str = 'sum', start=None, end=None):
+        '''
+        Aggregate of a column at the end of each period. Results are kept per chunk, so a chunk shared by
+        many snapshots is aggregated once
+        :param func: one of 'sum', 'mean', 'min', 'max', 'count'
+        :param start: first timestamp to include, all periods if None
+        :param end: last timestamp to include, all periods if None
+        :return: pd.Series indexed by pd.Period, None where the column has no value
+        '''
+        assert func in CHUNK_AGGREGATIONS + ['mean'], f'Unknown aggregation: {func}'
+        out = {}
+        for period, key in zip(self.periods(), self._periods):
+            if (start is not None and period.end_time < pd.Timestamp(start)) or \
+                    (end is not None and period.start_time > pd.Timestamp(end)):
+                continue
+            ids = self._snapshots[key]['chunks'].get(col)
+            if ids is None:
+                out[period] = None
+                continue
+            assert func == 'count' or col not in self._snapshots[key]['pooled'], \
+                f'Only count applies to a pooled string column: {col}'
+            parts = {x: [self._chunk_aggregate(i, x) for i in ids] for x in
+                     (['sum', 'count'] if func == 'mean' else [func])}
+            if func == 'count':
+                out[period] = sum(parts['count'])
+                continue
+            present = {x: [v for v in parts[x] if v is not None] for x in parts}
+            if func == 'mean':
+                count = sum(parts['count'])
+                out[period] = sum(present['sum']) / count if count else None
+            elif not present[func]:
+                out[period] = None
+            else:
+                out[period] = {'sum': sum, 'min': min, 'max': max}[func](present[func])
+        return pd.Series(out, dtype=object)
+
+    def history(self, index_val, col: str):
+        '''
+        Value of one cell at the end of each period
+        :return: pd.Series indexed by pd.Period, None where the row does not exist or the value is missing
+        '''
+        out = {}
+        for period, key in zip(self.periods(), self._periods):
+            snapshot = self._snapshots[key]
+            value = None
+            if col in snapshot['chunks']:
+                positions = np.nonzero(self._column(snapshot, snapshot['index'])[0] == index_val)[0]
+                if len(positions):
+                    k, offset = divmod(int(positions[0]), self.chunk_rows)
+                    values, valid = self._get_chunk(snapshot['chunks'][col][k])
+                    if valid[offset]:
+                        value = values[offset]
+                        if col in snapshot['pooled']:
+                            value = self.pool.get(int(value))
+            out[period] = value
+        return pd.Series(out, dtype=object)
+
+    def stats(self):
+        '''
+        :return: dict with the number of snapshots and stored chunks, the bytes of the stored chunks in memory and
+                 the bytes full copies of every snapshot would take
+        '''
+        stored = set()
+        full_bytes = 0
+        sizes = {}
+        for snapshot in self._snapshots.values():
+            for ids in snapshot['chunks'].values():
+                for chunk_id in ids:
+                    if chunk_id not in sizes:
+                        values, valid = self._get_chunk(chunk_id)
+                        sizes[chunk_id] = values.nbytes + valid.nbytes
+                    full_bytes += sizes[chunk_id]
+                    stored.add(chunk_id)
+        return {
+            'snapshots': len(self._snapshots),
+            'chunks': len(stored),
+            'stored_bytes': int(sum(sizes.values())),
+            'full_copy_bytes': int(full_bytes)
+        }
+
+    def save(self, table_path: str, table_name: str):
+        '''
+        Writes the chunks not saved yet to a new .npz file (see ColumnCodecs), then the list of snapshots as json.
+        Files of earlier saves are not rewritten
+        :return: list of the names of the files written
+        '''
+        if not os.path.exists(table_path):
+            os.makedirs(table_path)
+        self._drop_unused()
+        written = []
+        new = sorted(x for x in self._chunks if x not in self._chunk_files)
+        if new:
+            file_name = f'{table_name}_{new[0]}{ColumnCodecs.FILE_EXT}'
+            index_ids = {x for s in self._snapshots.values() for x in s['chunks'][s['index']]}
+            ColumnCodecs.save_columns(os.path.join(table_path, file_name),
+                                      {str(x): self._chunks[x] + ('delta' if x in index_ids else 'zlib',)
+                                       for x in new})
+            self._chunk_files.update({x: file_name for x in new})
+            written.append(file_name)
+
+        used = {x for s in self._snapshots.values() for ids in s['chunks'].values() for x in ids}
+        header = {
+            'version': SNAPSHOTS_VERSION,
+            'chunk_rows': self.chunk_rows,
+            'freq': self.freq,
+            'next_chunk': self._next_chunk,
+            'last': self._last['start'] if self._last is not None else None,
+            'chunk_files': {str(x): self._chunk_files[x] for x in sorted(used)},
+            'snapshots': [self._snapshots[x] for x in self._periods]
+        }
+        with atomic_write(os.path.join(table_path, table_name + '.json')) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(header, f)
+        self._dir = table_path
+        return written + [table_name + '.json']
+
+    def load(self, table_path: str, table_name: str, pool: StringPool = None):
+        '''
+        Reads the list of snapshots; chunks are read from their files when first used
+        :param pool: string pool of the tracker, to decode pooled columns
+        '''
+        full_path = os.path.join(table_path, table_name + '.json')
+        assert os.path.exists(full_path), f'Snapshots file not found: {full_path}'
+        with open(full_path) as f:
+            header = json.load(f)
+
+        self.chunk_rows = header['chunk_rows']
+        self.freq = header['freq']
+        self._next_chunk = header['next_chunk']
+        self._chunk_files = {int(x): header['chunk_files'][x] for x in header['chunk_files']}
+        self._snapshots = {x['start']: x for x in header['snapshots']}
+        self._periods = sorted(self._snapshots.keys())
+        self._last = self._snapshots[header['last']] if header['last'] is not None else None
+        self._chunks = {}
+        self._aggregates = {}
+        self.pool = pool
+        self._dir = table_path
@@ -0,0 +1,115 @@
+import re
+
+import numpy as np
+
+from ColumnarTable import column_dtype
+from data_types import InforecastDataTypes
+
+
+class ColumnValidator:
+    def __init__(self, dtype: InforecastDataTypes, limit: tuple = None, options: list = None, pattern: str = None):
+        '''
+        Validator compiled from the constraints of a DataColumn. Everything that does not depend on the
+        value (expected type, limits, options set, regex) is resolved once here, so validating a value is a
+        few attribute lookups. Kept as a plain class (no closures) so validators can be sent to other processes
+        :param dtype: type of the column
+        :param limit: (min, max) for numbers, (0, max length) for strings; None for no limit
+        :param options: allowed values; empty or None for any value
+        :param pattern: regex the whole string has to match (strings only); None for no pattern
+        '''
+        self.dtype: InforecastDataTypes = dtype
+        self.py_type: type = dtype.value
+        # type of the values in a numpy buffer of the column, e.g. np.bool_ for BOOL
+        self.np_type: type = column_dtype(dtype).type
+        self.is_str: bool = dtype == InforecastDataTypes.STR
+
+        self.has_limit: bool = bool(limit)
+        self.lim_min = limit[0] if limit else None
+        self.lim_max = limit[1] if limit else None
+
+        self.has_options: bool = bool(options)
+        self.options = None
+        if options:
+            try:
+                self.options = frozenset(options)
+            except TypeError:
+                # unhashable options, keep the list
+                self.options = list(options)
+
+        self.pattern = re.compile(pattern) if pattern and self.is_str else None
+
+    def type_isValid(self, value):
+        return type(value) == self.py_type
+
+    def limit_isValid(self, value):
+        if not self.has_limit:
+            return True
+        measure = len(value) if self.is_str else value
+        return self.lim_max > measure > self.lim_min
+
+    def option_isValid(self, value):
+        return not self.has_options or value in self.options
+
+    def __call__(self, value):
+        # type_isValid, limit_isValid and option_isValid inlined, this is called for every value
+        if type(value) != self.py_type:
+            return False
+
+        if self.has_limit:
+            measure = len(value) if self.is_str else value
+            if not self.lim_max > measure > self.lim_min:
+                return False
+
+        if self.has_options and value not in self.options:
+            return False
+
+        if self.pattern is not None and not self.pattern.fullmatch(value):
+            return False
+
+        return True
+
+    def validate_array(self, values: np.ndarray, valid: np.ndarray = None):
+        '''
+        Validates a whole column at once
+        :param values: column values
+        :param valid: bool array, False for missing values which are not validated; all present if None
+        :return: bool array, True where the value is missing or passes validation
+        '''
+        values = np.asarray(values)
+        if valid is None:
+            valid = np.ones(len(values), dtype=bool)
+        ok = np.ones(len(values), dtype=bool)
+        if not len(values):
+            return ok
+
+        if values.dtype == object:
+            ok &= np.fromiter((type(x) == self.py_type for x in values), dtype=bool, count=len(values))
+        elif values.dtype.type != self.np_type:
+            # typed buffers only hold values of their own type
+            ok[:] = False
+            return ok | ~valid
+
+        # Only the values passing the previous checks are looked at further
+        check = ok & valid
+        if self.has_limit:
+            if self.is_str:
+                measure = np.fromiter((len(x) if c else 0 for x, c in zip(values, check)), dtype=np.int64,
+                                      count=len(values))
+            else:
+                measure = values
+            ok &= ~check | ((measure > self.lim_min) & (measure < self.lim_max))
+            check &= ok
+
+        if self.has_options:
+            if values.dtype != object and isinstance(self.options, frozenset):
+                ok &= ~check | np.isin(values, np.array(list(self.options), dtype=values.dtype))
+            else:
+                ok &= ~check | np.fromiter((c and x in self.options for x, c in zip(values, check)), dtype=bool,
+                                           count=len(values))
+            check &= ok
+
+        if self.pattern is not None:
+            ok &= ~check | np.fromiter((c and self.pattern.fullmatch(x) is not None for x, c in zip(values, check)),
+                                       dtype=bool, count=len(values))
+
+        return ok | ~valid
@@ -2,6 +2,11 @@ from Table import Table
 from enum import Enum
 from typing import Dict
 from DataColumn import DataColumn
+from data_types import InforecastDataTypes
+import os
+import warnings
+import numpy as np
+import pandas as pd
 
 
 class ValidationTableRows(Enum):
@@ -9,6 +14,26 @@ class ValidationTableRows(Enum):
     DTYPE = 1
     LIM_MIN = 2
     LIM_MAX = 3
+    PATTERN = 4
+
+
+def parse_value(dtype: InforecastDataTypes, text):
+    '''
+    Value of the given type from its text in a saved table
+    :param dtype: type of the column
+    :param text: str, or a value already parsed
+    :return: value of type dtype.value
+    '''
+    if type(text) == dtype.value:
+        return text
+    if dtype == InforecastDataTypes.BOOL:
+        return dtype.value(str(text).strip().lower() in ['true', '1'])
+    if dtype == InforecastDataTypes.DATE:
+        return pd.Timestamp(text).to_pydatetime()
+    if dtype == InforecastDataTypes.INT64:
+        # integers may have been written as floats, e.g. 10.0
+        return dtype.value(np.float64(text)) if '.' in str(text) else dtype.value(text)
+    return dtype.value(text)
 
 
 class InforecastValidationTable(Table):
@@ -17,70 +42,105 @@ class InforecastValidationTable(Table):
         # incex col name for the validation table
         self.val_ind: str = 'index'
         self.next_ind_val: int = 0
-        # max from ValidationTableRows
-        self.pre_options_val_ind: int = 4
+        # rows before the options, one per ValidationTableRows
+        self.pre_options_val_ind: int = len(ValidationTableRows)
 
     def init(self, data_cols: Dict[str, DataColumn]):
         '''
         Initialises the table by creating a table where cols correspond to cols in the main table passed via data_cols
         and rows correspond to the key information about a column. Indexes in ValidationTableRows represent constant
-        params, indexes beyond represent options for a drop-down menu
+        params, indexes beyond represent options for a drop-down menu. The table is built in one pass, column by
+        column
         :param data_cols: dict [str, DataColumn] <=> column tag: DataColumn object
-        :return: True; False if empty data_cols; can throw RuntimeError
+        :return: True; False if empty data_cols
         '''
 
         if not data_cols:
             return False
 
-        cols = list(data_cols.keys()) + [self.val_ind]
-        self.create_table(columns=cols, index=self.val_ind)
-
-        # Process main validation criteria
-        for i in range(self.pre_options_val_ind):
-            row = {}
-            row[self.val_ind] = self.next_ind_val
-            self.next_ind_val += 1
-            for tag in data_cols:
-                data_col = data_cols[tag]
-                if i == ValidationTableRows.NAME.value:
-                    row[tag] = data_col.get_name()
-                elif i == ValidationTableRows.DTYPE.value:
-                    row[tag] = str(data_col.get_type())
-                elif i == ValidationTableRows.LIM_MIN.value:
-                    if data_col.get_limit():
-                        row[tag] = data_col.get_limit()[0]
-                    else:
-                        row[tag] = None
-                elif i == ValidationTableRows.LIM_MAX.value:
-                    if data_col.get_limit():
-                        row[tag] = data_col.get_limit()[1]
-                    else:
-                        row[tag] = None
-                else:
-                    raise RuntimeError('Cannot init Validation Table - index out of range')
-
-            self.insert_row(new_row=row)
-
-        # Add options
-        max_options = 0
+        max_options = max(data_col.num_options for data_col in data_cols.values())
+        num_rows = self.pre_options_val_ind + max_options
+
+        data = {}
         for tag in data_cols:
             data_col = data_cols[tag]
-            if data_col.num_options > max_options:
-                max_options = data_col.num_options
+            limit = data_col.get_limit()
+            col = [None] * num_rows
+            col[ValidationTableRows.NAME.value] = data_col.get_name()
+            # enum member name, parsed back with InforecastDataTypes[name]
+            col[ValidationTableRows.DTYPE.value] = data_col.get_type().name
+            col[ValidationTableRows.LIM_MIN.value] = limit[0] if limit else None
+            col[ValidationTableRows.LIM_MAX.value] = limit[1] if limit else None
+            col[ValidationTableRows.PATTERN.value] = data_col.get_pattern()
+            col[self.pre_options_val_ind:self.pre_options_val_ind + data_col.num_options] = data_col.get_options()
+            data[tag] = col
+
+        self._cols_list = list(data_cols.keys()) + [self.val_ind]
+        self._index = self.val_ind
+        self._table = pd.DataFrame(data, index=pd.Index(range(num_rows), name=self.val_ind), dtype=object)
+        self.next_ind_val = num_rows
 
-        for i in range(max_options):
-            row = {}
-            row[self.val_ind] = self.next_ind_val
-            self.next_ind_val += 1
+        return True
 
-            for tag in data_cols:
-                data_col = data_cols[tag]
+    def load_columns(self, table_path: str, table_name: str):
+        '''
+        Reverse of init: reads a saved validation table and rebuilds the DataColumn objects it describes
+        :param table_path: folder of the file
+        :param table_name: file name, .csv
+        :return: dict [str, DataColumn] <=> column tag: DataColumn object; None if the file cannot be parsed
+        '''
+        if not table_name.endswith('.csv'):
+            table_name += '.csv'
+        full_path = os.path.join(table_path, table_name)
+        assert os.path.exists(full_path), f'Validation table not found: {full_path}'
 
-                if i < data_col.num_options:
-                    row[tag] = data_col.get_options()[i]
-                else:
-                    row[tag] = None
+        # everything as text, empty cells are missing values
+        df = pd.read_csv(full_path, index_col=0, dtype=str, keep_default_na=False)
+        df.index.name = self.val_ind
+        self._table = df.astype(object).where(df != '', None)
+        self._cols_list = list(df.columns) + [self.val_ind]
+        self._index = self.val_ind
+        self.next_ind_val = len(df)
 
-            self.insert_row(new_row=row)
+        return self.to_columns()
 
-        return True
+    def to_columns(self):
+        '''
+        DataColumn objects described by the table
+        :return: dict [str, DataColumn]; None if a column cannot be parsed
+        '''
+        data_cols = {}
+        for tag in self._table.columns:
+            col = self._table[tag].tolist()
+            type_name = col[ValidationTableRows.DTYPE.value]
+            if type_name not in InforecastDataTypes.__members__:
+                warnings.warn(f'Unknown data type for column {tag}: {type_name}')
+                return None
+            dtype = InforecastDataTypes[type_name]
+
+            data_col = DataColumn(dtype=dtype, name=col[ValidationTableRows.NAME.value])
+            if data_col.get_tag() != tag:
+                warnings.warn(f'Column name {data_col.get_name()} does not match the column tag: {tag}')
+                return None
+
+            lim_min = col[ValidationTableRows.LIM_MIN.value]
+            lim_max = col[ValidationTableRows.LIM_MAX.value]
+            if lim_max is None:
+                data_col.limit = None
+            elif dtype == InforecastDataTypes.STR:
+                data_col.set_limit({'max': InforecastDataTypes.to_int64(parse_value(InforecastDataTypes.INT64,
+                                                                                    lim_max))})
+            else:
+                data_col.set_limit({'min': parse_value(dtype, lim_min), 'max': parse_value(dtype, lim_max)})
+
+            pattern = col[ValidationTableRows.PATTERN.value]
+            if pattern is not None:
+                data_col.set_pattern(pattern)
+
+            options = [parse_value(dtype, x) for x in col[self.pre_options_val_ind:] if x is not None]
+            if options and not data_col.set_options(options):
+                return None
+
+            data_cols[tag] = data_col
+
+        return data_cols
@@ -2,6 +2,7 @@ import datetime
 
 import numpy as np
 from abc import ABC
+from enum import Enum
 
 
 class InData(ABC):
@@ -219,6 +220,30 @@ class InText(InData):
         return len(self.raw())
 
 
+class InforecastDataTypes(Enum):
+    '''
+    Types a DataColumn can hold; the value of a member is the python type of the column values, so the type of a
+    value is looked up with InforecastDataTypes(type(value))
+    '''
+    INT64 = np.int64
+    FLOAT64 = np.float64
+    STR = str
+    DATE = datetime.datetime
+    BOOL = bool
+
+    @staticmethod
+    def to_int64(value):
+        return np.int64(value)
+
+    @staticmethod
+    def to_str(value):
+        return str(value)
+
+
+# Types accepting a (min, max) limit
+NUM_TYPES = [InforecastDataTypes.INT64, InforecastDataTypes.FLOAT64]
+
+
 if __name__ == "__main__":
     from random import random, randint
     check_InNumber = True
@@ -1,4 +1,31 @@
+import os
+import sys
+from contextlib import contextmanager
+
+# Modules shared with the KPI code live in the repository root and are imported from there
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.append(REPO_DIR)
+
+import Instrumentation  # noqa: E402
+
+
 def generate_tag(value: str):
     # Replace forbidden chars in the name to store in the table
     tag = value.replace(' ', '_')
     return tag
+
+
+@contextmanager
+def atomic_write(path: str):
+    '''
+    Yields a temporary path to write to; the file then replaces path in one step, so readers see either the
+    old or the new file, never a partial one
+    '''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
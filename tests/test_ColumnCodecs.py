@@ -0,0 +1,60 @@
+import datetime
+import json
+import os
+import pickle
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from ColumnCodecs import CODECS, ColumnFile, decode_column, encode_column, save_columns
+
+
+def objects(items):
+    out = np.empty(len(items), dtype=object)
+    out[:] = items
+    return out
+
+
+COLUMNS = {
+    'int': np.array([5, 7, 7, -3, 1000000], dtype=np.int64),
+    'float': np.array([1.5, 0., 0., -2.25, 1e9]),
+    'bool': np.array([True, False, False, True, True]),
+    'str': objects(['a', 'b', 'b', 'c', 'é']),
+    'date': objects([datetime.datetime(2022, 1, 1), datetime.datetime(2022, 5, 7, 12, 30), None,
+                     datetime.datetime(2022, 5, 7, 12, 30), datetime.datetime(1999, 12, 31)]),
+}
+VALID = np.array([True, True, False, True, True])
+
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('col', list(COLUMNS))
+def test_columns_round_trip(tmp_path, col, codec):
+    if codec == 'delta' and col in ['float', 'bool', 'str']:
+        return
+    path = str(tmp_path / 'cols')
+    save_columns(path, {col: (COLUMNS[col], VALID, codec)})
+
+    with ColumnFile(path) as f:
+        values, valid = f.read(col)
+
+    assert valid.tolist() == VALID.tolist()
+    assert values.dtype == COLUMNS[col].dtype
+    assert values[VALID].tolist() == COLUMNS[col][VALID].tolist()
+
+
+def test_objects_other_than_json_values_and_dates_are_refused():
+    with pytest.raises(TypeError):
+        encode_column(objects([{1, 2}, 'a']), np.array([True, True]), 'zlib')
+
+
+def test_pickled_payload_is_not_loaded():
+    meta, parts = encode_column(objects(['a', 'b']), np.array([True, True]), 'zlib')
+    meta['kind'] = 'pickle'
+    parts['values'] = np.frombuffer(zlib.compress(pickle.dumps(['a', 'b'])), dtype=np.uint8)
+
+    with pytest.raises(ValueError):
+        decode_column(json.loads(json.dumps(meta)), parts)
@@ -0,0 +1,53 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastProject import InforecastProject
+from InforecastTracker import InforecastTracker
+from TrackerQuery import Predicate
+from data_types import InforecastDataTypes
+
+
+def make_project(tmp_path):
+    project = InforecastProject('catalog', base_dir=str(tmp_path))
+    assert project.init()
+    for name, start in [('early', 0), ('late', 100)]:
+        cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), DataColumn(InforecastDataTypes.DATE, 'due'),
+                DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+        tracker = project.add_tracker(name, cols)
+        for i in range(start, start + 10):
+            tracker.add_row({'WPId': f'W{i}', 'due': datetime.datetime(2022, 1, 1) + datetime.timedelta(days=i),
+                             'cost': np.float64(i)})
+        tracker.save()
+    return project
+
+
+def test_trackers_are_pruned_on_their_saved_statistics(tmp_path):
+    make_project(tmp_path)
+    project = InforecastProject('catalog', base_dir=str(tmp_path))
+    assert project.open()
+
+    assert project.prune(Predicate('cost', '>=', 50.)) == ['late']
+    assert project.prune(Predicate('due', '<', datetime.datetime(2022, 2, 1))) == ['early']
+    assert project.prune(Predicate('cost', '<', 0.) | Predicate('cost', '==', 105.)) == ['late']
+    assert project.prune(Predicate('cost', '>', 5.) & Predicate('WPId', '>', 'X')) == []
+    # nothing was read to answer
+    assert project._trackers == {}
+
+
+def test_unsaved_and_external_changes_are_not_pruned_away(tmp_path):
+    project = make_project(tmp_path)
+    project.get_tracker('early').add_row({'WPId': 'big', 'cost': np.float64(500)})
+    assert project.prune(Predicate('cost', '>', 200.)) == ['early']
+
+    other = InforecastTracker()
+    assert other.open(os.path.join(project.dir, 'late'))
+    other.add_row({'WPId': 'bigger', 'cost': np.float64(900)})
+    other.save()
+    assert project.refresh_catalog() == ['late']
+    assert project.prune(Predicate('cost', '>', 800.)) == ['early', 'late']
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from KpiNormalisation import normalise
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages, NormalisationTypes
+
+
+def test_degenerate_bounds_raise_instead_of_casting_nan():
+    with pytest.raises(ZeroDivisionError):
+        normalise(NormalisationTypes.LINEAR, [3., 5.], lower_bound=5., upper_bound=5.)
+    with pytest.raises(ZeroDivisionError):
+        normalise(NormalisationTypes.PRACTICE, [-1.], good_practice=0., leading_practice=10.)
+    # only values below good practice divide by it
+    assert normalise(NormalisationTypes.PRACTICE, [5., 20.], good_practice=0., leading_practice=10.).tolist() == [
+        75, 100]
+
+
+def test_undefined_score_fails_only_its_own_kpi():
+    project = SdfProject(riba_stage=RibaStages.TWO, dev_type=DevelopmentTypes.RESIDENTIAL)
+    for identifier, val, lower_bound in [('ok', 5., 0.), ('flat', 5., 10.)]:
+        project.add_kpi(kpi_identifier=identifier, kpi_type=KpiTypes.NUMBER, input_args={'val': val},
+                        development_types=[DevelopmentTypes.RESIDENTIAL], riba_stages=[RibaStages.TWO],
+                        good_practice=5., leading_practice=8., lower_bound_norm=lower_bound, upper_bound_norm=10.,
+                        normalisation=NormalisationTypes.LINEAR)
+
+    results = project.evaluate_all()
+
+    assert results['ok']['final_score'] == 50
+    assert results['flat']['final_score'] is None and results['flat']['status'] == KpiStatus.UNDEFINED
@@ -0,0 +1,74 @@
+import datetime
+import os
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from MaterializedViews import MaterializedView
+from TrackerQuery import Predicate
+from data_types import InforecastDataTypes
+
+
+def make_tracker(tmp_path):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.STR, 'owner'), DataColumn(InforecastDataTypes.DATE, 'due'),
+            DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    assert tracker.init('views', cols, {'project_dir': str(tmp_path)})
+    for i in range(12):
+        tracker.add_row({'owner': ['ann', 'bob', 'cy'][i % 3], 'due': datetime.datetime(2022, 1 + i % 2, 1),
+                         'cost': np.float64(i)})
+    return tracker
+
+
+def test_view_round_trips_through_json():
+    view = MaterializedView('v', group_by=['due'], aggs={'n': ('cost', 'count'), 'top': ('cost', 'max'),
+                                                         'avg': ('cost', 'mean')},
+                            where=Predicate('due', '>=', datetime.datetime(2022, 1, 1)) & Predicate('cost', '>', 1.))
+    view.build((i, {'due': datetime.datetime(2022, 1, 1 + i % 2), 'cost': float(i)}) for i in range(6))
+
+    copy = MaterializedView.from_dict(view.to_dict())
+
+    assert copy.result().equals(view.result())
+    copy.apply(None, {'due': datetime.datetime(2022, 1, 2), 'cost': 10.})
+    assert copy.result().set_index('due').loc[datetime.datetime(2022, 1, 2), 'top'] == 10.
+
+
+def test_views_are_read_back_on_open_without_the_data(tmp_path):
+    tracker = make_tracker(tmp_path)
+    assert tracker.add_view(MaterializedView('by owner', group_by=['owner'], aggs={'total': ('cost', 'sum')}))
+    assert tracker.add_view(MaterializedView('by due', group_by=['due'], aggs={'n': ('cost', 'count')}))
+    expected = tracker.get_view('by owner')
+    tracker.save()
+
+    reopened = InforecastTracker()
+    assert reopened.open(tracker.dir)
+    assert reopened.get_view('by owner').equals(expected)
+    assert not reopened.is_loaded('data')
+    assert len(reopened.get_view('by due')) == 2
+
+    # maintained after reading back
+    reopened.add_row({'owner': 'ann', 'cost': np.float64(100)})
+    assert reopened.get_view('by owner').set_index('owner').loc['ann', 'total'] == expected.set_index(
+        'owner').loc['ann', 'total'] + 100
+
+
+def test_close_discards_unsaved_view_changes_and_removed_views(tmp_path):
+    tracker = make_tracker(tmp_path)
+    tracker.add_view(MaterializedView('by owner', group_by=['owner'], aggs={'n': ('cost', 'count')}))
+    tracker.add_view(MaterializedView('old', group_by=[], aggs={'n': ('cost', 'count')}))
+    tracker.save()
+    del tracker.views['old']
+    tracker.save()
+    assert not any('_view_old' in x for x in os.listdir(tracker.dir))
+    assert list(tracker.manifest['views']) == ['by owner']
+
+    tracker.add_row({'owner': 'dan', 'cost': np.float64(1)})
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        tracker.close(save=False)
+    assert 'dan' not in tracker.get_view('by owner')['owner'].tolist()
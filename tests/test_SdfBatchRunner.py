@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SdfBatchRunner import SdfBatchRunner, _Encoder, _decode
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, DevelopmentTypes, RibaStages, NormalisationTypes
+
+STAGES = [RibaStages.ONE, RibaStages.TWO]
+DEV_TYPES = [DevelopmentTypes.RESIDENTIAL]
+
+
+def make_project(i: int):
+    project = SdfProject(riba_stage=RibaStages.TWO, dev_type=DevelopmentTypes.RESIDENTIAL)
+    project.add_kpi(kpi_identifier='number', kpi_type=KpiTypes.NUMBER, input_args={'val': float(i)},
+                    development_types=DEV_TYPES, riba_stages=STAGES, good_practice=5., leading_practice=10.)
+    project.add_kpi(kpi_identifier='set', kpi_type=KpiTypes.NUMBERS_SET,
+                    input_args={'vals': [i, 2 * i], 'func': lambda x: sum(x) / len(x)},
+                    development_types=DEV_TYPES, riba_stages=STAGES, good_practice=5., leading_practice=10.,
+                    lower_bound_norm=0, upper_bound_norm=20, normalisation=NormalisationTypes.LINEAR)
+    project.add_kpi(kpi_identifier='failing', kpi_type=KpiTypes.NUMBERS_SET,
+                    input_args={'vals': [i], 'func': lambda x: {}['total']},
+                    development_types=DEV_TYPES, riba_stages=STAGES, good_practice=5., leading_practice=10.)
+    questions = {'first': {'no': 0, 'yes': 2, 'reply': 'yes'}, 'second': {'no': 0, 'yes': 1, 'reply': 'no'}}
+    project.add_kpi(kpi_identifier='quiz', kpi_type=KpiTypes.QUIZ, input_args={'questions': questions},
+                    development_types=DEV_TYPES, riba_stages=STAGES, good_practice=1., leading_practice=3.)
+    project.add_kpi(kpi_identifier='unanswered', kpi_type=KpiTypes.CHECKBOXES,
+                    input_args={'questions': {'a': {'no': 0, 'yes': 1, 'reply': 'yes'}, 'b': {'no': 0, 'yes': 1}}},
+                    development_types=DEV_TYPES, riba_stages=STAGES, good_practice=1., leading_practice=2.)
+    return project
+
+
+def comparable(results: dict):
+    return {x: (y['type'], y['raw_score'], y['final_score'], y['status'], y['error']) for x, y in results.items()}
+
+
+def test_projects_round_trip_through_the_encoding():
+    encoder = _Encoder()
+    projects = [make_project(i) for i in range(3)]
+    encoded = [encoder.encode(f'P{i}', x) for i, x in enumerate(projects)]
+    questions = [(encoder.strings[x], {encoder.strings[o]: s for o, s in zip(names, scores)})
+                 for x, names, scores in encoder.questions]
+
+    for project, item in zip(projects, encoded):
+        decoded = _decode(item, encoder.strings, encoder.kpis, questions, encoder.templates)
+
+        assert list(decoded.kpis) == list(project.kpis)
+        assert decoded.kpis['quiz']._input_args == project.kpis['quiz']._input_args
+        assert decoded.kpis['unanswered']._input_args == project.kpis['unanswered']._input_args
+        assert comparable(decoded.evaluate_all()) == comparable(project.evaluate_all())
+    # a shared template per KPI
+    assert len(encoder.templates) == 5
+
+
+def test_encoded_run_matches_the_evaluation_in_process():
+    projects = {f'P{i}': make_project(i) for i in range(4)}
+
+    table = SdfBatchRunner(processes=2, mp_context='spawn').run(projects)
+
+    for project_identifier, project in projects.items():
+        assert comparable(table.project_results(project_identifier)) == comparable(project.evaluate_all())
+    assert np.isnan(table.column('raw_score')).sum() == 8
+    assert table.project_results('P0')['failing']['error'] == "KeyError: 'total'"
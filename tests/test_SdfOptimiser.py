@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SdfOptimiser import SdfOptimiser
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages
+
+
+def make_project(num_questions: int, options: dict, good_practice: float):
+    project = SdfProject(riba_stage=RibaStages.TWO, dev_type=DevelopmentTypes.RESIDENTIAL)
+    questions = {f'Question {i}': dict(options, reply='red') for i in range(num_questions)}
+    project.add_kpi(kpi_identifier='K', kpi_type=KpiTypes.QUIZ, input_args={'questions': questions},
+                    development_types=[DevelopmentTypes.RESIDENTIAL], riba_stages=[RibaStages.TWO],
+                    good_practice=good_practice, leading_practice=good_practice * 2)
+    return project
+
+
+def test_greedy_upgrades_to_higher_gain_options():
+    # non integer gains go to the greedy solution; the best gain per effort (orange) alone only reaches 5
+    project = make_project(10, {'red': 0, 'orange': 0.5, 'green': 2.0}, good_practice=10)
+    effort = {('K', f'Question {i}', 'orange'): 1 for i in range(10)}
+    effort.update({('K', f'Question {i}', 'green'): 5 for i in range(10)})
+
+    solution = SdfOptimiser(project=project, effort=effort).solve(target=KpiStatus.GOOD_PRACTICE)
+
+    assert solution['unreachable'] == []
+    assert not solution['optimal']
+    gains = {'orange': 0.5, 'green': 2.0}
+    assert sum(gains[x['alternative']] for x in solution['changes']) >= 10
+    # 4 green and 4 orange, cheaper than 5 green
+    assert solution['total_effort'] == 24
+
+
+def test_greedy_unreachable_only_when_best_options_fall_short():
+    moves = [[(1, 0.5, 1.), (2, 2., 5.)] for _ in range(10)]
+    assert SdfOptimiser.solve_greedy(moves, 20.5) is None
+    assert len(SdfOptimiser.solve_greedy(moves, 20.)) == 10
+
+
+def test_greedy_matches_dp_on_integer_gains():
+    project = make_project(20, {'red': 0, 'orange': 1, 'green': 2}, good_practice=25)
+    optimiser = SdfOptimiser(project=project)
+    questions, options, current_raw, moves = optimiser.candidates('K')
+
+    changes = SdfOptimiser.solve_greedy(moves, 25 - current_raw)
+    gains = {(q, o): g for q, question_moves in enumerate(moves) for o, g, _ in question_moves}
+    assert sum(gains[x] for x in changes) >= 25
+    assert len(changes) == len(SdfOptimiser.solve_dp(moves, 25, float('inf')))
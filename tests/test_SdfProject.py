@@ -0,0 +1,62 @@
+import os
+import sys
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SdfProject import SdfProject
+from KpiEnums import KpiTypes, KpiStatus, DevelopmentTypes, RibaStages
+
+
+def make_project():
+    project = SdfProject(riba_stage=RibaStages.TWO, dev_type=DevelopmentTypes.RESIDENTIAL)
+    project.add_kpi(kpi_identifier='quiz', kpi_type=KpiTypes.QUIZ,
+                    input_args={'questions': {'q': {'no': 0, 'yes': 2, 'reply': 'no'}}},
+                    development_types=[DevelopmentTypes.RESIDENTIAL], riba_stages=[RibaStages.TWO],
+                    good_practice=1., leading_practice=2.)
+    return project
+
+
+def add_numbers_set(project: SdfProject, kpi_identifier: str, vals: list, func):
+    project.add_kpi(kpi_identifier=kpi_identifier, kpi_type=KpiTypes.NUMBERS_SET,
+                    input_args={'vals': vals, 'func': func},
+                    development_types=[DevelopmentTypes.RESIDENTIAL], riba_stages=[RibaStages.TWO],
+                    good_practice=5., leading_practice=10.)
+
+
+def test_unknown_kpi_identifier_returns_none():
+    project = make_project()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert project.verify_kpi_identifier('missing') is False
+        assert project.sensitivity('missing') is None
+        assert project.get_final_score('missing') is None
+    assert [x['alternative'] for x in project.sensitivity('quiz')] == ['yes']
+
+
+def test_any_exception_fails_only_its_own_kpi():
+    project = make_project()
+    add_numbers_set(project, 'mean', [4., 8.], lambda x: sum(x) / len(x))
+    add_numbers_set(project, 'lookup', [4., 8.], lambda x: {}['total'])
+    add_numbers_set(project, 'empty', [], lambda x: sum(x) / len(x))
+
+    results = project.evaluate_all()
+
+    assert results['mean']['raw_score'] == 6. and results['mean']['error'] is None
+    assert results['lookup']['error'] == "KeyError: 'total'"
+    assert results['empty']['error'] == 'ZeroDivisionError: division by zero'
+    assert results['empty']['status'] == KpiStatus.UNDEFINED
+    assert results['quiz']['status'] == KpiStatus.NEEDS_IMPROVEMENT
+
+
+def test_raw_score_at_the_thresholds():
+    project = make_project()
+    # the good practice threshold was out of bounds before, it is good practice now as in the normalisation
+    add_numbers_set(project, 'good', [5.], sum)
+    add_numbers_set(project, 'leading', [10.], sum)
+
+    results = project.evaluate_all()
+
+    assert results['good']['status'] == KpiStatus.GOOD_PRACTICE and results['good']['error'] is None
+    assert results['leading']['status'] == KpiStatus.LEADING_PRACTICE
@@ -0,0 +1,74 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from ShardedTable import default_context
+from TrackerQuery import Field, Predicate
+from data_types import InforecastDataTypes
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    owner = DataColumn(InforecastDataTypes.STR, 'owner')
+    owner.set_options(['ann', 'bob', 'cy'])
+    cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), owner, DataColumn(InforecastDataTypes.DATE, 'due'),
+            DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    tracker = InforecastTracker()
+    assert tracker.init('sharded', cols, {'project_dir': str(tmp_path)}, string_pool=['owner'],
+                        sharding={'shard_size': 25, 'processes': 2})
+    for i in range(100):
+        row = {'WPId': f'W{i}', 'due': datetime.datetime(2022, 1 + i % 12, 1), 'cost': np.float64(i)}
+        if i % 4 < 3:
+            row['owner'] = ['ann', 'bob', 'cy'][i % 4]
+        tracker.add_row(row)
+    tracker.save(compress=True)
+    yield tracker
+    tracker.data_table.close()
+
+
+def matching(tracker, predicate):
+    return tracker.query().select(['WPId']).where(predicate).execute()['WPId'].tolist()
+
+
+def test_worker_filters_match_the_rows_in_memory(tracker):
+    predicate = (Predicate('owner', '>', 'ann') & Predicate('due', '<', datetime.datetime(2022, 6, 1))) | \
+        Predicate('cost', '>=', 98.)
+    table = tracker.data_table
+
+    assert table._use_workers()
+    expected = np.flatnonzero(predicate.mask(table)).tolist()
+    assert table.filter([predicate]).tolist() == expected
+    assert table._executor is not None
+    assert matching(tracker, Field('owner').is_null() & (Field('cost') < 10.)) == ['W3', 'W7']
+
+
+def test_shards_changed_since_the_save_are_filtered_in_memory(tracker):
+    tracker.amend_val(5, 'owner', 'cy')
+    tracker.add_row({'WPId': 'new', 'owner': 'cy', 'cost': np.float64(0)})
+
+    found = matching(tracker, Predicate('owner', '==', 'cy') & Predicate('cost', '<', 10.))
+
+    assert found == ['W2', 'W5', 'W6', 'new']
+    assert len(tracker.data_table._files) == 3
+
+
+def test_workers_validate_shard_files_and_pooled_columns_here(tracker):
+    tracker.cols['cost'].set_limit({'min': np.float64(-1), 'max': np.float64(50)})
+    tracker.cols['owner'].set_options(['ann', 'bob'])
+
+    invalid = tracker.validate_all()
+
+    assert invalid['cost'] == list(range(50, 100))
+    assert invalid['owner'] == list(range(2, 100, 4))
+
+
+def test_workers_are_not_forked():
+    # forking copies the locks held by other threads, e.g. the log compactor
+    assert default_context().get_start_method() in ['forkserver', 'spawn']
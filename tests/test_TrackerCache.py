@@ -0,0 +1,77 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from TrackerCache import TrackerCache
+from data_types import InforecastDataTypes
+
+
+def make_tracker(tmp_path, name: str):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    assert tracker.init(name, cols, {'project_dir': str(tmp_path)})
+    for i in range(3):
+        tracker.add_row({'WPId': f'W{i}', 'cost': np.float64(i)})
+    tracker.save()
+    return tracker.tag
+
+
+def test_a_tracker_saved_elsewhere_is_read_again(tmp_path):
+    tag = make_tracker(tmp_path, 'cached')
+    cache = TrackerCache()
+    cached = cache.get(str(tmp_path), tag)
+    assert cache.get(str(tmp_path), tag) is cached
+
+    # saved through the cache, the entry stays valid
+    cached.amend_val(0, 'cost', np.float64(10))
+    cached.save()
+    assert cache.get(str(tmp_path), tag) is cached
+
+    other = InforecastTracker()
+    assert other.open(os.path.join(str(tmp_path), tag))
+    other.amend_val(1, 'cost', np.float64(11))
+    other.save()
+    reloaded = cache.get(str(tmp_path), tag)
+
+    assert reloaded is not cached
+    assert reloaded.data_table.get_value(1, 'cost') == 11.
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+
+
+def test_unsaved_changes_are_neither_reloaded_nor_evicted(tmp_path):
+    tags = [make_tracker(tmp_path, f'cached{i}') for i in range(3)]
+    cache = TrackerCache()
+    modified = cache.get(str(tmp_path), tags[0])
+    modified.amend_val(0, 'cost', np.float64(10))
+    cache.max_bytes = cache.nbytes()
+
+    other = InforecastTracker()
+    assert other.open(os.path.join(str(tmp_path), tags[0]))
+    other.save()
+    with warnings.catch_warnings():
+        # the modified tracker alone is above the limit
+        warnings.simplefilter('ignore')
+        cache.get(str(tmp_path), tags[1])
+        cache.get(str(tmp_path), tags[2])
+
+    assert cache.get(str(tmp_path), tags[0]) is modified
+    assert (os.path.normpath(str(tmp_path)), tags[1]) not in cache
+    assert cache.stats()['evictions'] == 1 and cache.stats()['invalidations'] == 0
+
+
+def test_invalidate_drops_the_trackers_of_a_project(tmp_path):
+    tags = [make_tracker(tmp_path, f'cached{i}') for i in range(2)]
+    cache = TrackerCache()
+    for tag in tags:
+        cache.get(str(tmp_path), tag)
+
+    assert cache.invalidate(str(tmp_path), tags[0]) == 1
+    assert cache.invalidate(str(tmp_path)) == 1
+    assert len(cache) == 0 and cache.nbytes() == 0
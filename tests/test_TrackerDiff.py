@@ -0,0 +1,93 @@
+import datetime
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from Constraints import UniqueConstraint
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from data_types import InforecastDataTypes
+
+
+def make_tracker(tmp_path):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), DataColumn(InforecastDataTypes.DATE, 'due'),
+            DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    assert tracker.init('diff', cols, {'project_dir': str(tmp_path)})
+    for i in range(3):
+        tracker.add_row({'WPId': f'W{i}', 'due': datetime.datetime(2022, 1, 1 + i), 'cost': np.float64(i)})
+    return tracker
+
+
+def incoming(tracker):
+    return tracker.data_table.to_dataframe()[tracker.get_cols_list()].copy()
+
+
+def test_date_updates_and_inserts_are_applied(tmp_path):
+    tracker = make_tracker(tmp_path)
+    df = incoming(tracker)
+    df.loc[1, 'due'] = pd.Timestamp(2023, 5, 6)
+    df = pd.concat([df, pd.DataFrame({'WPId': ['W9'], 'due': [pd.Timestamp(2024, 1, 2)], 'cost': [9.]})],
+                   ignore_index=True)
+
+    out = tracker.apply_diff(tracker.diff(df, key='WPId'))
+
+    assert out == {'inserted': 1, 'updated': 1, 'cleared': 0, 'deleted': 0, 'rejected': 0}
+    assert tracker.data_table.get_value(1, 'due') == datetime.datetime(2023, 5, 6)
+    assert tracker.data_table.get_value(3, 'due') == datetime.datetime(2024, 1, 2)
+
+
+def test_blank_cell_clears_the_value(tmp_path):
+    tracker = make_tracker(tmp_path)
+    df = incoming(tracker)
+    df.loc[2, 'cost'] = np.nan
+
+    out = tracker.apply_diff(tracker.diff(df))
+
+    assert out['cleared'] == 1 and out['rejected'] == 0
+    assert tracker.data_table.get_value(2, 'cost') is None
+    change = tracker.get_changes().iloc[-1]
+    assert (change['op'], change['col'], change['new']) == ('update', 'cost', None)
+
+
+def test_invalid_value_rejects_the_whole_batch(tmp_path):
+    tracker = make_tracker(tmp_path)
+    tracker.cols['cost'].set_limit({'min': np.float64(-1), 'max': np.float64(100)})
+    num_changes = tracker.change_table.num_rows()
+    df = incoming(tracker)
+    df.loc[0, 'due'] = pd.Timestamp(2030, 1, 1)
+    df.loc[1, 'cost'] = 1000.
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        out = tracker.apply_diff(tracker.diff(df))
+
+    assert out['rejected'] == 1 and out['updated'] == 0
+    assert tracker.data_table.get_value(0, 'due') == datetime.datetime(2022, 1, 1)
+    assert tracker.change_table.num_rows() == num_changes
+
+
+def test_constraint_violation_undoes_applied_changes(tmp_path):
+    tracker = make_tracker(tmp_path)
+    assert tracker.add_constraint(UniqueConstraint('unique_id', 'WPId'))
+    num_changes = tracker.change_table.num_rows()
+    next_ind_val = tracker.next_ind_val
+    df = incoming(tracker)
+    df.loc[0, 'cost'] = 50.
+    df = pd.concat([df, pd.DataFrame({'WPId': ['W1'], 'due': [pd.NaT], 'cost': [1.]}, index=[10])])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        out = tracker.apply_diff(tracker.diff(df))
+
+    assert out['rejected'] == 1 and out['updated'] == 0 and out['inserted'] == 0
+    assert tracker.data_table.get_value(0, 'cost') == 0.
+    assert tracker.get_num_rows() == 3 and tracker.next_ind_val == next_ind_val
+    assert tracker.change_table.num_rows() == num_changes
+    # the undone value is still indexed by the constraint
+    assert tracker.unique_index('WPId').lookup('W0') == 0
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from TrackerLog import TrackerLog, compact
+from data_types import InforecastDataTypes
+
+
+def make_tracker(tmp_path):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    assert tracker.init('wal', cols, {'project_dir': str(tmp_path)})
+    for i in range(3):
+        tracker.add_row({'WPId': f'W{i}', 'cost': np.float64(i)})
+    tracker.save()
+    return tracker
+
+
+def open_log(tracker_dir):
+    tracker = InforecastTracker()
+    assert tracker.open(tracker_dir)
+    return TrackerLog(tracker)
+
+
+def test_sync_reads_only_the_entries_appended_since(tmp_path):
+    tracker_dir = make_tracker(tmp_path).dir
+    a, b = open_log(tracker_dir), open_log(tracker_dir)
+
+    assert a.amend(0, 'cost', np.float64(10))
+    assert b.sync() == {'applied': 1, 'rejected': 0}
+    assert b.sync() == {'applied': 0, 'rejected': 0}
+    assert list(b._offsets.values()) == [os.path.getsize(b.path)]
+
+    assert b.add({'WPId': 'new', 'cost': np.float64(5)})
+    assert a.sync() == {'applied': 1, 'rejected': 0}
+    assert a.tracker.data_table.get_value(3, 'WPId') == 'new'
+
+
+def test_entries_are_applied_once_across_a_log_rotation(tmp_path):
+    tracker_dir = make_tracker(tmp_path).dir
+    a, b = open_log(tracker_dir), open_log(tracker_dir)
+    assert a.amend(1, 'cost', np.float64(11))
+    b.sync()
+    assert a.amend(2, 'cost', np.float64(12))
+
+    # renamed as by a compaction starting, the new entries go to a new log
+    os.rename(a.path, a.folding_path)
+    assert a.amend(0, 'cost', np.float64(10))
+    # the rest of the folding log and the new log
+    assert b.sync() == {'applied': 2, 'rejected': 0}
+    assert [b.tracker.data_table.get_value(x, 'cost') for x in range(3)] == [10., 11., 12.]
+    assert b.tracker.change_table.num_rows() == a.tracker.change_table.num_rows()
+
+    # the folding log only, the new log is folded by the next compaction
+    assert compact(tracker_dir) == {'applied': 2, 'rejected': 0}
+    assert b.sync() == {'applied': 0, 'rejected': 0}
+    assert a.amend(0, 'cost', np.float64(20))
+    assert b.sync() == {'applied': 1, 'rejected': 0}
+
+
+def test_changes_read_at_a_stale_version_conflict(tmp_path):
+    tracker_dir = make_tracker(tmp_path).dir
+    a, b = open_log(tracker_dir), open_log(tracker_dir)
+    base = b.version()
+
+    assert a.amend(0, 'cost', np.float64(10))
+    # the same cell and the whole row changed after base, another column of the row did not
+    assert not b.amend(0, 'cost', np.float64(20), base=base)
+    assert not b.delete([0], base=base)
+    assert b.amend(0, 'WPId', 'renamed', base=base)
+    assert b.delete([1], base=base)
+
+    assert [x[1] for x in b.conflicts] == [f'row 0, col cost changed after version {base}',
+                                           f'row 0 changed after version {base}']
+    assert a.sync() == {'applied': 2, 'rejected': 2}
+    assert a.tracker.data_table.get_value(0, 'cost') == 10.
+    assert a.tracker.data_table.get_value(0, 'WPId') == 'renamed'
+    assert not a.tracker.data_table.has_index(1)
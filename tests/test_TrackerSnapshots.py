@@ -0,0 +1,75 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from TrackerSnapshots import TrackerSnapshots
+from data_types import InforecastDataTypes
+
+WEEKS = [datetime.datetime(2022, 3, 1), datetime.datetime(2022, 3, 8), datetime.datetime(2022, 3, 15)]
+
+
+def make_tracker(tmp_path):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.STR, 'WPId'), DataColumn(InforecastDataTypes.FLOAT64, 'cost')]
+    assert tracker.init('snapshots', cols, {'project_dir': str(tmp_path)})
+    for i in range(10):
+        tracker.add_row({'WPId': f'W{i}', 'cost': np.float64(i)})
+    return tracker
+
+
+def test_unchanged_chunks_are_shared_between_snapshots(tmp_path):
+    tracker = make_tracker(tmp_path)
+    snapshots = TrackerSnapshots(chunk_rows=4)
+    snapshots.take(tracker, WEEKS[0])
+    # 3 chunks of the index, WPId and cost columns
+    assert snapshots.stats()['chunks'] == 9
+
+    tracker.amend_val(5, 'cost', np.float64(50))
+    snapshots.take(tracker, WEEKS[1])
+
+    stats = snapshots.stats()
+    assert stats['chunks'] == 10
+    assert stats['stored_bytes'] < stats['full_copy_bytes']
+    assert snapshots.history(5, 'cost').tolist() == [5., 50.]
+    assert snapshots.as_of(WEEKS[0])['cost'].tolist() == list(range(10))
+    assert snapshots.aggregate('cost').tolist() == [45., 90.]
+
+
+def test_a_snapshot_replaced_in_its_period_drops_its_chunks(tmp_path):
+    tracker = make_tracker(tmp_path)
+    snapshots = TrackerSnapshots(chunk_rows=4)
+    snapshots.take(tracker, WEEKS[0])
+    tracker.amend_val(0, 'cost', np.float64(100))
+    snapshots.take(tracker, WEEKS[1])
+    tracker.amend_val(0, 'cost', np.float64(200))
+    snapshots.take(tracker, WEEKS[1] + datetime.timedelta(days=1))
+
+    assert len(snapshots) == 2
+    assert snapshots.stats()['chunks'] == 10
+    assert len(snapshots._chunks) == 10
+    assert snapshots.history(0, 'cost').tolist() == [0., 200.]
+
+
+def test_saved_snapshots_keep_sharing_their_chunks(tmp_path):
+    tracker = make_tracker(tmp_path)
+    snapshots = TrackerSnapshots(chunk_rows=4)
+    snapshots.take(tracker, WEEKS[0])
+    tracker.add_row({'WPId': 'new', 'cost': np.float64(1)})
+    snapshots.take(tracker, WEEKS[1])
+    snapshots.save(str(tmp_path), 'snapshots')
+    tracker.amend_val(9, 'cost', np.float64(0))
+    snapshots.take(tracker, WEEKS[2])
+    snapshots.save(str(tmp_path), 'snapshots')
+
+    loaded = TrackerSnapshots(chunk_rows=4)
+    loaded.load(str(tmp_path), 'snapshots', pool=tracker.string_pool)
+
+    assert loaded.stats() == snapshots.stats()
+    assert loaded.history(9, 'cost').tolist() == [9., 9., 0.]
+    assert loaded.as_of(WEEKS[2])['WPId'].tolist()[-1] == 'new'
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from InforecastTracker import InforecastTracker
+from data_types import InforecastDataTypes
+
+
+def test_typed_bool_column_validates(tmp_path):
+    tracker = InforecastTracker()
+    cols = [DataColumn(InforecastDataTypes.BOOL, 'done'), DataColumn(InforecastDataTypes.INT64, 'qty')]
+    assert tracker.init('bools', cols, {'project_dir': str(tmp_path)})
+    for i in range(4):
+        assert tracker.add_row({'done': i % 2 == 0, 'qty': np.int64(i)})
+    tracker.cols['qty'].set_limit({'min': np.int64(-1), 'max': np.int64(2)})
+
+    assert tracker.data_table.get_column('done')[0].dtype == np.bool_
+    assert tracker.validate_all() == {'qty': [2, 3]}
+
+
+def test_column_checks_agree_with_the_validator():
+    col = DataColumn(InforecastDataTypes.STR, 'name')
+    col.set_limit({'max': np.int64(5)})
+    col.set_options(['a', 'bb', 'cccc'])
+
+    for value in ['a', 'cccc', 'zz', 1.5, None]:
+        checks = col.type_isValid(value) and col.limit_isValid(value) and col.option_isValid(value)
+        assert checks == col.validate(value)
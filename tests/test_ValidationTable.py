@@ -0,0 +1,54 @@
+import datetime
+import os
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'may_july22_relevant'))
+
+from DataColumn import DataColumn
+from ValidationTable import InforecastValidationTable
+from data_types import InforecastDataTypes
+
+
+def described(col: DataColumn):
+    return col.get_name(), col.get_type(), col.get_limit(), col.get_pattern(), col.get_options()
+
+
+def test_columns_are_loaded_back_from_the_saved_table(tmp_path):
+    name = DataColumn(InforecastDataTypes.STR, 'WP name')
+    name.set_limit({'max': np.int64(20)})
+    name.set_pattern('W[0-9]+')
+    assert name.set_options(['W1', 'W2'])
+    qty = DataColumn(InforecastDataTypes.INT64, 'qty')
+    qty.set_limit({'min': np.int64(0), 'max': np.int64(1000)})
+    assert qty.set_options([np.int64(1), np.int64(10), np.int64(100)])
+    cost = DataColumn(InforecastDataTypes.FLOAT64, 'cost')
+    cost.set_limit({'min': np.float64(-1.5), 'max': np.float64(1e6)})
+    due = DataColumn(InforecastDataTypes.DATE, 'due')
+    assert due.set_options([datetime.datetime(2022, 1, 1), datetime.datetime(2022, 6, 30)])
+    cols = {x.get_tag(): x for x in [name, qty, cost, due, DataColumn(InforecastDataTypes.BOOL, 'done')]}
+
+    table = InforecastValidationTable()
+    assert table.init(cols)
+    table.save_table(str(tmp_path), 'cols_validation')
+    loaded = InforecastValidationTable().load_columns(str(tmp_path), 'cols_validation')
+
+    assert list(loaded) == list(cols)
+    for tag in cols:
+        assert described(loaded[tag]) == described(cols[tag])
+    assert all(type(x) == np.int64 for x in loaded['qty'].get_options())
+    assert all(type(x) == datetime.datetime for x in loaded['due'].get_options())
+    assert not loaded['qty'].validate(np.int64(5)) and loaded['qty'].validate(np.int64(10))
+
+
+def test_an_unknown_type_is_not_loaded(tmp_path):
+    table = InforecastValidationTable()
+    assert table.init({'qty': DataColumn(InforecastDataTypes.INT64, 'qty')})
+    table._table.loc[1, 'qty'] = 'DECIMAL'
+    table.save_table(str(tmp_path), 'cols_validation')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert InforecastValidationTable().load_columns(str(tmp_path), 'cols_validation') is None